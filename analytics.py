@@ -0,0 +1,149 @@
+"""Spatial analytics over the resident dataset, in SVY21 metres.
+
+Every query runs on the dataset's projected copy (``Dataset.projected``):
+distances, areas and centroids are in metres rather than degrees, and the
+work is done with vectorized shapely/NumPy calls over the rows the spatial
+index returns, never a Python loop over features.
+"""
+
+from typing import List, Optional
+
+import numpy as np
+import shapely
+
+from cache import LRUCache
+from dataset import Dataset, from_svy21
+
+# STRtrees over one fclass selection, for nearest-neighbour joins
+SUBSET_TREE_ENTRIES = 32  # per layer
+
+
+def selection_key(fclasses: Optional[List[str]]):
+    return None if fclasses is None else tuple(sorted(set(fclasses)))
+
+
+def subset_tree(dataset: Dataset, fclasses: Optional[List[str]], trees: LRUCache):
+    """(rows, STRtree over those rows' projected geometries) for a selection."""
+    trees.ensure_version(dataset.version)
+    key = selection_key(fclasses)
+    entry = trees.get(key)
+    if entry is None:
+        rows = dataset.rows_for(fclasses)
+        entry = (rows, shapely.STRtree(dataset.projected.geometries[rows]))
+        trees.put(key, entry, dataset.version)
+    return entry
+
+
+def describe(dataset: Dataset, rows: np.ndarray) -> List[dict]:
+    """Identifying properties plus projected centroid and area per row."""
+    lon, lat = from_svy21(*dataset.projected.centroids[rows].T) if len(rows) else ([], [])
+    codes = dataset.fclass_codes[rows]
+    areas = dataset.projected.areas[rows]
+    return [
+        {
+            "osm_id": str(dataset.osm_ids[r]),
+            "fclass": dataset.fclasses[c] if c >= 0 else None,
+            "name": str(dataset.names[r]),
+            "centroid": [round(float(y), 6), round(float(x), 6)],
+            "area_m2": round(float(a), 1),
+        }
+        for r, c, a, x, y in zip(rows, codes, areas, lon, lat)
+    ]
+
+
+def within(
+    dataset: Dataset,
+    lon: float,
+    lat: float,
+    radius_m: float,
+    fclasses: Optional[List[str]] = None,
+    limit: int = 100,
+) -> dict:
+    """Facilities within ``radius_m`` metres of a point, nearest first."""
+    rows, dist = dataset.query_radius(lon, lat, radius_m, fclasses)
+    codes, counts = np.unique(dataset.fclass_codes[rows], return_counts=True)
+    features = describe(dataset, rows[:limit])
+    for feature, d in zip(features, dist[:limit]):
+        feature["distance_m"] = round(float(d), 1)
+    return {
+        "count": len(rows),
+        "by_fclass": {dataset.fclasses[c]: int(n) for c, n in zip(codes, counts) if c >= 0},
+        "features": features,
+    }
+
+
+def nearest_pairs(
+    dataset: Dataset,
+    from_fclasses: Optional[List[str]],
+    to_fclasses: Optional[List[str]],
+    trees: LRUCache,
+    limit: int = 100,
+) -> dict:
+    """For every facility in ``from_fclasses``, its nearest one in ``to_fclasses``.
+
+    One bulk STRtree nearest query over all sources; a facility is never
+    paired with itself when the two selections overlap. ``trees`` caches the
+    target trees and needs to be the dataset's own.
+    """
+    source_rows = dataset.rows_for(from_fclasses)
+    target_rows, tree = subset_tree(dataset, to_fclasses, trees)
+    if len(source_rows) == 0 or len(target_rows) == 0:
+        return {"count": 0, "distance_m": None, "pairs": []}
+    (src, dst), dist = tree.query_nearest(
+        dataset.projected.geometries[source_rows], return_distance=True, exclusive=True, all_matches=False
+    )
+    src_rows, dst_rows = source_rows[src], target_rows[dst]
+    order = np.argsort(dist, kind="stable")
+    pairs = [
+        {"from": a, "to": b, "distance_m": round(float(d), 1)}
+        for a, b, d in zip(
+            describe(dataset, src_rows[order][:limit]),
+            describe(dataset, dst_rows[order][:limit]),
+            dist[order][:limit],
+        )
+    ]
+    return {
+        "count": len(src_rows),
+        "distance_m": {
+            "min": round(float(dist.min()), 1),
+            "median": round(float(np.median(dist)), 1),
+            "mean": round(float(dist.mean()), 1),
+            "max": round(float(dist.max()), 1),
+        },
+        "pairs": pairs,
+    }
+
+
+def grid_density(
+    dataset: Dataset, cell_m: float = 1000.0, fclasses: Optional[List[str]] = None, top: int = 20
+) -> dict:
+    """Facility counts per square grid cell of ``cell_m`` metres, densest first.
+
+    Facilities are binned by their projected centroid. Cells are aligned to
+    the SVY21 origin, so the same cell size always gives the same grid.
+    """
+    rows = dataset.rows_for(fclasses)
+    xy = dataset.projected.centroids[rows]
+    xy = xy[~np.isnan(xy).any(axis=1)]
+    ij = np.floor(xy / cell_m).astype(np.int64)
+    # one int64 key per cell: a 1-D unique is far cheaper than unique rows
+    keys, counts = np.unique((ij[:, 0] << 32) + (ij[:, 1] & 0xFFFFFFFF), return_counts=True)
+    order = np.argsort(-counts, kind="stable")[:top]
+    cells = np.column_stack((keys[order] >> 32, (keys[order] & 0xFFFFFFFF).astype(np.int32)))
+    centers = (cells + 0.5) * cell_m
+    lon, lat = from_svy21(centers[:, 0], centers[:, 1]) if len(order) else ([], [])
+    km2 = (cell_m / 1000) ** 2
+    return {
+        "cell_m": cell_m,
+        "facilities": int(len(xy)),
+        "occupied_cells": int(len(keys)),
+        "cells": [
+            {
+                "center": [round(float(y), 6), round(float(x), 6)],
+                "count": int(n),
+                "per_km2": round(float(n) / km2, 2),
+            }
+            for n, x, y in zip(counts[order], lon, lat)
+        ],
+    }
+
@@ -1,23 +1,330 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Literal, Optional, Union
 import redis
+import redis.asyncio as aioredis
+import asyncio
 import json
+import os
+import time
 import uvicorn
-from pathlib import Path
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
 
-app = FastAPI(title="Streamlit Health Facilities API")
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-DATA_PATH = (Path(__file__).parent / "data" / "health_sg.geojson").resolve()
+import analytics
+from coalesce import Coalescer
+import export
+from layers import LayerRegistry, load_layer_specs
+import metrics
+from state_backend import (
+    ANNOUNCE_DATASET_LUA,
+    DATASET_CHANNEL,
+    MemoryStateBackend,
+    RedisStateBackend,
+    announcement,
+)
+import tiles
+import workers
+from dataset import watched_files
+from watcher import file_signature
 
-def notify_state_change():
-    """Publish state change notification to Redis"""
+registry = metrics.Registry()
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by method, route and status", ["method", "route", "status"]
+)
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route", ["method", "route"]
+)
+redis_latency = registry.histogram(
+    "redis_command_duration_seconds", "Redis command round-trip latency by command", ["command"]
+)
+redis_errors = registry.counter("redis_command_errors_total", "Redis commands that raised, by command", ["command"])
+state_publish_receivers = registry.histogram(
+    "state_publish_receivers",
+    "Subscribers that received each state change PUBLISH",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 1000),
+)
+state_updates = registry.counter("state_updates_total", "State updates applied")
+state_updates_merged = registry.counter(
+    "state_updates_merged_total", "Map updates merged into another's write by the coalescing window"
+)
+state_cache_reads = registry.counter(
+    "state_cache_reads_total", "State reads by whether this process's cache answered them", ["result"]
+)
+dataset_load_seconds = registry.histogram(
+    "dataset_load_duration_seconds",
+    "Time to load or reload a layer's dataset",
+    ["layer"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+dataset_features = registry.gauge("dataset_features", "Features in each resident layer", ["layer"])
+dataset_changed_features = registry.counter(
+    "dataset_changed_features_total", "Features added, changed or removed by dataset reloads", ["layer", "kind"]
+)
+layer_memory = registry.gauge("layer_memory_bytes", "Estimated memory of each loaded layer, as of its last load", ["layer"])
+layer_evictions = registry.counter("layer_evictions_total", "Layers dropped to stay within LAYER_MEMORY_MB", ["layer"])
+event_loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop woke a task sleeping for a fixed interval"
+)
+event_loop_lag_last = registry.gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+def record_dataset_load(layer, dataset, seconds: float):
+    dataset_load_seconds.observe(seconds, layer.name)
+    dataset_features.set(len(dataset), layer.name)
+    layer_memory.set(layer.measure(), layer.name)
+
+def record_layer_eviction(layer):
+    layer_evictions.inc(layer.name)
+    dataset_features.set(0, layer.name)
+    layer_memory.set(0, layer.name)
+
+def dataset_changed(layer, previous, dataset, diff):
+    """Carry a layer's caches over to its new dataset version and announce it
+
+    Runs on the file watcher's thread once the new version is live.
+    """
+    if diff is not None:
+        tiles.retain_tiles(diff, layer.caches["tiles"])
+        for kind in ("added", "changed", "removed"):
+            dataset_changed_features.inc(layer.name, kind, amount=getattr(diff, kind))
+        summary = diff.summary()
+    else:
+        summary = {"dataset_version": dataset.version, "previous_version": previous.version}
+    summary["layer"] = layer.name
+    summary["features"] = len(dataset)
+    if event_loop is not None:
+        asyncio.run_coroutine_threadsafe(announce_dataset(summary), event_loop)
+    else:
+        pending_announcements.append(summary)  # supervisor: sent once the workers serve it
+
+# Reload data files from a background thread when they change; "0" checks
+# them on requests instead
+DATASET_WATCH = os.environ.get("DATASET_WATCH", "1") != "0"
+# Processes serving requests ("auto": one per core). With more than one, a
+# supervisor loads every layer before forking them so they share it, and it
+# checks the data files for them (see workers.py)
+API_WORKERS = os.environ.get("API_WORKERS", "1")
+API_WORKERS = (os.cpu_count() or 1) if API_WORKERS == "auto" else int(API_WORKERS)
+# Estimated memory the loaded layers may use before the least recently used
+# ones are dropped; the layer in use always stays
+LAYER_MEMORY_MB = float(os.environ.get("LAYER_MEMORY_MB", "2048"))
+# Encoded tiles each layer keeps; counted in its memory against LAYER_MEMORY_MB
+TILE_CACHE_MB = float(os.environ.get("TILE_CACHE_MB", "256"))
+layer_registry = LayerRegistry(
+    load_layer_specs(),
+    max_bytes=int(LAYER_MEMORY_MB * 2**20),
+    caches={
+        "tiles": {"max_entries": tiles.TILE_CACHE_ENTRIES, "max_bytes": int(TILE_CACHE_MB * 2**20), "sizeof": len},
+        "subset_trees": {"max_entries": analytics.SUBSET_TREE_ENTRIES},
+    },
+    on_load=record_dataset_load,
+    on_change=dataset_changed,
+    on_evict=record_layer_eviction,
+    check_interval=None if API_WORKERS > 1 else 1.0,
+)
+# The server's loop, for work scheduled from other threads
+event_loop: Optional[asyncio.AbstractEventLoop] = None
+# Dataset changes loaded by the worker supervisor, which has no loop
+pending_announcements: List[dict] = []
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the default layer at startup so the first request doesn't pay for it
+
+    Other layers load when they are first asked for.
+    """
+    global event_loop
+    event_loop = asyncio.get_running_loop()
     try:
-        redis_client.publish("app_state_changes", "state_updated")
+        layer_registry.get()
+    except Exception:
+        pass  # endpoints will report the failure
+    if DATASET_WATCH and API_WORKERS <= 1:
+        layer_registry.watch()
+    try:
+        await state_backend.prepare()
+    except redis.RedisError:
+        pass  # /health reports Redis as disconnected
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag(event_loop_lag, event_loop_lag_last))
+    yield
+    lag_monitor.cancel()
+    layer_registry.stop_watching()
+    try:
+        await state_coalescer.close()
     except redis.RedisError:
-        pass  # Don't fail API calls if pub/sub fails
+        pass
+    await state_backend.close()
+    await redis_client.aclose()
+    await redis_pool.disconnect()
+    await pubsub_client.aclose()
+
+class DatasetVersionMiddleware:
+    """Stamp every response with the resident version of the requested layer
+
+    The layer is the request's ``layer`` query parameter, or the default one.
+    Clients that cache anything derived from a layer (such as the fclass
+    catalogs in the MCP servers) notice a reload from whatever response they
+    get next, without polling. Nothing is stamped while the layer isn't loaded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        layer = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("layer", [None])[0]
+
+        async def send_with_version(message):
+            version = layer_registry.version(layer)
+            if message["type"] == "http.response.start" and version:
+                message["headers"] = [*message.get("headers", []), (b"x-dataset-version", version.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_version)
+
+app = FastAPI(title="Streamlit Health Facilities API", lifespan=lifespan)
+# The map in the browser fetches vector tiles straight from this server
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET"])
+app.add_middleware(DatasetVersionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware, requests=http_requests, latency=http_latency)
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "64"))
+REDIS_TIMEOUT = float(os.environ.get("REDIS_TIMEOUT", "2.0"))
+
+# One pool for the whole process. Requests beyond max_connections wait (up to
+# REDIS_TIMEOUT) for a free connection instead of opening new sockets, so a
+# burst of clients can't exhaust Redis' connection limit.
+redis_pool = aioredis.BlockingConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT,
+    socket_connect_timeout=REDIS_TIMEOUT,
+    decode_responses=True,
+)
+class InstrumentedRedis(aioredis.Redis):
+    """Redis client that times every command it sends"""
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except redis.RedisError:
+            redis_errors.inc(command)
+            raise
+        finally:
+            redis_latency.observe(time.perf_counter() - start, command)
+
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
+# /events subscribers hold their connection for as long as the stream is open,
+# so they get their own pool rather than starving request handlers
+pubsub_client = aioredis.Redis.from_url(
+    REDIS_URL, socket_connect_timeout=REDIS_TIMEOUT, decode_responses=True
+)
+
+# Named sessions get their own hash and channel, so a write only wakes the
+# clients watching that session. They expire after this long without a read,
+# a write or a connected /events stream; the shared namespace never does.
+STATE_TTL_SECONDS = int(os.environ.get("STATE_TTL_SECONDS", str(24 * 3600)))
+SessionQuery = Annotated[
+    Optional[str],
+    Query(pattern=r"^[A-Za-z0-9_-]{1,64}$", description="State namespace; omit for the shared one"),
+]
+LayerQuery = Annotated[
+    Optional[str],
+    Query(pattern=r"^[A-Za-z0-9_-]{1,64}$", description="Layer name from /layers; omit for the default"),
+]
+# A null layer is the default one
+STATE_DEFAULTS = {"layer": None, "selected_fclasses": [], "map_center": None, "zoom_level": 12}
+SSE_KEEPALIVE_SECONDS = 15
+# Map updates to one session within this window of its last write are merged
+# into a single write and notification at the window's end; 0 disables.
+STATE_COALESCE_MS = float(os.environ.get("STATE_COALESCE_MS", "100"))
+
+# "redis" keeps the state in Redis, shared by every API process, with a read
+# cache in each (STATE_CACHE=0 turns it off); "memory" keeps it in this
+# process, for a single-process deployment without Redis
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "redis")
+STATE_CACHE = os.environ.get("STATE_CACHE", "1") != "0"
+if STATE_BACKEND == "redis":
+    state_backend = RedisStateBackend(
+        redis_client, pubsub_client, STATE_DEFAULTS, STATE_TTL_SECONDS,
+        cache=STATE_CACHE, on_read=state_cache_reads.inc,
+    )
+elif STATE_BACKEND == "memory":
+    state_backend = MemoryStateBackend(STATE_DEFAULTS, STATE_TTL_SECONDS)
+else:
+    raise ValueError(f"STATE_BACKEND must be redis or memory, not {STATE_BACKEND!r}")
+
+async def announce_dataset(summary: dict):
+    """Publish a layer's dataset change to every /events stream"""
+    try:
+        await state_backend.announce_dataset(summary)
+    except redis.RedisError:
+        pass  # clients still see the new version in X-Dataset-Version
+
+def state_etag(version: int) -> str:
+    return f'"{version}"'
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Expected version from an If-Match header; None when absent or ``*``."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.split(",")[0].strip().removeprefix("W/").strip('"')
+    try:
+        return int(tag)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a state ETag")
+
+async def update_state(
+    fields: dict,
+    reset: bool = False,
+    expected_version: Optional[int] = None,
+    session: Optional[str] = None,
+) -> int:
+    """Atomically apply field updates and publish; returns the new version
+
+    ``reset`` drops every field first, so unspecified fields fall back to
+    their defaults. Raises 412 if ``expected_version`` is not current. A map
+    update held by the coalescing window is written first.
+    """
+    async with state_coalescer.exclusive(session):
+        return await write_state(fields, reset, expected_version, session)
+
+async def write_state(
+    fields: dict,
+    reset: bool = False,
+    expected_version: Optional[int] = None,
+    session: Optional[str] = None,
+) -> int:
+    """``update_state`` without ordering against a held map update"""
+    applied, version, receivers = await state_backend.update(fields, reset, expected_version, session)
+    if not applied:
+        raise HTTPException(
+            status_code=412,
+            detail={"message": "State version mismatch", "version": version},
+            headers={"ETag": state_etag(version)},
+        )
+    state_updates.inc()
+    state_publish_receivers.observe(receivers)
+    return version
+
+# Panning the map sends a burst of /map updates; only the latest of each burst
+# needs to reach Redis and the other clients
+state_coalescer = Coalescer(
+    STATE_COALESCE_MS / 1000,
+    lambda session, fields: write_state(fields, session=session),
+    on_merge=state_updates_merged.inc,
+)
 
 class AppState(BaseModel):
+    layer: Optional[str] = None
     selected_fclasses: List[str]
     map_center: Optional[List[float]] = None
     zoom_level: Optional[int] = 12
@@ -26,105 +333,611 @@ class MapUpdate(BaseModel):
     center: List[float]
     zoom: int
 
-def load_fclasses() -> List[str]:
-    """Load available fclass values from GeoJSON data file."""
-    try:
-        with open(DATA_PATH, "r", encoding="utf-8") as f:
-            gj = json.load(f)
-        values = []
-        for feat in gj.get("features", []):
-            props = feat.get("properties", {}) or {}
-            val = props.get("fclass")
-            if isinstance(val, str):
-                values.append(val)
-        # unique, stable order
-        seen = set()
-        uniq = []
-        for v in values:
-            if v not in seen:
-                seen.add(v)
-                uniq.append(v)
-        return uniq
-    except Exception as e:
+class FiltersOperation(BaseModel):
+    op: Literal["filters"]
+    fclasses: List[str]
+    layer: Optional[str] = None  # switch to this layer along with its fclasses
+
+class MapOperation(BaseModel):
+    op: Literal["map"]
+    center: List[float]
+    zoom: int
+
+class ResetOperation(BaseModel):
+    op: Literal["reset"]
+
+StateOperation = Annotated[
+    Union[FiltersOperation, MapOperation, ResetOperation], Field(discriminator="op")
+]
+
+class StateBatch(BaseModel):
+    operations: List[StateOperation] = Field(min_length=1)
+
+def compile_operations(operations: List[StateOperation]) -> tuple[dict, bool]:
+    """Fold an ordered list of operations into one (fields, reset) update
+
+    A reset discards whatever earlier operations set, so only the fields
+    written after the last reset survive.
+    """
+    fields, reset = {}, False
+    for operation in operations:
+        if isinstance(operation, ResetOperation):
+            fields, reset = {}, True
+        elif isinstance(operation, FiltersOperation):
+            if operation.layer is not None:
+                fields["layer"] = operation.layer
+            fields["selected_fclasses"] = operation.fclasses
+        else:
+            fields["map_center"] = operation.center
+            fields["zoom_level"] = operation.zoom
+    return fields, reset
+
+def check_layer(layer: Optional[str]) -> str:
+    """The layer's name, or the default's for None; 404 if it isn't declared."""
+    try:
+        return layer_registry.resolve(layer)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown layer {layer!r}")
+
+def load_fclasses(layer: Optional[str] = None) -> List[str]:
+    """Return available fclass values from a layer's resident dataset."""
+    check_layer(layer)
+    try:
+        return list(layer_registry.get(layer).fclasses)
+    except Exception:
         # On failure, return empty list; endpoints will handle as error
         return []
 
+def check_fclasses(fclasses: List[str], layer: Optional[str] = None):
+    """422 naming the values ``layer`` doesn't have; skipped if it can't be loaded."""
+    allowed = load_fclasses(layer)
+    invalid = sorted(set(fclasses) - set(allowed)) if allowed else []
+    if invalid:
+        raise HTTPException(
+            status_code=422,
+            detail={"message": "Some fclasses are not recognized", "invalid": invalid, "allowed": sorted(allowed)},
+        )
+
+async def shown_layer(session: Optional[str]) -> Optional[str]:
+    """The layer a session's map shows (None: the default), from the state read cache"""
+    try:
+        return (await state_backend.read(session))["layer"]
+    except redis.RedisError:
+        raise HTTPException(status_code=500, detail="Redis connection error")
+
+def parse_fclasses(fclasses: Optional[List[str]]) -> Optional[List[str]]:
+    """Accept both repeated (?fclasses=a&fclasses=b) and comma-separated values."""
+    if not fclasses:
+        return None
+    return [v for item in fclasses for v in item.split(",") if v]
+
+def parse_bbox(bbox: str):
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minx,miny,maxx,maxy")
+    return minx, miny, maxx, maxy
+
+def get_layer(layer: Optional[str] = None):
+    """(layer, its current dataset), loading it on first use"""
+    entry = layer_registry.layer(check_layer(layer))
+    try:
+        return entry, layer_registry.get(entry.name)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Failed to load data file")
+
+def get_dataset(layer: Optional[str] = None):
+    return get_layer(layer)[1]
+
 @app.get("/state")
-async def get_state():
-    """Get current app state"""
+async def get_state(request: Request, response: Response, session: SessionQuery = None):
+    """Get current app state
+
+    The ETag is the state version; a matching If-None-Match gets a 304.
+    """
     try:
-        state_json = redis_client.get("app_state")
-        if state_json:
-            return json.loads(state_json)
-        return {"selected_fclasses": [], "map_center": None, "zoom_level": 12}
+        state = await state_backend.read(session)
     except redis.RedisError:
         raise HTTPException(status_code=500, detail="Redis connection error")
+    etag = state_etag(state["version"])
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return state
+
+@app.get("/layers")
+async def get_layers():
+    """List the declared layers, the default first, and which are loaded.
+
+    Loaded layers also report their version, size and estimated memory.
+    Listing never loads a layer.
+    """
+    loaded = {layer.name: layer for layer in layer_registry.loaded()}
+    result = []
+    for name, spec in layer_registry.specs.items():
+        entry = {"name": name, "title": spec.title, "default": name == layer_registry.default, "loaded": False}
+        layer = loaded.get(name)
+        dataset = layer.engine.loaded if layer is not None else None
+        if dataset is not None:
+            entry.update(loaded=True, dataset_version=dataset.version, features=len(dataset), memory_bytes=layer.nbytes)
+        result.append(entry)
+    return {"layers": result, "memory_budget_bytes": layer_registry.max_bytes}
 
 @app.get("/fclasses")
-async def get_fclasses():
-    """Return the list of available facility classes from the dataset."""
-    fclasses = load_fclasses()
+async def get_fclasses(layer: LayerQuery = None):
+    """Return the list of available facility classes in a layer."""
+    fclasses = load_fclasses(layer)
     if not fclasses:
         raise HTTPException(status_code=500, detail="Failed to load fclasses from data file")
-    return {"fclasses": fclasses}
+    return {"layer": check_layer(layer), "fclasses": fclasses, "dataset_version": layer_registry.version(layer)}
+
+@app.get("/dataset")
+async def get_dataset_info(layer: LayerQuery = None):
+    """Report the version and size of a layer's resident dataset."""
+    dataset = get_dataset(layer)
+    return {
+        "layer": check_layer(layer),
+        "version": dataset.version,
+        "features": len(dataset),
+        "fclasses": {name: len(rows) for name, rows in dataset.fclass_rows.items()},
+        "loaded_at": dataset.loaded_at,
+    }
+
+# Handlers that work on geometry are plain functions: Starlette runs them in
+# its threadpool, so a slow query or tile render doesn't hold up the event
+# loop (SSE keepalives, state reads and writes)
+@app.get("/extent")
+def get_extent(
+    fclasses: Optional[List[str]] = Query(None),
+    width: int = Query(800, ge=64, le=8192, description="map width in px, for the suggested zoom"),
+    height: int = Query(500, ge=64, le=8192, description="map height in px, for the suggested zoom"),
+    layer: LayerQuery = None,
+):
+    """Bounds, centre and a fitting zoom for some fclasses, without any geometry.
+
+    ``bounds`` is minx,miny,maxx,maxy in lon/lat and ``center`` is [lat, lon],
+    the mean facility centroid.
+    """
+    dataset = get_dataset(layer)
+    extent = dataset.selection_extent(parse_fclasses(fclasses))
+    if extent is None:
+        raise HTTPException(status_code=404, detail="No facilities match the selection")
+    return {
+        "dataset_version": dataset.version,
+        **extent,
+        "zoom": tiles.fit_zoom(extent["bounds"], width, height),
+    }
+
+@app.get("/features")
+def get_features(
+    bbox: str = Query(..., description="minx,miny,maxx,maxy in lon/lat"),
+    fclasses: Optional[List[str]] = Query(None),
+    geometry: bool = True,
+    zoom: Optional[int] = Query(None, ge=0, le=22, description="simplify geometry for this zoom"),
+    limit: int = Query(1000, ge=1, le=10000),
+    layer: LayerQuery = None,
+):
+    """Return features intersecting a viewport bounding box."""
+    bbox = parse_bbox(bbox)
+    dataset = get_dataset(layer)
+    rows = dataset.query_bbox(bbox, parse_fclasses(fclasses))
+    return {
+        "type": "FeatureCollection",
+        "dataset_version": dataset.version,
+        "total": len(rows),
+        "features": [dataset.feature(r, geometry, zoom) for r in rows[:limit]],
+    }
+
+@app.get("/features/export")
+async def export_features(
+    request: Request,
+    bbox: Optional[str] = Query(None, description="minx,miny,maxx,maxy in lon/lat; whole layer if omitted"),
+    fclasses: Optional[List[str]] = Query(None),
+    format: Literal["ndjson", "geojson"] = "ndjson",
+    geometry: bool = True,
+    zoom: Optional[int] = Query(None, ge=0, le=22, description="simplify geometry for this zoom"),
+    limit: Optional[int] = Query(None, ge=1, description="page size; everything after the cursor if omitted"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    layer: LayerQuery = None,
+):
+    """Stream matching features as GeoJSON lines or a FeatureCollection
+
+    Features are encoded in batches as the response is sent, so memory does
+    not grow with the result. With ``limit`` the result is paged: the next
+    page's cursor comes in the ``X-Next-Cursor`` header (and a ``Link``
+    header), or as ``next_cursor`` in a FeatureCollection. Cursors are only
+    valid for the dataset version that issued them (410 afterwards).
+    """
+    dataset = get_dataset(layer)
+    fclasses = parse_fclasses(fclasses)
+    if bbox is not None:
+        rows = dataset.query_bbox(parse_bbox(bbox), fclasses)
+    else:
+        rows = dataset.rows_for(fclasses)
+    total = len(rows)
+    try:
+        rows, next_cursor = export.page(rows, dataset.version, cursor, limit)
+    except LookupError:
+        raise HTTPException(status_code=410, detail="Dataset changed since the cursor was issued")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    encoding = export.negotiate_encoding(request.headers.get("accept-encoding"))
+    headers = {"X-Total-Count": str(total), "Vary": "Accept-Encoding"}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+
+    features = export.encode_features(dataset, rows, geometry, zoom)
+    if format == "ndjson":
+        body = export.ndjson(features)
+    else:
+        body = export.feature_collection(
+            features, {"dataset_version": dataset.version, "total": total, "next_cursor": next_cursor}
+        )
+    # a plain generator: Starlette runs it in the threadpool, off the event loop
+    return StreamingResponse(
+        export.compress(body, encoding), media_type=export.MEDIA_TYPES[format], headers=headers
+    )
+
+@app.get("/features/within")
+def get_features_within(
+    lat: float,
+    lon: float,
+    radius_m: float = Query(..., gt=0),
+    fclasses: Optional[List[str]] = Query(None),
+    geometry: bool = False,
+    zoom: Optional[int] = Query(None, ge=0, le=22),
+    limit: int = Query(1000, ge=1, le=10000),
+    layer: LayerQuery = None,
+):
+    """Return features within a radius (metres) of a point, nearest first."""
+    dataset = get_dataset(layer)
+    rows, dist = dataset.query_radius(lon, lat, radius_m, parse_fclasses(fclasses))
+    features = []
+    for r, d in zip(rows[:limit], dist[:limit]):
+        feat = dataset.feature(r, geometry, zoom)
+        feat["properties"]["distance_m"] = round(float(d), 1)
+        features.append(feat)
+    return {
+        "type": "FeatureCollection",
+        "dataset_version": dataset.version,
+        "total": len(rows),
+        "features": features,
+    }
+
+@app.get("/nearest")
+def get_nearest(
+    lat: float,
+    lon: float,
+    k: int = Query(1, ge=1, le=100),
+    fclasses: Optional[List[str]] = Query(None),
+    geometry: bool = False,
+    zoom: Optional[int] = Query(None, ge=0, le=22),
+    layer: LayerQuery = None,
+):
+    """Return the k features nearest to a point, nearest first."""
+    dataset = get_dataset(layer)
+    rows, dist = dataset.nearest(lon, lat, k, parse_fclasses(fclasses))
+    features = []
+    for r, d in zip(rows, dist):
+        feat = dataset.feature(r, geometry, zoom)
+        feat["properties"]["distance_m"] = round(float(d), 1)
+        features.append(feat)
+    return {
+        "type": "FeatureCollection",
+        "dataset_version": dataset.version,
+        "features": features,
+    }
+
+@app.get("/analytics/within")
+def get_analytics_within(
+    lat: float,
+    lon: float,
+    radius_m: float = Query(..., gt=0, le=100_000),
+    fclasses: Optional[List[str]] = Query(None),
+    limit: int = Query(100, ge=0, le=10000),
+    layer: LayerQuery = None,
+):
+    """Count and list facilities within a radius (metres, SVY21) of a point."""
+    dataset = get_dataset(layer)
+    result = analytics.within(dataset, lon, lat, radius_m, parse_fclasses(fclasses), limit)
+    return {"dataset_version": dataset.version, **result}
+
+@app.get("/analytics/nearest")
+def get_analytics_nearest(
+    from_fclasses: Optional[List[str]] = Query(None),
+    to_fclasses: Optional[List[str]] = Query(None),
+    limit: int = Query(100, ge=0, le=10000),
+    layer: LayerQuery = None,
+):
+    """Nearest ``to_fclasses`` facility to each ``from_fclasses`` facility, closest pairs first."""
+    entry, dataset = get_layer(layer)
+    result = analytics.nearest_pairs(
+        dataset, parse_fclasses(from_fclasses), parse_fclasses(to_fclasses), entry.caches["subset_trees"], limit
+    )
+    return {"dataset_version": dataset.version, **result}
+
+@app.get("/analytics/density")
+def get_analytics_density(
+    cell_m: float = Query(1000, ge=100, le=50_000),
+    fclasses: Optional[List[str]] = Query(None),
+    top: int = Query(20, ge=1, le=1000),
+    layer: LayerQuery = None,
+):
+    """Facilities per square grid cell of ``cell_m`` metres (SVY21), densest cells first."""
+    dataset = get_dataset(layer)
+    result = analytics.grid_density(dataset, cell_m, parse_fclasses(fclasses), top)
+    return {"dataset_version": dataset.version, **result}
+
+@app.get("/tiles/{z}/{x}/{y}.mvt")
+def get_tile(
+    z: int, x: int, y: int, fclasses: Optional[List[str]] = Query(None), layer: LayerQuery = None
+):
+    """Return one Mapbox Vector Tile of a layer, optionally restricted to some fclasses."""
+    if not 0 <= z <= tiles.MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    entry, dataset = get_layer(layer)
+    content = tiles.get_tile(dataset, z, x, y, entry.caches["tiles"], parse_fclasses(fclasses))
+    return Response(
+        content=content,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"ETag": f'"{dataset.version}"', "Cache-Control": "public, max-age=60"},
+    )
 
 @app.post("/state")
-async def set_state(state: AppState):
+async def set_state(
+    state: AppState,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    session: SessionQuery = None,
+):
     """Set complete app state"""
+    if state.layer is not None:
+        check_layer(state.layer)
+    check_fclasses(state.selected_fclasses, state.layer)
     try:
-        redis_client.set("app_state", state.model_dump_json())
-        notify_state_change()
-        return {"status": "success", "state": state.model_dump()}
+        version = await update_state(
+            state.model_dump(), reset=True, expected_version=parse_if_match(if_match), session=session
+        )
+        response.headers["ETag"] = state_etag(version)
+        return {"status": "success", "state": state.model_dump(), "version": version}
     except redis.RedisError:
         raise HTTPException(status_code=500, detail="Redis connection error")
 
 @app.post("/filters")
-async def set_filters(fclasses: List[str]):
-    """Set selected facility classes"""
-    try:
-        current_state = await get_state()
-        current_state["selected_fclasses"] = fclasses
-        redis_client.set("app_state", json.dumps(current_state))
-        notify_state_change()
-        return {"status": "success", "selected_fclasses": fclasses}
+async def set_filters(
+    fclasses: List[str],
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    session: SessionQuery = None,
+    layer: LayerQuery = None,
+):
+    """Set selected facility classes, switching the map to ``layer`` if given
+
+    The values must belong to that layer, or to the one the session shows;
+    a 422 lists the ones that don't.
+    """
+    fields = {"selected_fclasses": fclasses}
+    if layer is not None:
+        fields["layer"] = check_layer(layer)
+    if fclasses:
+        check_fclasses(fclasses, layer if layer is not None else await shown_layer(session))
+    try:
+        version = await update_state(fields, expected_version=parse_if_match(if_match), session=session)
+        response.headers["ETag"] = state_etag(version)
+        return {"status": "success", **fields, "version": version}
     except redis.RedisError:
         raise HTTPException(status_code=500, detail="Redis connection error")
 
 @app.post("/map")
-async def update_map(map_update: MapUpdate):
-    """Update map center and zoom"""
-    try:
-        current_state = await get_state()
-        current_state["map_center"] = map_update.center
-        current_state["zoom_level"] = map_update.zoom
-        redis_client.set("app_state", json.dumps(current_state))
-        notify_state_change()
-        return {"status": "success", "map": map_update.model_dump()}
+async def update_map(
+    map_update: MapUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    session: SessionQuery = None,
+):
+    """Update map center and zoom
+
+    Unconditional updates go through the coalescing window, so the response
+    to a mid-burst update comes with the version that carried it.
+    """
+    fields = {"map_center": map_update.center, "zoom_level": map_update.zoom}
+    try:
+        expected_version = parse_if_match(if_match)
+        if expected_version is None:
+            version = await state_coalescer.submit(session, fields)
+        else:
+            version = await update_state(fields, expected_version=expected_version, session=session)
+        response.headers["ETag"] = state_etag(version)
+        return {"status": "success", "map": map_update.model_dump(), "version": version}
+    except redis.RedisError:
+        raise HTTPException(status_code=500, detail="Redis connection error")
+
+@app.post("/state/batch")
+async def apply_state_batch(
+    batch: StateBatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    session: SessionQuery = None,
+):
+    """Apply an ordered list of filters/map/reset operations atomically
+
+    The whole batch is one state update, so it bumps the version once and
+    clients rerun once. fclasses are checked against the layer the map shows
+    at that point in the batch.
+    """
+    shown, known = None, False
+    for operation in batch.operations:
+        if isinstance(operation, ResetOperation):
+            shown, known = None, True
+        elif isinstance(operation, FiltersOperation):
+            if operation.layer is not None:
+                check_layer(operation.layer)
+                shown, known = operation.layer, True
+            if operation.fclasses:
+                if not known:
+                    shown, known = await shown_layer(session), True
+                check_fclasses(operation.fclasses, shown)
+    fields, reset = compile_operations(batch.operations)
+    try:
+        version = await update_state(
+            fields, reset=reset, expected_version=parse_if_match(if_match), session=session
+        )
+        response.headers["ETag"] = state_etag(version)
+        return {"status": "success", "operations": len(batch.operations), "version": version}
     except redis.RedisError:
         raise HTTPException(status_code=500, detail="Redis connection error")
 
 @app.delete("/state")
-async def reset_state():
+async def reset_state(
+    response: Response, if_match: Optional[str] = Header(None), session: SessionQuery = None
+):
     """Reset app to default state"""
     try:
-        redis_client.delete("app_state")
-        notify_state_change()
-        return {"status": "success", "message": "State reset to defaults"}
+        version = await update_state(
+            {}, reset=True, expected_version=parse_if_match(if_match), session=session
+        )
+        response.headers["ETag"] = state_etag(version)
+        return {"status": "success", "message": "State reset to defaults", "version": version}
     except redis.RedisError:
         raise HTTPException(status_code=500, detail="Redis connection error")
 
+def format_sse(event: str, data: dict) -> str:
+    """Encode one server-sent event; the state version doubles as the event id."""
+    lines = [f"event: {event}"]
+    if data.get("version") is not None:
+        lines.append(f"id: {data['version']}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+@app.get("/events")
+async def stream_events(request: Request, session: SessionQuery = None):
+    """Server-sent event stream of state and dataset changes
+
+    Sends the current state version on connect, then one ``state`` event per
+    message on the session's change channel, so clients can rerun only when
+    the version moves past what they last rendered. A ``dataset`` event
+    announces each new version of any layer with what changed in it. A connected
+    stream keeps its session from expiring.
+    """
+
+    async def event_stream():
+        subscription = state_backend.subscribe(session)
+        try:
+            await subscription.open()
+            state = await state_backend.read(session)
+            yield format_sse("state", {"version": state["version"]})
+            while not await request.is_disconnected():
+                message = await subscription.get_message(timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    await state_backend.touch(session)
+                    yield ": keepalive\n\n"
+                    continue
+                try:
+                    data = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    data = {"version": None}  # publisher without a version
+                yield format_sse("dataset" if message["channel"] == DATASET_CHANNEL else "state", data)
+        except redis.RedisError:
+            yield format_sse("error", {"detail": "Redis connection error"})
+        finally:
+            await subscription.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request, Redis, dataset and event loop metrics in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    if STATE_BACKEND == "memory":
+        return {"status": "healthy", "redis": "not used", "dataset_version": layer_registry.version()}
+    try:
+        await state_backend.ping()
+        return {"status": "healthy", "redis": "connected", "dataset_version": layer_registry.version()}
+    except redis.RedisError:
+        return {"status": "unhealthy", "redis": "disconnected", "dataset_version": layer_registry.version()}
+
+def preload_layers():
+    """Load every layer that fits LAYER_MEMORY_MB, fully built, before the workers fork"""
+    # the default last, so it is the one kept if they don't all fit
+    for name in reversed(layer_registry.names()):
+        try:
+            layer_registry.get(name).warm()
+        except Exception:
+            pass  # its endpoints will report the failure
+
+# Data file signatures of the layers the supervisor doesn't hold, as last seen
+# and as last acted on; a change is only acted on once it has settled
+unloaded_files: dict = {}
+
+def refresh_layers() -> bool:
+    """Reload the supervisor's layers whose files changed; True if workers need replacing
+
+    Layers the supervisor doesn't hold may still be loaded by workers, so a
+    settled change to their files counts as well.
+    """
+    changed = False
+    loaded = {}
+    for layer in layer_registry.loaded():
+        loaded[layer.name] = layer
+        version = layer.engine.version
+        layer.engine.reload()
+        if layer.engine.version != version:
+            layer.engine.loaded.warm()
+            changed = True
+    for name, spec in layer_registry.specs.items():
+        if name in loaded:
+            unloaded_files.pop(name, None)
+            continue
+        current = file_signature(watched_files(spec.path))
+        last, acted = unloaded_files.get(name, (current, current))
+        if current == last and current != acted:
+            acted = current
+            changed = True
+        unloaded_files[name] = (current, acted)
+    return changed
+
+def announce_pending():
+    """Publish the dataset changes the supervisor loaded, now that the workers serve them"""
+    if not pending_announcements:
+        return
+    client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT)
+    script = client.register_script(ANNOUNCE_DATASET_LUA)
     try:
-        redis_client.ping()
-        return {"status": "healthy", "redis": "connected"}
+        while pending_announcements:
+            script(**announcement(pending_announcements[0]))
+            pending_announcements.pop(0)
     except redis.RedisError:
-        return {"status": "unhealthy", "redis": "disconnected"}
+        pending_announcements.clear()  # clients still see the new version in X-Dataset-Version
+    finally:
+        client.close()
 
 def main():
     """Entry point for uv script"""
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if API_WORKERS > 1 and STATE_BACKEND == "memory":
+        raise RuntimeError("STATE_BACKEND=memory keeps the state in one process; use API_WORKERS=1")
+    if API_WORKERS <= 1:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
+        return
+    workers.serve(
+        uvicorn.Config(app, host="0.0.0.0", port=8000, timeout_graceful_shutdown=10),
+        API_WORKERS,
+        prepare=preload_layers,
+        refresh=refresh_layers if DATASET_WATCH else None,
+        after_restart=announce_pending,
+    )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,90 @@
+"""Feature export: whole-collection json.dumps vs the streaming encoder.
+
+Builds synthetic datasets of small polygons over Singapore and, for each
+size, encodes every feature:
+
+* dumps: ``json.dumps`` of a FeatureCollection of ``Dataset.feature`` dicts
+  (what a non-streaming endpoint would do)
+* stream: ``export.encode_features`` as NDJSON, uncompressed, gzip and zstd
+  (the last only if ``zstandard`` is installed)
+
+Reports time, output size and the peak Python heap (tracemalloc) while
+encoding; the streaming peak should stay the same as the size grows.
+
+Usage:
+    python benchmarks/bench_export.py --features 10000 100000
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import shapely
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import export  # noqa: E402
+from dataset import build_dataset  # noqa: E402
+
+FCLASSES = ["hospital", "clinic", "pharmacy", "dentist", "doctors"]
+
+
+def synthetic_dataset(n, seed=0):
+    rng = np.random.default_rng(seed)
+    x, y = rng.uniform(103.6, 104.0, n), rng.uniform(1.24, 1.47, n)
+    angles = np.linspace(0, 2 * np.pi, 12)
+    rings = np.stack([x[:, None] + 0.0005 * np.cos(angles), y[:, None] + 0.0005 * np.sin(angles)], axis=-1)
+    rings[:, -1] = rings[:, 0]
+    geoms = shapely.polygons(rings)
+    fclasses = rng.choice(FCLASSES, n).tolist()
+    return build_dataset(fclasses, [f"Facility {i}" for i in range(n)], [str(i) for i in range(n)], geoms, "bench")
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = fn()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--features", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if export.orjson else 'no'}, zstandard: {'yes' if export.zstandard else 'no'}")
+    encodings = [None, "gzip"] + (["zstd"] if export.zstandard else [])
+    for n in args.features:
+        dataset = synthetic_dataset(n)
+        rows = dataset.rows_for()
+        dataset.geometries  # noqa: B018 - materialize before measuring
+
+        def dumps():
+            collection = {"type": "FeatureCollection", "features": [dataset.feature(r) for r in rows]}
+            return len(json.dumps(collection))
+
+        print(f"\n{n} features")
+        results = [("dumps", *measure(dumps))]
+        for encoding in encodings:
+
+            def stream():
+                chunks = export.compress(export.ndjson(export.encode_features(dataset, rows)), encoding)
+                return sum(len(chunk) for chunk in chunks)
+
+            results.append((f"stream {encoding or 'identity'}", *measure(stream)))
+        for label, seconds, size, peak in results:
+            print(
+                f"  {label:16s} {seconds:7.2f}s  {n / seconds:9.0f} features/s"
+                f"  {size / 1e6:8.1f} MB out  peak heap {peak / 1e6:7.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Cold/warm dataset load time and memory, legacy vs columnar cache.
+
+Every measurement runs in a fresh interpreter so imports, page cache aside,
+start from scratch:
+
+* geopandas: ``gpd.read_file`` on the source (the old per-rerun load)
+* engine cold: ``DatasetEngine.get()`` with no cache on disk (parse, write cache)
+* engine warm: ``DatasetEngine.get()`` with the cache present (memory-mapped)
+
+RSS is reported as the growth over the post-import baseline.
+
+Usage:
+    python benchmarks/bench_load.py                     # data/health_sg.geojson
+    python benchmarks/bench_load.py --synthetic 200000  # generated GeoJSON
+"""
+
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+import geopandas as gpd
+import dataset
+
+def rss_kb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+base = rss_kb()
+start = time.perf_counter()
+if {mode!r} == "geopandas":
+    obj = gpd.read_file({path!r})
+else:
+    obj = dataset.DatasetEngine({path!r}).get()
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "rss_mb": (rss_kb() - base) / 1024, "rows": len(obj)}}))
+"""
+
+
+def synthetic_geojson(path, n, seed=0):
+    """Write n small multipolygons over Singapore as GeoJSON."""
+    rng = np.random.default_rng(seed)
+    fclasses = ["hospital", "clinic", "pharmacy", "dentist", "doctors"]
+    with open(path, "w") as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for i in range(n):
+            x, y = rng.uniform(103.6, 104.0), rng.uniform(1.24, 1.47)
+            ring = [[x + 0.0005 * np.cos(a), y + 0.0005 * np.sin(a)] for a in np.linspace(0, 2 * np.pi, 12)]
+            ring[-1] = ring[0]
+            feat = {
+                "type": "Feature",
+                "properties": {"osm_id": str(i), "fclass": fclasses[i % 5], "name": f"Facility {i}"},
+                "geometry": {"type": "MultiPolygon", "coordinates": [[ring]]},
+            }
+            f.write(json.dumps(feat) + (",\n" if i < n - 1 else "\n"))
+        f.write("]}\n")
+
+
+def probe(mode, path):
+    code = PROBE.format(root=str(ROOT), mode=mode, path=str(path))
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", type=Path, default=ROOT / "data" / "health_sg.geojson")
+    parser.add_argument("--synthetic", type=int, help="generate a GeoJSON with this many features")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "bench.geojson"
+        if args.synthetic:
+            synthetic_geojson(source, args.synthetic)
+        else:
+            shutil.copy(args.source, source)
+        cache = source.parent / ".cache"
+        print(f"{source.name}: {source.stat().st_size / 1e6:.1f} MB")
+
+        def run(label, mode, clear_cache):
+            results = []
+            for _ in range(args.repeat):
+                if clear_cache:
+                    shutil.rmtree(cache, ignore_errors=True)
+                results.append(probe(mode, source))
+            best = min(results, key=lambda r: r["seconds"])
+            print(f"{label:<14} {best['seconds'] * 1000:10.1f} ms  rss +{best['rss_mb']:7.1f} MB  ({best['rows']} rows)")
+
+        run("geopandas", "geopandas", clear_cache=False)
+        run("engine cold", "engine", clear_cache=True)
+        run("engine warm", "engine", clear_cache=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Cold start of the MCP stdio servers, as an agent host sees it.
+
+Spawns a server the way a host does (``python mcp_server.py`` over stdio)
+and times, from the spawn, the ``initialize`` response, the first
+``tools/list`` response and the response to the first tool call
+(``check_health``). Each server runs ``--runs`` times with no tool schema
+snapshot on disk (cold) and with the snapshot the previous run left
+(warm); medians are reported. With ``--baseline-dir`` (another checkout,
+say ``git worktree add /tmp/before HEAD~1``) the same runs are made against
+it for comparison.
+
+It also prints ``python -X importtime`` numbers for importing each server
+module: the total and the top-level packages that cost the most.
+
+The API serves every layer in data/layers.json, or only the default one
+with ``--default-layer``. Redis is fakeredis over TCP and the API server
+runs on port 8000 for the HTTP transport; ``--transport inprocess`` has
+the servers start the API app themselves, so the first tool call includes
+loading the dataset.
+
+Usage:
+    python benchmarks/bench_mcp_startup.py
+    python benchmarks/bench_mcp_startup.py --baseline-dir /tmp/before --runs 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+from bench_state_concurrency import FAKE_REDIS, wait_for_port
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVERS = {"lowlevel": "mcp_server.py", "fastmcp": "mcp_server_fastmcp.py"}
+PHASES = ["initialize", "tools/list", "first call"]
+
+
+async def time_startup(app_dir, script, env):
+    """Seconds from spawn to each phase's response."""
+    params = StdioServerParameters(command=sys.executable, args=[script], cwd=str(app_dir), env=env)
+    start = time.perf_counter()
+    times = []
+    with open(os.devnull, "w") as errlog:
+        async with stdio_client(params, errlog=errlog) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                times.append(time.perf_counter() - start)
+                await session.list_tools()
+                times.append(time.perf_counter() - start)
+                result = await session.call_tool("check_health", {})
+                times.append(time.perf_counter() - start)
+                if result.isError:
+                    raise RuntimeError(f"check_health failed: {result.content}")
+    return times
+
+
+def wait_for_file(path, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def startup(app_dir, script, env, runs, snapshot):
+    """Median phase times over ``runs``, cold (no snapshot) and warm.
+
+    No warm runs for servers that never write a snapshot.
+    """
+    results = {}
+    for label in ("cold", "warm"):
+        if label == "warm" and not snapshot.exists():
+            break
+        samples = []
+        for _ in range(runs):
+            if label == "cold":
+                snapshot.unlink(missing_ok=True)
+            samples.append(asyncio.run(time_startup(app_dir, script, env)))
+            if label == "cold":
+                wait_for_file(snapshot)  # written by the background refresh
+        results[label] = [statistics.median(s[i] for s in samples) for i in range(len(PHASES))]
+    return results
+
+
+def import_time(app_dir, module, env, top=5):
+    """(total seconds, [(package, cumulative seconds)]) for importing ``module``."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=app_dir, env=env, capture_output=True, text=True, check=True,
+    )
+    total, packages = 0, []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        total += int(self_us)
+        if name[1:].startswith("  ") and not name[3:].startswith(" "):  # imported by the module itself
+            packages.append((name.strip(), int(cumulative_us) / 1e6))
+    return total / 1e6, sorted(packages, key=lambda p: -p[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", nargs="+", choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument("--transport", choices=["http", "inprocess"], default="http")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline-dir", type=Path, help="another checkout to compare against")
+    parser.add_argument("--default-layer", action="store_true", help="serve only health_sg, the default layer")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    args = parser.parse_args()
+
+    checkouts = [("current", ROOT)] + ([("baseline", args.baseline_dir.resolve())] if args.baseline_dir else [])
+    redis_url = f"redis://127.0.0.1:{args.redis_port}/0"
+    procs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = Path(tmp) / "mcp_tool_schema.json"
+        env = dict(
+            os.environ, REDIS_URL=redis_url, MCP_API_TRANSPORT=args.transport,
+            MCP_TOOL_SCHEMA_CACHE=str(snapshot), PYTHONWARNINGS="ignore",
+        )
+        if args.default_layer:
+            layers = Path(tmp) / "layers.json"
+            source = ROOT / "data" / "health_sg.geojson"
+            layers.write_text(json.dumps({"health_sg": {"path": str(source), "title": "Health facilities"}}))
+            env["DATASET_LAYERS"] = str(layers)
+        try:
+            procs.append(subprocess.Popen([sys.executable, "-c", FAKE_REDIS, str(args.redis_port)]))
+            wait_for_port(args.redis_port)
+            if args.transport == "http":
+                procs.append(subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "api_server:app", "--port", "8000",
+                     "--log-level", "warning", "--no-access-log"],
+                    cwd=ROOT, env=env,
+                ))
+                wait_for_port(8000)
+
+            print(f"{args.transport} transport, median of {args.runs} runs, seconds from spawn")
+            print(f"{'server':<9} {'checkout':<9} {'snapshot':<8}" + "".join(f" {p:>11}" for p in PHASES))
+            for server in args.servers:
+                for checkout, app_dir in checkouts:
+                    results = startup(app_dir, SERVERS[server], env, args.runs, snapshot)
+                    for label, times in results.items():
+                        print(f"{server:<9} {checkout:<9} {label:<8}" + "".join(f" {t:>11.3f}" for t in times))
+
+            print("\npython -X importtime")
+            for server in args.servers:
+                for checkout, app_dir in checkouts:
+                    total, packages = import_time(app_dir, Path(SERVERS[server]).stem, env)
+                    top = ", ".join(f"{name} {seconds:.2f}" for name, seconds in packages)
+                    print(f"{server:<9} {checkout:<9} {total:6.2f}s  {top}")
+        finally:
+            for proc in reversed(procs):
+                proc.terminate()
+                proc.wait()
+
+
+if __name__ == "__main__":
+    main()
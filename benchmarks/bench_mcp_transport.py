@@ -0,0 +1,133 @@
+"""Per-tool-call latency of the MCP servers, HTTP vs in-process transport.
+
+Starts a Redis-compatible server (fakeredis over TCP unless ``--redis-url``)
+and, for the HTTP mode, the API server. Each mode then runs in a fresh
+interpreter with ``MCP_API_TRANSPORT`` set, calls every tool ``--calls``
+times through the server's tool handler and reports p50/p99 per tool.
+
+Usage:
+    python benchmarks/bench_mcp_transport.py
+    python benchmarks/bench_mcp_transport.py --server fastmcp --calls 500
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from bench_state_concurrency import FAKE_REDIS, wait_for_port
+
+ROOT = Path(__file__).resolve().parent.parent
+
+TOOLS = [
+    ("get_app_state", {}),
+    ("list_layers", {}),
+    ("list_facility_classes", {}),
+    ("set_facility_filters", {"fclasses": ["hospital", "clinic"]}),
+    ("set_map_view", {"latitude": 1.3521, "longitude": 103.8198, "zoom": 13}),
+    ("apply_state_changes", {"operations": [
+        {"op": "filters", "fclasses": ["hospital"]},
+        {"op": "map", "latitude": 1.3911, "longitude": 103.8954, "zoom": 15},
+    ]}),
+    ("count_facilities_within", {"latitude": 1.3048, "longitude": 103.8318, "radius_m": 2000, "fclasses": ["clinic"]}),
+    ("nearest_facilities", {"from_fclasses": ["clinic"], "to_fclasses": ["hospital"]}),
+    ("facility_density", {"cell_m": 1000}),
+    ("get_facility_extent", {"fclasses": ["hospital"]}),
+    ("reset_app", {}),
+    ("use_session", {}),
+    ("check_health", {}),
+]
+
+PROBE = """
+import asyncio, json, sys, time, warnings
+warnings.filterwarnings("ignore")
+sys.path.insert(0, {root!r})
+import numpy as np
+
+if {server!r} == "fastmcp":
+    import mcp_server_fastmcp as module
+
+    async def call(name, args):
+        tool = await module.app.get_tool(name)
+        if name == "apply_state_changes":
+            args = {{"operations": [module.StateChange(**op) for op in args["operations"]]}}
+        return await tool.fn(**args)
+else:
+    import mcp_server as module
+
+    async def call(name, args):
+        return await module.handle_call_tool(name, args)
+
+async def main():
+    results = {{}}
+    for name, args in {tools!r}:
+        for _ in range(5):  # warm up: client, catalog, app startup
+            await call(name, args)
+        times = []
+        for _ in range({calls}):
+            start = time.perf_counter()
+            await call(name, args)
+            times.append(time.perf_counter() - start)
+        ms = np.array(times) * 1000
+        results[name] = {{
+            "p50": float(np.percentile(ms, 50)),
+            "p95": float(np.percentile(ms, 95)),
+            "p99": float(np.percentile(ms, 99)),
+            "rps": len(times) / sum(times),
+        }}
+    print(json.dumps(results))
+
+asyncio.run(main())
+"""
+
+
+def probe(mode, server, calls, redis_url):
+    code = PROBE.format(root=str(ROOT), server=server, tools=TOOLS, calls=calls)
+    env = dict(os.environ, MCP_API_TRANSPORT=mode, REDIS_URL=redis_url)
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env=env)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=["lowlevel", "fastmcp"], default="lowlevel")
+    parser.add_argument("--calls", type=int, default=200, help="timed calls per tool")
+    parser.add_argument("--redis-url", help="use this Redis instead of starting fakeredis")
+    parser.add_argument("--redis-port", type=int, default=6379, help="port for the fakeredis server")
+    args = parser.parse_args()
+
+    procs = []
+    try:
+        redis_url = args.redis_url
+        if redis_url is None:
+            procs.append(subprocess.Popen([sys.executable, "-c", FAKE_REDIS, str(args.redis_port)]))
+            wait_for_port(args.redis_port)
+            redis_url = f"redis://127.0.0.1:{args.redis_port}/0"
+
+        # the MCP servers expect the API at localhost:8000
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api_server:app", "--port", "8000",
+             "--log-level", "warning", "--no-access-log"],
+            cwd=ROOT, env=dict(os.environ, REDIS_URL=redis_url),
+        ))
+        wait_for_port(8000)
+
+        http = probe("http", args.server, args.calls, redis_url)
+        inprocess = probe("inprocess", args.server, args.calls, redis_url)
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait()
+
+    print(f"{args.server} server, {args.calls} calls per tool, p50 / p99 ms")
+    print(f"{'tool':<24} {'http':>17} {'in-process':>17} {'p50 speedup':>12}")
+    for name, _ in TOOLS:
+        h, i = http[name], inprocess[name]
+        print(f"{name:<24} {h['p50']:8.2f} /{h['p99']:7.2f} {i['p50']:8.2f} /{i['p99']:7.2f} "
+              f"{h['p50'] / i['p50']:11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""State writes, notifications and viewer reruns per map pan gesture.
+
+Starts a Redis-compatible server (fakeredis over TCP unless ``--redis-url``)
+and then, for each ``--windows`` value, the API server with that
+``STATE_COALESCE_MS``. A gesture is ``--events`` POST /map updates sent
+``--interval-ms`` apart, as the map reports a drag. A second client follows
+/events the way a watching Streamlit session does.
+
+Reported per gesture:
+
+* writes: state updates applied in Redis (from /metrics)
+* publishes: change notifications the watcher received
+* reruns: how often the watcher reruns, if each rerun takes ``--rerun-ms``
+  and notifications arriving during one trigger a single follow-up rerun
+* settle: ms from the last update sent until the watcher saw the final state
+
+Usage:
+    python benchmarks/bench_pan_coalescing.py
+    python benchmarks/bench_pan_coalescing.py --windows 0 50 100 250 --events 40
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from bench_state_concurrency import FAKE_REDIS, wait_for_port
+
+ROOT = Path(__file__).resolve().parent.parent
+SESSION = "bench-pan"
+
+
+def count_reruns(arrivals, rerun_seconds):
+    """Reruns of a session that reruns on each notification not yet rendered"""
+    reruns, busy_until, queued = 0, float("-inf"), False
+    for t in arrivals:
+        if t < busy_until:
+            queued = True
+            continue
+        if queued:  # the follow-up rerun started when the last one ended
+            reruns += 1
+            busy_until += rerun_seconds
+            queued = False
+            if t < busy_until:
+                queued = True
+                continue
+        reruns += 1
+        busy_until = t + rerun_seconds
+    return reruns + queued
+
+
+async def metric(client, name):
+    text = (await client.get("/metrics")).text
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    return 0.0
+
+
+async def gesture(client, events, interval, rerun_seconds):
+    arrivals = []  # (time, version) per notification
+    connected = asyncio.Event()
+
+    async def watch():
+        async with client.stream("GET", "/events", params={"session": SESSION}) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    version = json.loads(line[5:])["version"]
+                    if connected.is_set():
+                        arrivals.append((time.perf_counter(), version))
+                    connected.set()  # the first event is the version on connect
+
+    watcher = asyncio.create_task(watch())
+    await connected.wait()
+    writes_before = await metric(client, "state_updates_total")
+
+    posts = []
+    for i in range(events):
+        body = {"center": [1.30 + 0.001 * i, 103.80], "zoom": 13}
+        posts.append(asyncio.create_task(client.post("/map", params={"session": SESSION}, json=body)))
+        sent = time.perf_counter()
+        await asyncio.sleep(interval)
+    final = max(r.raise_for_status().json()["version"] for r in await asyncio.gather(*posts))
+    while not arrivals or arrivals[-1][1] < final:
+        await asyncio.sleep(0.005)
+    watcher.cancel()
+
+    writes = await metric(client, "state_updates_total") - writes_before
+    times = [t for t, _ in arrivals]
+    return {
+        "writes": writes,
+        "publishes": len(arrivals),
+        "reruns": count_reruns(times, rerun_seconds),
+        "settle": (times[-1] - sent) * 1000,
+    }
+
+
+async def run(base_url, args):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        await client.delete("/state", params={"session": SESSION})
+        results = [
+            await gesture(client, args.events, args.interval_ms / 1000, args.rerun_ms / 1000)
+            for _ in range(args.gestures)
+        ]
+    return {k: sum(r[k] for r in results) / len(results) for k in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 100], help="STATE_COALESCE_MS values")
+    parser.add_argument("--events", type=int, default=20, help="map updates per gesture")
+    parser.add_argument("--interval-ms", type=float, default=30, help="time between map updates")
+    parser.add_argument("--rerun-ms", type=float, default=150, help="modelled Streamlit rerun time")
+    parser.add_argument("--gestures", type=int, default=5)
+    parser.add_argument("--redis-url", help="use this Redis instead of starting fakeredis")
+    parser.add_argument("--redis-port", type=int, default=6379, help="port for the fakeredis server")
+    parser.add_argument("--port", type=int, default=8765, help="port for the API server")
+    args = parser.parse_args()
+
+    procs = []
+    try:
+        redis_url = args.redis_url
+        if redis_url is None:
+            procs.append(subprocess.Popen([sys.executable, "-c", FAKE_REDIS, str(args.redis_port)]))
+            wait_for_port(args.redis_port)
+            redis_url = f"redis://127.0.0.1:{args.redis_port}/0"
+
+        print(f"{args.events} updates {args.interval_ms:g} ms apart per gesture, {args.rerun_ms:g} ms reruns")
+        print(f"{'window ms':>9} {'writes':>7} {'publishes':>10} {'reruns':>7} {'settle ms':>10}")
+        for window in args.windows:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(args.port),
+                 "--log-level", "warning", "--no-access-log"],
+                cwd=ROOT, env=dict(os.environ, REDIS_URL=redis_url, STATE_COALESCE_MS=str(window)),
+            )
+            try:
+                wait_for_port(args.port)
+                r = asyncio.run(run(f"http://127.0.0.1:{args.port}", args))
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{window:>9g} {r['writes']:>7.1f} {r['publishes']:>10.1f} {r['reruns']:>7.1f} {r['settle']:>10.1f}")
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Before/after timing of the Streamlit map render path on synthetic data.
+
+Builds a synthetic GeoDataFrame of small polygons scattered over Singapore and
+times three ways of putting it on a folium map, including the final HTML
+render that st_folium performs:
+
+* legacy: one folium.GeoJson (with style lambda and tooltip) per row
+* single layer: one pre-serialized FeatureCollection layer
+* cached rerun: same selection again, served from the serialization cache
+
+Usage:
+    python benchmarks/bench_render.py --features 100000
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import warnings
+
+import folium
+import geopandas as gpd
+import numpy as np
+import shapely
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+warnings.filterwarnings("ignore", message="CartoDB tiles")
+
+import main as app  # noqa: E402
+from dataset import build_dataset  # noqa: E402
+
+FCLASSES = ["hospital", "clinic", "pharmacy", "dentist", "doctors"]
+
+
+def synthetic_gdf(n, seed=0):
+    """n small square polygons inside the Singapore bounding box."""
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(103.6, 104.0, n)
+    y = rng.uniform(1.24, 1.47, n)
+    size = rng.uniform(0.0002, 0.001, n)
+    return gpd.GeoDataFrame(
+        {
+            "osm_id": np.arange(n).astype(str),
+            "fclass": rng.choice(FCLASSES, n),
+            "name": [f"Facility {i}" for i in range(n)],
+        },
+        geometry=shapely.box(x, y, x + size, y + size),
+        crs="EPSG:4326",
+    )
+
+
+def new_map():
+    return folium.Map(location=[1.35, 103.82], zoom_start=12, tiles="CartoDB positron")
+
+
+def legacy_render(gdf):
+    m = new_map()
+    for _, row in gdf.iterrows():
+        folium.GeoJson(
+            row["geometry"],
+            style_function=lambda x: app.FACILITY_STYLE,
+            tooltip=row["name"],
+        ).add_to(m)
+    return m.get_root().render()
+
+
+def single_layer_render(dataset, selection):
+    m = new_map()
+    # zoom 17 keeps full-resolution geometry, like the legacy path
+    app.add_geojson_layer(m, dataset, selection, 17)
+    return m.get_root().render()
+
+
+def timed(label, fn, *args):
+    start = time.perf_counter()
+    html = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed * 1000:10.1f} ms   page {len(html) / 1e6:8.1f} MB")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--features", type=int, default=100_000)
+    parser.add_argument("--skip-legacy", action="store_true", help="skip the slow per-row loop")
+    args = parser.parse_args()
+
+    gdf = synthetic_gdf(args.features)
+    selection = FCLASSES[:3]
+    filtered = gdf[gdf["fclass"].isin(selection)]
+    print(f"{args.features} features, {len(filtered)} selected")
+
+    if not args.skip_legacy:
+        legacy = timed("legacy per-row layers", legacy_render, filtered)
+    dataset = build_dataset(
+        gdf["fclass"], gdf["name"], gdf["osm_id"], np.asarray(gdf.geometry.values), "bench"
+    )
+    new = timed("single layer (cold)", single_layer_render, dataset, selection)
+    cached = timed("single layer (cached)", single_layer_render, dataset, list(reversed(selection)))
+    if not args.skip_legacy:
+        print(f"speedup: {legacy / new:.1f}x cold, {legacy / cached:.1f}x cached")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""State endpoint latency under concurrent clients.
+
+Starts a Redis-compatible server (fakeredis over TCP unless ``--redis-url``
+points at a real one) and the API server in separate processes, then drives
+a mix of GET /state, POST /map and POST /filters from 1, 50 and 500
+concurrent clients and reports p50/p99 latency and throughput.
+
+``--redis-latency-ms`` routes Redis traffic through a proxy that delays each
+direction by half that round-trip time, to model a Redis that isn't on the
+same host. This is where a blocking client hurts: the event loop sits idle
+for every round trip instead of serving other requests.
+
+To compare against another revision, point ``--app-dir`` at a checkout of it
+(e.g. ``git worktree add /tmp/before HEAD~1``). The server always gets
+``REDIS_URL``; revisions that hard-code ``localhost:6379`` are served by the
+fakeredis default port.
+
+Usage:
+    python benchmarks/bench_state_concurrency.py
+    python benchmarks/bench_state_concurrency.py --app-dir /tmp/before
+    python benchmarks/bench_state_concurrency.py --redis-latency-ms 1
+    python benchmarks/bench_state_concurrency.py --redis-url redis://localhost:6379/0
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Real Redis sets TCP_NODELAY on client sockets; without it the fake server's
+# multi-reply pipeline responses stall ~40 ms on delayed ACKs.
+FAKE_REDIS = """
+import sys
+from fakeredis import TcpFakeServer
+server = TcpFakeServer(("127.0.0.1", int(sys.argv[1])))
+server.RequestHandlerClass.disable_nagle_algorithm = True
+server.serve_forever()
+"""
+
+LATENCY_PROXY = """
+import asyncio, sys
+
+listen, host, port = int(sys.argv[1]), sys.argv[2], int(sys.argv[3])
+delay = float(sys.argv[4]) / 2000  # half the round trip each way
+
+async def pipe(reader, writer):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def deliver():
+        while True:
+            due, data = await queue.get()
+            if not data:
+                writer.close()
+                return
+            await asyncio.sleep(due - loop.time())
+            writer.write(data)
+            await writer.drain()
+
+    task = asyncio.create_task(deliver())
+    while data := await reader.read(65536):
+        queue.put_nowait((loop.time() + delay, data))
+    queue.put_nowait((0, b""))
+    await task
+
+async def handle(reader, writer):
+    up_reader, up_writer = await asyncio.open_connection(host, port)
+    await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer), return_exceptions=True)
+
+async def main():
+    server = await asyncio.start_server(handle, "127.0.0.1", listen)
+    await server.serve_forever()
+
+asyncio.run(main())
+"""
+
+REQUESTS = [
+    ("GET", "/state", None),
+    ("GET", "/state", None),
+    ("POST", "/map", {"center": [1.3521, 103.8198], "zoom": 13}),
+    ("POST", "/filters", ["hospital", "clinic"]),
+]
+
+
+def wait_for_port(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+
+async def worker(client, requests, offset, n, latencies, errors):
+    for i in range(offset, offset + n):
+        method, path, body = requests[i % len(requests)]
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            errors.append(path)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(base_url, clients, per_client, requests=REQUESTS):
+    """Run ``clients`` workers, each cycling through ``requests`` from its own offset."""
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        await worker(client, requests, 0, len(requests), [], [])  # warm up
+        latencies, errors = [], []
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, requests, i, per_client, latencies, errors) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    percentile = lambda q: float(np.percentile(ms, q)) if len(ms) else float("nan")  # noqa: E731
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "rps": len(latencies) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", type=Path, default=ROOT, help="tree to import api_server from")
+    parser.add_argument("--redis-url", help="use this Redis instead of starting fakeredis")
+    parser.add_argument("--redis-port", type=int, default=6379, help="port for the fakeredis server")
+    parser.add_argument("--redis-latency-ms", type=float, default=0.0, help="simulated Redis round-trip time")
+    parser.add_argument("--port", type=int, default=8765, help="port for the API server")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    args = parser.parse_args()
+
+    procs = []
+    try:
+        redis_url = args.redis_url
+        if redis_url is None:
+            # with a proxy in front, the proxy takes --redis-port so revisions
+            # that hard-code localhost:6379 go through it too
+            fake_port = args.redis_port + 1 if args.redis_latency_ms else args.redis_port
+            procs.append(subprocess.Popen([sys.executable, "-c", FAKE_REDIS, str(fake_port)]))
+            wait_for_port(fake_port)
+            redis_url = f"redis://127.0.0.1:{fake_port}/0"
+
+        if args.redis_latency_ms:
+            upstream = urlsplit(redis_url)
+            procs.append(subprocess.Popen([
+                sys.executable, "-c", LATENCY_PROXY, str(args.redis_port),
+                upstream.hostname, str(upstream.port or 6379), str(args.redis_latency_ms),
+            ]))
+            wait_for_port(args.redis_port)
+            redis_url = f"redis://127.0.0.1:{args.redis_port}{upstream.path}"
+
+        env = dict(os.environ, REDIS_URL=redis_url)
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(args.port),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=args.app_dir, env=env,
+        ))
+        wait_for_port(args.port)
+
+        base_url = f"http://127.0.0.1:{args.port}"
+        print(f"{args.app_dir} against {redis_url}, +{args.redis_latency_ms} ms RTT")
+        print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+        for clients in args.clients:
+            per_client = max(1, args.requests // clients)
+            r = asyncio.run(run_level(base_url, clients, per_client))
+            print(f"{r['clients']:>8} {r['requests']:>9} {r['errors']:>7} "
+                  f"{r['p50']:>9.1f} {r['p99']:>9.1f} {r['rps']:>8.0f}")
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
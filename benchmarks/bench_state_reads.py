@@ -0,0 +1,140 @@
+"""State read latency: Redis every time vs the local read cache vs the memory backend.
+
+Two parts:
+
+* backend: ``read()`` called back to back in this process on a
+  ``RedisStateBackend`` without and with its cache, and on a
+  ``MemoryStateBackend``; p50/p99 in microseconds
+* http: GET /state from ``--clients`` concurrent clients against the API
+  server started with ``STATE_CACHE=0``, with the cache, and with
+  ``STATE_BACKEND=memory``; p50/p99 and throughput
+
+Redis is fakeredis over TCP; ``--redis-latency-ms`` puts the latency proxy
+from bench_state_concurrency in front of it, to model a Redis on another
+host.
+
+Usage:
+    python benchmarks/bench_state_reads.py
+    python benchmarks/bench_state_reads.py --redis-latency-ms 1 --clients 50
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import redis.asyncio as aioredis
+
+from bench_state_concurrency import FAKE_REDIS, LATENCY_PROXY, run_level, wait_for_port
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from state_backend import MemoryStateBackend, RedisStateBackend  # noqa: E402
+
+DEFAULTS = {"layer": None, "selected_fclasses": [], "map_center": None, "zoom_level": 12}
+FIELDS = {"selected_fclasses": ["hospital", "clinic"], "map_center": [1.3521, 103.8198], "zoom_level": 13}
+PORT = 8765
+
+
+async def time_reads(backend, reads):
+    await backend.prepare()
+    try:
+        await backend.update(FIELDS)
+        if isinstance(backend, RedisStateBackend) and backend.cache_enabled:
+            while not backend._listening:  # the cache only fills once subscribed
+                await asyncio.sleep(0.01)
+        await backend.read()
+        times = []
+        for _ in range(reads):
+            start = time.perf_counter()
+            await backend.read()
+            times.append(time.perf_counter() - start)
+    finally:
+        await backend.close()
+    us = np.array(times) * 1e6
+    return float(np.percentile(us, 50)), float(np.percentile(us, 99))
+
+
+async def bench_backends(redis_url, reads):
+    results = {}
+    for label, cache in (("redis", False), ("redis + cache", True)):
+        client = aioredis.Redis.from_url(redis_url, decode_responses=True)
+        pubsub_client = aioredis.Redis.from_url(redis_url, decode_responses=True)
+        backend = RedisStateBackend(client, pubsub_client, DEFAULTS, 3600, cache=cache)
+        results[label] = await time_reads(backend, reads)
+        await client.aclose()
+        await pubsub_client.aclose()
+    results["memory"] = await time_reads(MemoryStateBackend(DEFAULTS, 3600), reads)
+    return results
+
+
+def bench_http(redis_url, clients, requests):
+    results = {}
+    configs = [
+        ("redis", {"STATE_CACHE": "0"}),
+        ("redis + cache", {"STATE_CACHE": "1"}),
+        ("memory", {"STATE_BACKEND": "memory"}),
+    ]
+    for label, extra in configs:
+        env = dict(os.environ, REDIS_URL=redis_url, DATASET_WATCH="0", **extra)
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(PORT),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=ROOT, env=env,
+        )
+        try:
+            wait_for_port(PORT)
+            results[label] = asyncio.run(
+                run_level(f"http://127.0.0.1:{PORT}", clients, max(1, requests // clients), [("GET", "/state", None)])
+            )
+        finally:
+            proc.terminate()
+            proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reads", type=int, default=20000, help="reads per backend")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000, help="GET /state requests per server")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-latency-ms", type=float, default=0.0, help="simulated Redis round-trip time")
+    args = parser.parse_args()
+
+    procs = []
+    try:
+        fake_port = args.redis_port + 1 if args.redis_latency_ms else args.redis_port
+        procs.append(subprocess.Popen([sys.executable, "-c", FAKE_REDIS, str(fake_port)]))
+        wait_for_port(fake_port)
+        if args.redis_latency_ms:
+            procs.append(subprocess.Popen([
+                sys.executable, "-c", LATENCY_PROXY, str(args.redis_port),
+                "127.0.0.1", str(fake_port), str(args.redis_latency_ms),
+            ]))
+            wait_for_port(args.redis_port)
+        redis_url = f"redis://127.0.0.1:{args.redis_port}/0"
+
+        print(f"+{args.redis_latency_ms} ms Redis RTT")
+        print(f"\nbackend read(), {args.reads} reads")
+        print(f"{'':<14} {'p50 us':>9} {'p99 us':>9}")
+        for label, (p50, p99) in asyncio.run(bench_backends(redis_url, args.reads)).items():
+            print(f"{label:<14} {p50:>9.1f} {p99:>9.1f}")
+
+        print(f"\nGET /state, {args.clients} clients")
+        print(f"{'':<14} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8} {'errors':>7}")
+        for label, r in bench_http(redis_url, args.clients, args.requests).items():
+            print(f"{label:<14} {r['p50']:>9.2f} {r['p99']:>9.2f} {r['rps']:>8.0f} {r['errors']:>7}")
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
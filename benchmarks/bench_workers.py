@@ -0,0 +1,189 @@
+"""API throughput and memory against worker count.
+
+Serves a synthetic dataset (``--features`` small polygons over Singapore)
+from the API server with 1..N workers, in two modes:
+
+* prefork: ``API_WORKERS=N``; the supervisor loads and builds everything
+  once and forks the workers (see workers.py)
+* uvicorn: ``uvicorn --workers N``; every worker loads its own copy
+
+For each run it reports the time until the first response, throughput and
+latency of a CPU-bound mix (viewport features, vector tiles, radius
+analytics, extents) from ``--clients`` concurrent clients, and the memory
+of the whole process tree: summed RSS, which counts shared pages once per
+process, and summed PSS, which splits them between the processes sharing
+them and so is the real total.
+
+Redis is fakeredis over TCP; the server uses ports 6379 and 8000. The data
+cache is built before the runs, so every mode starts from a warm cache.
+
+Usage:
+    python benchmarks/bench_workers.py --features 200000 --workers 1 2 4
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from bench_load import synthetic_geojson
+from bench_state_concurrency import FAKE_REDIS, run_level, wait_for_port
+
+ROOT = Path(__file__).resolve().parent.parent
+PORT = 8000  # api_server.main() listens here
+REDIS_PORT = 6379
+
+
+def tile_xy(lon, lat, z):
+    n = 1 << z
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+def request_mix(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    requests = []
+    for _ in range(n // 4):
+        lon, lat = rng.uniform(103.62, 103.98), rng.uniform(1.26, 1.45)
+        z = int(rng.integers(13, 16))
+        x, y = tile_xy(lon, lat, z)
+        requests += [
+            ("GET", f"/features?bbox={lon - 0.01},{lat - 0.01},{lon + 0.01},{lat + 0.01}&zoom=14&limit=500", None),
+            ("GET", f"/tiles/{z}/{x}/{y}.mvt", None),
+            ("GET", f"/analytics/within?lat={lat}&lon={lon}&radius_m=1500&limit=50", None),
+            ("GET", f"/extent?fclasses={rng.choice(['clinic', 'hospital', 'pharmacy'])}", None),
+        ]
+    return requests
+
+
+def process_tree(root):
+    """pid of ``root`` and all its descendants."""
+    children = {}
+    for entry in Path("/proc").iterdir():
+        if entry.name.isdigit():
+            try:
+                ppid = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry.name))
+    pids, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def tree_memory_mb(root):
+    """(summed RSS, summed PSS) of a process tree, in MB."""
+    rss = pss = 0
+    for pid in process_tree(root):
+        try:
+            for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+                if line.startswith("Rss:"):
+                    rss += int(line.split()[1])
+                elif line.startswith("Pss:"):
+                    pss += int(line.split()[1])
+        except OSError:
+            continue
+    return rss / 1024, pss / 1024
+
+
+def start_server(mode, workers, env):
+    if mode == "prefork":
+        cmd = [sys.executable, "-c", "import api_server; api_server.main()"]
+        env = dict(env, API_WORKERS=str(workers))
+    else:
+        cmd = [
+            sys.executable, "-m", "uvicorn", "api_server:app",
+            "--port", str(PORT), "--workers", str(workers), "--log-level", "warning",
+        ]
+    return subprocess.Popen(
+        cmd,
+        cwd=ROOT, env=env, start_new_session=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_for_response(url, timeout=300.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=5.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{url} never answered")
+
+
+def run(mode, workers, env, requests, clients, per_client):
+    start = time.perf_counter()
+    proc = start_server(mode, workers, env)
+    try:
+        wait_for_response(f"http://127.0.0.1:{PORT}/extent")
+        startup = time.perf_counter() - start
+        result = asyncio.run(run_level(f"http://127.0.0.1:{PORT}", clients, per_client, requests))
+        rss, pss = tree_memory_mb(proc.pid)
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+    return {"startup": startup, "rss_mb": rss, "pss_mb": pss, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--features", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument("--modes", nargs="+", choices=["prefork", "uvicorn"], default=["prefork", "uvicorn"])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "synthetic.geojson"
+        synthetic_geojson(source, args.features)
+        layers = Path(tmp) / "layers.json"
+        layers.write_text(json.dumps({"synthetic": {"path": source.name, "title": "Synthetic"}}))
+        env = dict(os.environ, DATASET_LAYERS=str(layers), REDIS_URL=f"redis://127.0.0.1:{REDIS_PORT}/0")
+        subprocess.run([sys.executable, "dataset.py", str(source)], cwd=ROOT, env=env, check=True)
+
+        redis = subprocess.Popen([sys.executable, "-c", FAKE_REDIS, str(REDIS_PORT)])
+        try:
+            wait_for_port(REDIS_PORT)
+            requests = request_mix()
+            per_client = max(1, args.requests // args.clients)
+            print(f"{args.features} features, {args.clients} clients, {os.cpu_count()} cores")
+            print(
+                f"{'mode':>8} {'workers':>7} {'startup s':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}"
+                f" {'errors':>6} {'RSS MB':>8} {'PSS MB':>8}"
+            )
+            for mode in args.modes:
+                for workers in args.workers:
+                    r = run(mode, workers, env, requests, args.clients, per_client)
+                    print(
+                        f"{mode:>8} {workers:>7} {r['startup']:>9.2f} {r['rps']:>8.0f} {r['p50']:>8.1f}"
+                        f" {r['p99']:>8.1f} {r['errors']:>6} {r['rss_mb']:>8.0f} {r['pss_mb']:>8.0f}"
+                    )
+        finally:
+            redis.terminate()
+            redis.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Offline benchmark suite with a JSON baseline for regression diffs.
+
+Sections (all by default):
+
+* api: drives the API server (uvicorn, backed by fakeredis over TCP unless
+  ``--redis-url``) with the synthetic state mix at several concurrency levels,
+  plus a replayed request log if ``--replay`` is given
+* mcp: every MCP tool through both servers, over HTTP and in-process
+* render: the Streamlit app's data-load / project / filter / map-build / view phases on
+  synthetic datasets, sized by ``--render-sizes``
+
+Every measurement is stored under a flat key (``api.synthetic.c50``,
+``mcp.fastmcp.http.set_map_view``, ``render.100000.map_build``...) with
+p50/p95/p99 in ms and throughput, or seconds for one-shot phases.
+``--save-baseline`` writes the results as the new baseline; otherwise they
+are compared against it and any metric that got worse by more than
+``--threshold`` is flagged (exit status 1).
+
+Replay logs are JSON lines of ``{"method": ..., "path": ..., "json": ...}``
+(``json`` optional), issued in order by each client from its own offset.
+
+Usage:
+    python benchmarks/run_suite.py --save-baseline
+    python benchmarks/run_suite.py --sections api mcp
+    python benchmarks/run_suite.py --replay traffic.jsonl --render-sizes 10000 1000000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import bench_mcp_transport
+from bench_load import synthetic_geojson
+from bench_state_concurrency import FAKE_REDIS, REQUESTS, run_level, wait_for_port
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+API_PORT = 8000  # the MCP servers' HTTP mode expects the API here
+
+# metric -> True if larger is better
+METRICS = {"p50": False, "p95": False, "p99": False, "rps": True, "seconds": False}
+# Measurements this small swing by more than any sensible threshold from run to
+# run; they're reported but never flagged
+NOISE_FLOOR = {"p50": 0.1, "seconds": 0.02}
+
+
+@contextlib.contextmanager
+def services(redis_url, redis_port):
+    """Run Redis (unless given) and the API server for the duration."""
+    procs = []
+    try:
+        if redis_url is None:
+            procs.append(subprocess.Popen([sys.executable, "-c", FAKE_REDIS, str(redis_port)]))
+            wait_for_port(redis_port)
+            redis_url = f"redis://127.0.0.1:{redis_port}/0"
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(API_PORT),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=ROOT, env=dict(os.environ, REDIS_URL=redis_url),
+        ))
+        wait_for_port(API_PORT)
+        yield redis_url
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait()
+
+
+def load_replay(path):
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                requests.append((entry["method"].upper(), entry["path"], entry.get("json")))
+    return requests
+
+
+def bench_api(args, results):
+    base_url = f"http://127.0.0.1:{API_PORT}"
+    mixes = [("synthetic", REQUESTS)]
+    if args.replay:
+        mixes.append(("replay", load_replay(args.replay)))
+    for label, requests in mixes:
+        for clients in args.clients:
+            r = asyncio.run(run_level(base_url, clients, max(1, args.requests // clients), requests))
+            results[f"api.{label}.c{clients}"] = {k: r[k] for k in ("p50", "p95", "p99", "rps", "errors")}
+
+
+def bench_mcp(args, redis_url, results):
+    for server in ("lowlevel", "fastmcp"):
+        for mode in ("http", "inprocess"):
+            tools = bench_mcp_transport.probe(mode, server, args.calls, redis_url)
+            for name, r in tools.items():
+                results[f"mcp.{server}.{mode}.{name}"] = r
+
+
+def timed(fn):
+    start = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - start
+
+
+def bench_render(args, results):
+    """Time main.main()'s phases outside Streamlit, one dataset size at a time."""
+    sys.path.insert(0, str(ROOT))
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")  # bare-mode warnings
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    warnings.filterwarnings("ignore")
+    import folium
+
+    import main as app
+    from dataset import DatasetEngine
+
+    for n in args.render_sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / f"synthetic_{n}.geojson"
+            synthetic_geojson(source, n)
+            best = {}
+            for _ in range(args.repeat):
+                for phase, seconds in render_phases(app, folium, DatasetEngine, source):
+                    best[phase] = min(seconds, best.get(phase, float("inf")))
+            for phase, seconds in best.items():
+                results[f"render.{n}.{phase}"] = {"seconds": seconds}
+
+
+def render_phases(app, folium, DatasetEngine, source):
+    """One pass over the phases; yields (phase, seconds)."""
+    # data load: cold parses and writes the cache, warm maps it
+    shutil.rmtree(source.parent / ".cache", ignore_errors=True)
+    _, cold = timed(lambda: DatasetEngine(source).get())
+    dataset, warm = timed(lambda: DatasetEngine(source).get())
+    app.facilities_frame.clear()
+    gdf, frame = timed(lambda: app.facilities_frame(dataset, dataset.version))
+    yield from [("load_cold", cold), ("load_warm", warm), ("frame", frame)]
+
+    # filter: two of the five classes, as main() filters and centres the map
+    selection = ["hospital", "clinic"]
+
+    def filter_phase():
+        return dataset.selection_extent(selection)["center"]
+
+    # the SVY21 copy and the per-fclass aggregates are built once per dataset version
+    _, projecting = timed(lambda: dataset.fclass_aggregates)
+    center, filtering = timed(filter_phase)
+    yield from [("project", projecting), ("filter", filtering)]
+
+    # map build: embedded GeoJSON layer (uncached, then cached) and tile layer, rendered to HTML
+    def map_build(add_layer):
+        m = folium.Map(location=center, zoom_start=12, tiles="CartoDB positron")
+        add_layer(m)
+        return len(m.get_root().render())
+
+    app.serialize_selection.clear()
+    _, geojson = timed(lambda: map_build(lambda m: app.add_geojson_layer(m, dataset, selection, 12)))
+    _, cached = timed(lambda: map_build(lambda m: app.add_geojson_layer(m, dataset, selection, 12)))
+    _, tiles = timed(lambda: map_build(lambda m: app.add_vector_tile_layer(m, selection, dataset.version)))
+    yield from [("map_build_geojson", geojson), ("map_build_geojson_cached", cached), ("map_build_tiles", tiles)]
+
+    # the whole view as shown: built and rendered, then taken from the shared map cache
+    def view_phase():
+        return app.show_map(app.cached_map(dataset, selection, center, 12), "folium_map", 500, "100%")
+
+    app.MAP_RENDERER = "geojson"
+    app.get_map_cache().clear()
+    _, view = timed(view_phase)
+    _, view_cached = timed(view_phase)
+    yield from [("map_view", view), ("map_view_cached", view_cached)]
+
+    del dataset, gdf
+    app.facilities_frame.clear()
+    app.serialize_selection.clear()
+    app.get_map_cache().clear()
+    gc.collect()
+
+
+def compare(results, baseline, threshold):
+    """Print metric changes against the baseline; returns the regressions."""
+    regressions = []
+    print(f"\n{'metric':<58} {'baseline':>10} {'now':>10} {'change':>8}")
+    for key, current in results.items():
+        before = baseline.get(key)
+        if before is None:
+            print(f"{key:<58} {'(new)':>10}")
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in current or not before.get(metric):
+                continue
+            change = current[metric] / before[metric] - 1
+            worse = -change if higher_is_better else change
+            noise = any(before.get(m, floor) < floor for m, floor in NOISE_FLOOR.items())
+            flag = "  REGRESSION" if worse > threshold and not noise else ""
+            print(f"{key + '.' + metric:<58} {before[metric]:10.2f} {current[metric]:10.2f} {change:+8.0%}{flag}")
+            if flag:
+                regressions.append(f"{key}.{metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", nargs="+", choices=["api", "mcp", "render"], default=["api", "mcp", "render"])
+    parser.add_argument("--redis-url", help="use this Redis instead of starting fakeredis")
+    parser.add_argument("--redis-port", type=int, default=6379, help="port for the fakeredis server")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--requests", type=int, default=1000, help="requests per API concurrency level")
+    parser.add_argument("--replay", type=Path, help="JSON-lines request log to replay against the API")
+    parser.add_argument("--calls", type=int, default=100, help="timed calls per MCP tool")
+    parser.add_argument("--render-sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3, help="render passes per size; the best is kept")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--output", type=Path, help="also write the results here")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative change flagged as a regression")
+    args = parser.parse_args()
+
+    results = {}
+    if "api" in args.sections or "mcp" in args.sections:
+        with services(args.redis_url, args.redis_port) as redis_url:
+            if "api" in args.sections:
+                bench_api(args, results)
+            if "mcp" in args.sections:
+                bench_mcp(args, redis_url, results)
+    if "render" in args.sections:
+        bench_render(args, results)
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+            ).stdout.strip(),
+        },
+        "results": results,
+    }
+    for key, r in results.items():
+        cells = "  ".join(f"{m} {r[m]:.2f}" for m in METRICS if m in r)
+        print(f"{key:<58} {cells}")
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nbaseline written to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"\nno baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    baseline = json.loads(args.baseline.read_text())
+    print(f"\nbaseline from commit {baseline['meta'].get('commit')} on {baseline['meta'].get('platform')}")
+    regressions = compare(results, baseline["results"], args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
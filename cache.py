@@ -0,0 +1,116 @@
+"""Small thread-safe LRU cache shared by the tile and map renderers."""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Size-bounded LRU mapping with hit/miss counters.
+
+    The cache can be bound to a dataset version with ``ensure_version``: when
+    the version changes, every entry is dropped, so stale renders can never be
+    served after a reload.
+
+    With ``max_bytes``, entries are also evicted to keep the total of
+    ``sizeof(value)`` under that budget; a value larger than the whole budget
+    is not cached at all.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or len
+        self.version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def ensure_version(self, version: Optional[str]):
+        """Clear the cache if it was filled for a different dataset version."""
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self._clear()
+                    self.version = version
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, version: Optional[str] = None):
+        """Store ``value``; with ``version``, only if the cache is still on that version."""
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if version is not None and version != self.version:
+                return  # rendered from a dataset that has since been replaced
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                self._discard(next(iter(self._data)))
+                self.evictions += 1
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def retain(self, previous: Optional[str], version: str, keep: Callable[[Hashable], bool]):
+        """Move to ``version``, keeping the entries of ``previous`` that ``keep`` accepts."""
+        with self._lock:
+            if self.version != previous:
+                self._clear()
+            else:
+                for key in [k for k in self._data if not keep(k)]:
+                    self._discard(key)
+            self.version = version
+
+    def _discard(self, key: Hashable):
+        if key in self._data:
+            del self._data[key]
+            self.bytes -= self._sizes.pop(key)
+
+    def _clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "version": self.version,
+        }
@@ -0,0 +1,99 @@
+"""Per-key coalescing of bursts of partial updates into one write per window."""
+
+import asyncio
+import contextlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class Coalescer:
+    """Merge rapid partial updates per key so each key is written at most once per window
+
+    The first update after a quiet period is applied straight away, so a
+    single change isn't delayed. Updates arriving within ``window`` seconds of
+    the last write are merged (later fields win) and applied together when the
+    window closes; their callers wait for that write and all get its result.
+    With ``window`` 0 every update is applied immediately.
+
+    Writes that must not be merged go through ``exclusive``, which lands any
+    held update first so the two stay in order.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        apply: Callable[[Hashable, dict], Awaitable[Any]],
+        on_merge: Optional[Callable[[], None]] = None,
+    ):
+        self.window = window
+        self.apply = apply
+        self.on_merge = on_merge
+        self._pending: Dict[Hashable, dict] = {}
+        self._waiters: Dict[Hashable, asyncio.Future] = {}
+        # one timer and lock per key with an open window
+        self._timers: Dict[Hashable, asyncio.Task] = {}
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+    async def submit(self, key: Hashable, fields: dict) -> Any:
+        """Apply ``fields`` to ``key`` now or with the window's trailing write"""
+        if self.window <= 0:
+            return await self.apply(key, fields)
+        if key not in self._timers:
+            lock = self._locks[key] = asyncio.Lock()
+            self._timers[key] = asyncio.create_task(self._close_windows(key))
+            # held so an exclusive write can't land before this one
+            async with lock:
+                return await self.apply(key, fields)
+
+        if key in self._pending and self.on_merge is not None:
+            self.on_merge()
+        self._pending.setdefault(key, {}).update(fields)
+        waiter = self._waiters.get(key)
+        if waiter is None:
+            waiter = self._waiters[key] = asyncio.get_running_loop().create_future()
+        # shield: one cancelled request must not cancel the shared write
+        return await asyncio.shield(waiter)
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self, key: Hashable):
+        """Hold ``key`` for a write that bypasses coalescing, flushing first"""
+        lock = self._locks.get(key)
+        if lock is None:
+            yield  # no open window, so nothing held or in flight
+            return
+        async with lock:
+            await self._flush(key)
+            yield
+
+    async def _flush(self, key: Hashable):
+        fields = self._pending.pop(key, None)
+        if fields is None:
+            return
+        waiter = self._waiters.pop(key)
+        try:
+            result = await self.apply(key, fields)
+        except Exception as exc:
+            waiter.set_exception(exc)
+            waiter.exception()  # mark retrieved in case every caller went away
+            return
+        waiter.set_result(result)
+
+    async def _close_windows(self, key: Hashable):
+        """Flush at the end of each window; stop after one with nothing to flush"""
+        lock = self._locks[key]
+        try:
+            while True:
+                await asyncio.sleep(self.window)
+                async with lock:
+                    if key not in self._pending:
+                        return
+                    await self._flush(key)
+        finally:
+            del self._timers[key], self._locks[key]
+
+    async def close(self):
+        """Flush everything still pending and stop the timers"""
+        for key in list(self._pending):
+            async with self.exclusive(key):
+                pass
+        for timer in list(self._timers.values()):
+            timer.cancel()
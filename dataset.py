@@ -0,0 +1,1130 @@
+"""Resident in-memory dataset engine for the health facilities data file.
+
+The GeoJSON file is parsed once into a compact columnar snapshot and kept in
+memory. The engine re-checks the file's mtime/size at most once per
+``check_interval`` seconds and only reloads when the content hash changes.
+
+The first load of a version also writes a binary columnar cache (flat NumPy
+coordinate/offset arrays plus attribute columns) to ``data/.cache``. Later
+loads memory-map those arrays instead of parsing text, and a small index file
+maps the source's mtime/size to its version so an unchanged file isn't even
+hashed.
+
+Each snapshot also carries a level-of-detail pyramid: per zoom band, a
+topology-preserving simplified copy of the geometries, built on first use and
+cached next to the columnar data, keyed by dataset version.
+
+With ``DatasetEngine.watch()`` the file is watched from a background thread
+instead, and a new version is fully built before it is swapped in. Every row
+keeps a digest of its feature, so a new version only parses, projects and
+simplifies the features that changed (``DatasetDiff``) and reuses the rest.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+
+from watcher import FileWatcher
+
+DATA_PATH = (Path(__file__).parent / "data" / "health_sg.geojson").resolve()
+
+# Singapore's projected CRS (SVY21 / Singapore TM), in metres. Distances, areas
+# and centroids are computed in it rather than in degrees.
+SVY21 = "EPSG:3414"
+
+# Upper zoom of each level-of-detail band; zooms above the last band get the
+# full-resolution geometries.
+LOD_BANDS = (8, 10, 12, 14, 16)
+
+
+def lod_band(zoom: Optional[float]) -> Optional[int]:
+    """The LOD band serving a zoom level, or None for full resolution."""
+    if zoom is None:
+        return None
+    for band in LOD_BANDS:
+        if zoom <= band:
+            return band
+    return None
+
+
+def lod_tolerance(band: int) -> float:
+    """Simplification tolerance in degrees: half a 256px-tile pixel at ``band``."""
+    return 360.0 / (256 * 2 ** band) / 2
+
+
+# Features per GEOS parse when streaming a GeoJSON file. Parsing the whole
+# document at once builds a DOM several times the file's size.
+GEOJSON_BATCH = 20_000
+
+# Sidecar files that belong to a shapefile source and feed its version hash.
+SHAPEFILE_SIDECARS = (".dbf", ".shx", ".prj", ".cpg")
+
+
+def cache_prefix(source: Path, version: str) -> Path:
+    """Path prefix for derived files of one version of ``source``."""
+    return source.parent / ".cache" / f"{source.stem}-{version}"
+
+
+def source_files(source: Path) -> List[Path]:
+    """The file itself plus, for shapefiles, its sidecars that exist."""
+    files = [source]
+    if source.suffix.lower() == ".shp":
+        files += [p for p in (source.with_suffix(s) for s in SHAPEFILE_SIDECARS) if p.exists()]
+    return files
+
+
+def watched_files(source: Path) -> List[Path]:
+    """Every file whose change means a new version, whether it exists yet or not."""
+    if source.suffix.lower() == ".shp":
+        return [source] + [source.with_suffix(s) for s in SHAPEFILE_SIDECARS]
+    return [source]
+
+
+def source_stat(source: Path) -> List[List[int]]:
+    """mtime/size of every source file; raises OSError if the source is missing."""
+    stats = []
+    for path in source_files(source):
+        st = os.stat(path)
+        stats.append([st.st_mtime_ns, st.st_size])
+    return stats
+
+
+def save_geometries(directory: Path, geometries: np.ndarray) -> dict:
+    """Write geometries as flat .npy arrays that ``load_geometries`` can memory-map.
+
+    Geometries are stored as shapely ragged arrays (coordinates plus offsets);
+    mixes of geometry types that have no ragged form fall back to WKB.
+    Returns the metadata ``load_geometries`` needs.
+    """
+    try:
+        geom_type, coords, offsets = shapely.to_ragged_array(geometries)
+    except ValueError:
+        wkb = shapely.to_wkb(geometries)
+        lengths = np.array([len(b) if b is not None else 0 for b in wkb], dtype=np.int64)
+        blob = np.frombuffer(b"".join(b for b in wkb if b is not None), dtype=np.uint8)
+        np.save(directory / "wkb.npy", blob)
+        np.save(directory / "wkb_offsets.npy", np.concatenate(([0], np.cumsum(lengths))))
+        return {"wkb": True}
+    np.save(directory / "coords.npy", coords)
+    for i, arr in enumerate(offsets):
+        np.save(directory / f"offsets{i}.npy", arr)
+    return {"ragged": int(geom_type), "offsets": len(offsets)}
+
+
+def load_geometries(directory: Path, meta: dict) -> np.ndarray:
+    load = lambda name: np.load(directory / name, mmap_mode="r")
+    if "ragged" in meta:
+        offsets = tuple(load(f"offsets{i}.npy") for i in range(meta["offsets"]))
+        return shapely.from_ragged_array(
+            shapely.GeometryType(meta["ragged"]), load("coords.npy"), offsets
+        )
+    blob = load("wkb.npy")
+    offsets = load("wkb_offsets.npy")
+    parts = [blob[a:b].tobytes() if b > a else None for a, b in zip(offsets[:-1], offsets[1:])]
+    return shapely.from_wkb(np.array(parts, dtype=object))
+
+
+# Rough per-object cost of a GEOS geometry and its Python wrapper beyond the
+# coordinates, and of one STRtree item; for memory budgets, not accounting.
+GEOMETRY_OVERHEAD = 200
+TREE_ITEM_BYTES = 64
+
+
+def geometry_nbytes(geometries: np.ndarray) -> int:
+    """Estimated resident size of an array of geometries."""
+    coords = int(shapely.get_num_coordinates(geometries).sum())
+    return coords * 16 + len(geometries) * (GEOMETRY_OVERHEAD + 8)
+
+
+def write_directory(directory: Path, writer):
+    """Run ``writer(tmp_dir)`` and atomically rename the result to ``directory``."""
+    tmp = directory.with_name(f"{directory.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    try:
+        writer(tmp)
+        os.replace(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not directory.exists():  # else another process won the race
+            raise
+
+
+class LodPyramid:
+    """Simplified geometries per zoom band for one dataset version.
+
+    Bands are loaded (or simplified and saved) on first use, so a process
+    only holds the bands its clients actually ask for.
+    """
+
+    def __init__(self, geometries: np.ndarray, prefix: Optional[Path] = None):
+        self.full = geometries
+        self.prefix = prefix
+        self.bands: Dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def band_path(self, band: int) -> Optional[Path]:
+        if self.prefix is None:
+            return None
+        return self.prefix.with_name(f"{self.prefix.name}.lod-z{band}")
+
+    def band(self, band: int) -> np.ndarray:
+        geoms = self.bands.get(band)
+        if geoms is None:
+            with self._lock:
+                geoms = self.bands.get(band)
+                if geoms is None:
+                    geoms = self.bands[band] = self._load_or_build(band)
+        return geoms
+
+    def _load_or_build(self, band: int, base: Optional[Tuple[np.ndarray, "DatasetDiff"]] = None) -> np.ndarray:
+        path = self.band_path(band)
+        if path is not None and path.exists():
+            try:
+                meta = json.loads((path / "meta.json").read_text())
+                geoms = load_geometries(path, meta)
+                if len(geoms) == len(self.full):
+                    return geoms
+            except (OSError, ValueError, KeyError, shapely.errors.GEOSException):
+                pass  # corrupt or stale; rebuild it
+        if base is not None:
+            # the previous version's band, re-simplifying only changed rows
+            previous, diff = base
+            fresh = shapely.simplify(self.full[diff.fresh], lod_tolerance(band), preserve_topology=True)
+            geoms = diff.merge(previous, fresh)
+        else:
+            geoms = shapely.simplify(self.full, lod_tolerance(band), preserve_topology=True)
+        if path is not None:
+            def writer(tmp):
+                meta = save_geometries(tmp, geoms)
+                (tmp / "meta.json").write_text(json.dumps(meta))
+            try:
+                write_directory(path, writer)
+            except OSError:
+                pass  # read-only data dir; keep the band in memory only
+        return geoms
+
+    def for_zoom(self, zoom: Optional[float]) -> np.ndarray:
+        band = lod_band(zoom)
+        return self.full if band is None else self.band(band)
+
+    def inherit(self, previous: "LodPyramid", diff: "DatasetDiff"):
+        """Build every band ``previous`` had loaded from its unchanged rows."""
+        for band, geoms in list(previous.bands.items()):
+            if band not in self.bands:
+                self.bands[band] = self._load_or_build(band, (geoms, diff))
+
+
+@lru_cache(maxsize=2)
+def svy21_transformer(inverse: bool = False):
+    """pyproj transformer from lon/lat to SVY21 metres (or back, if ``inverse``)."""
+    from pyproj import Transformer  # only needed once analytics are used
+
+    crs = ("EPSG:4326", SVY21)
+    return Transformer.from_crs(*(crs[::-1] if inverse else crs), always_xy=True)
+
+
+def transform_arrays(transformer, x, y) -> Tuple[np.ndarray, np.ndarray]:
+    """``transformer.transform`` over coordinate arrays of any length."""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if x.size == 1:
+        # pyproj takes a one-element array for a scalar, which NumPy deprecates
+        tx, ty = transformer.transform(x.item(), y.item())
+        return np.full(x.shape, tx), np.full(y.shape, ty)
+    return transformer.transform(x, y)
+
+
+def to_svy21(geometries: np.ndarray) -> np.ndarray:
+    """Project lon/lat geometries to SVY21 in one pass over their coordinates."""
+    transformer = svy21_transformer()
+    return shapely.transform(geometries, lambda xy: np.column_stack(transform_arrays(transformer, xy[:, 0], xy[:, 1])))
+
+
+def project_point(lon: float, lat: float) -> shapely.Point:
+    return shapely.Point(*svy21_transformer().transform(lon, lat))
+
+
+def from_svy21(x, y) -> Tuple[np.ndarray, np.ndarray]:
+    """lon, lat arrays for SVY21 coordinates."""
+    return transform_arrays(svy21_transformer(inverse=True), x, y)
+
+
+class ProjectedGeometries:
+    """SVY21 copy of a dataset's geometries with per-row centroids, areas and bounds.
+
+    Built on first use and cached next to the columnar data, keyed by dataset
+    version, like the LOD bands.
+    """
+
+    def __init__(self, geometries: np.ndarray, centroids: np.ndarray, areas: np.ndarray, bounds: np.ndarray):
+        self.geometries = geometries
+        self.centroids = centroids  # float64 (n, 2): x, y in metres; NaN for null geometries
+        self.areas = areas  # float64 (n,): square metres
+        self.bounds = bounds  # float64 (n, 4): minx, miny, maxx, maxy in metres
+
+    @cached_property
+    def tree(self) -> shapely.STRtree:
+        """STRtree over the projected geometries; row i is tree item i."""
+        return shapely.STRtree(self.geometries)
+
+    @classmethod
+    def build(
+        cls, geometries: np.ndarray, base: Optional[Tuple["ProjectedGeometries", "DatasetDiff"]] = None
+    ) -> "ProjectedGeometries":
+        if base is not None:
+            # the previous version's rows, projecting only changed ones
+            previous, diff = base
+            fresh = cls.build(geometries[diff.fresh])
+            return cls(*(
+                diff.merge(getattr(previous, name), getattr(fresh, name))
+                for name in ("geometries", "centroids", "areas", "bounds")
+            ))
+        projected = to_svy21(geometries)
+        centroids = shapely.get_coordinates(shapely.centroid(projected), include_z=False)
+        # get_coordinates skips missing geometries; put NaN rows back in place
+        xy = np.full((len(projected), 2), np.nan)
+        xy[~shapely.is_missing(projected) & ~shapely.is_empty(projected)] = centroids
+        return cls(projected, xy, shapely.area(projected), shapely.bounds(projected))
+
+    @classmethod
+    def load_or_build(
+        cls,
+        geometries: np.ndarray,
+        prefix: Optional[Path] = None,
+        base: Optional[Tuple["ProjectedGeometries", "DatasetDiff"]] = None,
+    ) -> "ProjectedGeometries":
+        path = prefix.with_name(f"{prefix.name}.svy21") if prefix is not None else None
+        if path is not None and path.exists():
+            try:
+                meta = json.loads((path / "meta.json").read_text())
+                load = lambda name: np.load(path / name, mmap_mode="r")
+                projected = cls(load_geometries(path, meta), load("centroids.npy"), load("areas.npy"), load("bounds.npy"))
+                if len(projected.geometries) == len(geometries):
+                    return projected
+            except (OSError, ValueError, KeyError, shapely.errors.GEOSException):
+                pass  # corrupt or stale; rebuild it
+        projected = cls.build(geometries, base)
+        if path is not None:
+            def writer(tmp):
+                meta = save_geometries(tmp, projected.geometries)
+                for name in ("centroids", "areas", "bounds"):
+                    np.save(tmp / f"{name}.npy", getattr(projected, name))
+                (tmp / "meta.json").write_text(json.dumps(meta))
+            try:
+                write_directory(path, writer)
+            except OSError:
+                pass  # read-only data dir; keep it in memory only
+        return projected
+
+
+@dataclass(frozen=True)
+class FclassAggregates:
+    """Per-fclass sums for framing any selection in O(#fclasses).
+
+    Arrays are indexed by fclass code. A selection's centre is the sum of its
+    classes' centroid sums over the sum of their counts; its bounding box is
+    the min/max over their boxes.
+    """
+
+    counts: np.ndarray  # int64 (k,): rows with a geometry
+    centroid_sums: np.ndarray  # float64 (k, 2): summed SVY21 centroids
+    bounds: np.ndarray  # float64 (k, 4): lon/lat box, NaN for classes without geometry
+
+    @classmethod
+    def build(cls, codes: np.ndarray, centroids: np.ndarray, bounds: np.ndarray, k: int) -> "FclassAggregates":
+        valid = (codes >= 0) & ~np.isnan(centroids).any(axis=1)
+        codes, centroids, bounds = codes[valid], centroids[valid], bounds[valid]
+        sums = np.column_stack([np.bincount(codes, weights=centroids[:, i], minlength=k) for i in (0, 1)])
+        boxes = np.full((k, 4), np.nan)
+        if len(codes):
+            order = np.argsort(codes, kind="stable")
+            present, starts = np.unique(codes[order], return_index=True)
+            sorted_bounds = bounds[order]
+            boxes[present, :2] = np.minimum.reduceat(sorted_bounds[:, :2], starts)
+            boxes[present, 2:] = np.maximum.reduceat(sorted_bounds[:, 2:], starts)
+        return cls(np.bincount(codes, minlength=k), sums.reshape(k, 2), boxes)
+
+
+def feature_digest(feature) -> int:
+    """64-bit content hash of one decoded feature, to match it across versions.
+
+    Hashing the canonical JSON rather than the source text keeps features
+    matched when the file is only reformatted.
+    """
+    text = json.dumps(feature, sort_keys=True, separators=(",", ":")).encode()
+    return int.from_bytes(hashlib.blake2b(text, digest_size=8).digest(), "little")
+
+
+def row_digests(fclass_values, names, osm_ids, geometries: np.ndarray) -> np.ndarray:
+    """Feature digests from parsed columns, for sources without feature text."""
+    wkb = shapely.to_wkb(geometries)
+    return np.array(
+        [
+            feature_digest([str(fclass), str(name), str(osm_id), geom.hex() if geom else None])
+            for fclass, name, osm_id, geom in zip(fclass_values, names, osm_ids, wkb)
+        ],
+        dtype=np.uint64,
+    )
+
+
+def match_rows(
+    previous: np.ndarray, digests: np.ndarray, order: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(rows, previous rows) of the features in ``digests`` already in ``previous``.
+
+    ``order`` is ``np.argsort(previous)``, for callers matching several batches.
+    """
+    if len(previous) == 0 or len(digests) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    if order is None:
+        order = np.argsort(previous, kind="stable")
+    pos = np.minimum(np.searchsorted(previous, digests, sorter=order), len(previous) - 1)
+    found = previous[order[pos]] == digests
+    return np.flatnonzero(found), order[pos[found]]
+
+
+def other_rows(n: int, rows: np.ndarray) -> np.ndarray:
+    """Sorted indices in ``range(n)`` that are not in ``rows``."""
+    mask = np.ones(n, dtype=bool)
+    mask[rows] = False
+    return np.flatnonzero(mask)
+
+
+@dataclass(frozen=True)
+class DatasetDiff:
+    """Which rows of a new version are unchanged from the previous one.
+
+    Features are matched by content digest; of the rest, those whose
+    ``osm_id`` existed before count as changed and the others as added. Every
+    per-row structure of the new version can be assembled from the previous
+    one's ``kept_from`` rows plus freshly computed ``fresh`` rows (``merge``).
+    """
+
+    previous_version: str
+    version: str
+    kept: np.ndarray  # new rows whose feature is unchanged
+    kept_from: np.ndarray  # the same features' rows in the previous version
+    fresh: np.ndarray  # new rows that had to be parsed
+    added: int
+    changed: int
+    removed: int
+    bounds: np.ndarray  # float64 (m, 4): lon/lat boxes of every touched feature, old and new
+    fclasses: List[str]  # fclasses of every touched feature, old and new
+
+    @classmethod
+    def between(cls, previous: "Dataset", dataset: "Dataset") -> Optional["DatasetDiff"]:
+        """Diff two versions; None when either has no feature digests."""
+        if previous.feature_digests is None or dataset.feature_digests is None:
+            return None
+        kept, kept_from = match_rows(previous.feature_digests, dataset.feature_digests)
+        fresh = other_rows(len(dataset), kept)
+        gone = other_rows(len(previous), kept_from)
+        existed = np.isin(dataset.osm_ids[fresh], previous.osm_ids[gone])
+        bounds = np.concatenate([dataset.bounds[fresh], previous.bounds[gone]])
+        codes = [(previous, np.unique(previous.fclass_codes[gone])), (dataset, np.unique(dataset.fclass_codes[fresh]))]
+        return cls(
+            previous_version=previous.version,
+            version=dataset.version,
+            kept=kept,
+            kept_from=kept_from,
+            fresh=fresh,
+            added=int((~existed).sum()),
+            changed=int(existed.sum()),
+            removed=int((~np.isin(previous.osm_ids[gone], dataset.osm_ids[fresh])).sum()),
+            bounds=bounds[~np.isnan(bounds).any(axis=1)],
+            fclasses=sorted({d.fclasses[c] for d, cs in codes for c in cs if c >= 0}),
+        )
+
+    @property
+    def rows(self) -> int:
+        return len(self.kept) + len(self.fresh)
+
+    def merge(self, previous: np.ndarray, fresh: np.ndarray) -> np.ndarray:
+        """Per-row array for the new version from the previous one and the fresh rows."""
+        out = np.empty((self.rows, *previous.shape[1:]), dtype=previous.dtype)
+        out[self.kept] = previous[self.kept_from]
+        out[self.fresh] = fresh
+        return out
+
+    def touches(self, bbox: Tuple[float, float, float, float], fclasses: Optional[List[str]] = None) -> bool:
+        """Whether anything inside lon/lat ``bbox`` of these fclasses (None: any) changed."""
+        if fclasses is not None and not set(fclasses) & set(self.fclasses):
+            return False
+        b = self.bounds
+        return bool(
+            ((b[:, 0] <= bbox[2]) & (b[:, 2] >= bbox[0]) & (b[:, 1] <= bbox[3]) & (b[:, 3] >= bbox[1])).any()
+        )
+
+    def summary(self) -> dict:
+        """JSON-ready description for change notifications."""
+        b = self.bounds
+        return {
+            "dataset_version": self.version,
+            "previous_version": self.previous_version,
+            "added": self.added,
+            "changed": self.changed,
+            "removed": self.removed,
+            "bounds": [float(v) for v in (*b[:, :2].min(axis=0), *b[:, 2:].max(axis=0))] if len(b) else None,
+            "fclasses": self.fclasses,
+        }
+
+
+@dataclass(frozen=True, eq=False)
+class Dataset:
+    """Immutable columnar snapshot of one version of the data file."""
+
+    version: str
+    fclasses: List[str]  # unique fclass values, in file order
+    fclass_codes: np.ndarray  # int16 index into ``fclasses`` per row
+    names: np.ndarray  # str per row
+    osm_ids: np.ndarray  # str per row
+    bounds: np.ndarray  # float64 (n, 4): minx, miny, maxx, maxy
+    geometries: np.ndarray  # shapely geometries per row
+    fclass_rows: Dict[str, np.ndarray] = field(default_factory=dict)
+    source: Optional[Path] = None
+    loaded_at: float = field(default_factory=time.time)
+    feature_digests: Optional[np.ndarray] = None  # uint64 per row, see ``DatasetDiff``
+
+    def __len__(self) -> int:
+        return len(self.fclass_codes)
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory held by this snapshot and whatever has been built from it."""
+        built = self.__dict__
+        total = geometry_nbytes(self.geometries) + sum(
+            a.nbytes for a in (self.fclass_codes, self.names, self.osm_ids, self.bounds)
+        )
+        if "tree" in built:
+            total += len(self) * TREE_ITEM_BYTES
+        if "projected" in built:
+            projected = self.projected
+            total += geometry_nbytes(projected.geometries) + sum(
+                a.nbytes for a in (projected.centroids, projected.areas, projected.bounds)
+            )
+            if "tree" in projected.__dict__:
+                total += len(self) * TREE_ITEM_BYTES
+        if "lod" in built:
+            total += sum(geometry_nbytes(g) for g in list(self.lod.bands.values()))
+        return total
+
+    @cached_property
+    def lod(self) -> LodPyramid:
+        """Level-of-detail pyramid, loaded from or saved next to the source file."""
+        prefix = cache_prefix(self.source, self.version) if self.source else None
+        return LodPyramid(self.geometries, prefix)
+
+    @cached_property
+    def projected(self) -> ProjectedGeometries:
+        """Geometries in SVY21 metres, for distance, area and centroid analytics."""
+        prefix = cache_prefix(self.source, self.version) if self.source else None
+        return ProjectedGeometries.load_or_build(self.geometries, prefix)
+
+    @cached_property
+    def fclass_aggregates(self) -> FclassAggregates:
+        """Counts, centroid sums and bounding boxes per fclass."""
+        return FclassAggregates.build(
+            np.asarray(self.fclass_codes, dtype=np.int64),
+            self.projected.centroids,
+            np.asarray(self.bounds),
+            len(self.fclasses),
+        )
+
+    def selection_extent(self, fclasses: Optional[List[str]] = None) -> Optional[dict]:
+        """Feature count, lon/lat bounds and [lat, lon] centre of some fclasses.
+
+        Combines the per-fclass aggregates, so the cost depends on the number
+        of classes, not features. None when the selection has no geometry.
+        """
+        names = self.fclasses if fclasses is None else [f for f in set(fclasses) if f in self.fclass_rows]
+        codes = [self.fclasses.index(f) for f in names]
+        agg = self.fclass_aggregates
+        count = int(agg.counts[codes].sum())
+        if count == 0:
+            return None
+        lon, lat = from_svy21(*(agg.centroid_sums[codes].sum(axis=0) / count))
+        boxes = agg.bounds[codes]
+        bounds = [*np.nanmin(boxes[:, :2], axis=0), *np.nanmax(boxes[:, 2:], axis=0)]
+        return {
+            "count": count,
+            "bounds": [float(v) for v in bounds],
+            "center": [float(lat), float(lon)],
+        }
+
+    def warm(self):
+        """Build everything that is otherwise built on first use.
+
+        For processes forked after loading, which then share the result
+        instead of each building their own.
+        """
+        self.tree
+        self.projected.tree
+        for band in LOD_BANDS:
+            self.lod.band(band)
+        self.fclass_aggregates
+        self.extent
+
+    def inherit(self, previous: "Dataset", diff: DatasetDiff):
+        """Build what ``previous`` had built, reusing its rows for unchanged features.
+
+        The engine calls this before publishing a new version, so no request
+        pays for projecting or simplifying it.
+        """
+        prefix = cache_prefix(self.source, self.version) if self.source else None
+        if "projected" in previous.__dict__ and "projected" not in self.__dict__:
+            self.__dict__["projected"] = ProjectedGeometries.load_or_build(
+                self.geometries, prefix, (previous.projected, diff)
+            )
+        if "lod" in previous.__dict__:
+            self.lod.inherit(previous.lod, diff)
+        for name in ("fclass_aggregates", "tree"):
+            if name in previous.__dict__:
+                getattr(self, name)
+
+    @property
+    def fclass_values(self) -> np.ndarray:
+        """fclass name per row (None where a feature has none)."""
+        names = np.array(self.fclasses + [None], dtype=object)
+        return names[self.fclass_codes]
+
+    @cached_property
+    def tree(self) -> shapely.STRtree:
+        """STRtree over the feature geometries; row i is tree item i."""
+        return shapely.STRtree(self.geometries)
+
+    def filter_rows(self, rows: np.ndarray, fclasses: Optional[List[str]]) -> np.ndarray:
+        if fclasses is None:
+            return rows
+        wanted = [self.fclasses.index(f) for f in set(fclasses) if f in self.fclass_rows]
+        return rows[np.isin(self.fclass_codes[rows], wanted)]
+
+    def query_bbox(
+        self, bbox: Tuple[float, float, float, float], fclasses: Optional[List[str]] = None
+    ) -> np.ndarray:
+        """Rows whose geometry intersects ``bbox`` (minx, miny, maxx, maxy)."""
+        rows = self.tree.query(shapely.box(*bbox), predicate="intersects")
+        return np.sort(self.filter_rows(rows, fclasses))
+
+    def query_radius(
+        self, lon: float, lat: float, radius_m: float, fclasses: Optional[List[str]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows within ``radius_m`` metres of a point, nearest first, with distances in SVY21 metres."""
+        projected = self.projected
+        point = project_point(lon, lat)
+        rows = self.filter_rows(projected.tree.query(point, predicate="dwithin", distance=radius_m), fclasses)
+        dist = shapely.distance(projected.geometries[rows], point)
+        order = np.argsort(dist, kind="stable")
+        return rows[order], dist[order]
+
+    def nearest(
+        self, lon: float, lat: float, k: int = 1, fclasses: Optional[List[str]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The ``k`` rows nearest to a point, nearest first, with distances in SVY21 metres."""
+        empty = np.empty(0, dtype=np.int64), np.empty(0)
+        if len(self) == 0 or k <= 0:
+            return empty
+        projected = self.projected
+        point = project_point(lon, lat)
+        # Seed the search radius with the distance to the nearest feature of
+        # any class, then widen it until enough matching rows fall inside.
+        seed = projected.tree.query_nearest(point, return_distance=True)[1]
+        if len(seed) == 0:
+            return empty  # no feature has a geometry
+        radius = max(float(seed[0]), 1.0)
+        b = projected.bounds
+        x, y = point.x, point.y
+        max_radius = float(np.hypot(
+            max(np.nanmax(b[:, 2]), x) - min(np.nanmin(b[:, 0]), x),
+            max(np.nanmax(b[:, 3]), y) - min(np.nanmin(b[:, 1]), y),
+        ))
+        while True:
+            rows = self.filter_rows(projected.tree.query(point, predicate="dwithin", distance=radius), fclasses)
+            if len(rows) >= k or radius > max_radius:
+                break
+            radius *= 4
+        dist = shapely.distance(projected.geometries[rows], point)
+        order = np.argsort(dist, kind="stable")[:k]
+        return rows[order], dist[order]
+
+    @cached_property
+    def extent(self) -> Tuple[float, float, float, float]:
+        """Bounding box of the whole dataset."""
+        if len(self) == 0:
+            return (0.0, 0.0, 0.0, 0.0)
+        b = self.bounds
+        return (
+            float(np.nanmin(b[:, 0])),
+            float(np.nanmin(b[:, 1])),
+            float(np.nanmax(b[:, 2])),
+            float(np.nanmax(b[:, 3])),
+        )
+
+    def feature(self, row: int, geometry: bool = True, zoom: Optional[float] = None) -> dict:
+        """GeoJSON Feature dict for one row, simplified for ``zoom`` if given."""
+        code = self.fclass_codes[row]
+        geom = self.lod.for_zoom(zoom)[row] if zoom is not None else self.geometries[row]
+        return {
+            "type": "Feature",
+            "properties": {
+                "osm_id": str(self.osm_ids[row]),
+                "fclass": self.fclasses[code] if code >= 0 else None,
+                "name": str(self.names[row]),
+            },
+            "geometry": json.loads(shapely.to_geojson(geom)) if geometry and geom is not None else None,
+        }
+
+    def rows_for(self, fclasses: Optional[List[str]] = None) -> np.ndarray:
+        """Return sorted row indices for the given fclasses (all rows if None)."""
+        if fclasses is None:
+            return np.arange(len(self), dtype=np.int64)
+        parts = [self.fclass_rows[f] for f in set(fclasses) if f in self.fclass_rows]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+
+def file_digest(data: bytes) -> str:
+    """Short content hash used as the dataset version."""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def build_dataset(
+    fclass_values,
+    names,
+    osm_ids,
+    geometries: np.ndarray,
+    version: str,
+    source: Optional[Path] = None,
+    digests: Optional[np.ndarray] = None,
+) -> Dataset:
+    """Assemble a ``Dataset`` from per-row columns."""
+    fclasses: List[str] = []
+    fclass_index: Dict[str, int] = {}
+    codes = np.full(len(geometries), -1, dtype=np.int16)
+    for i, val in enumerate(fclass_values):
+        if isinstance(val, str):
+            if val not in fclass_index:
+                fclass_index[val] = len(fclasses)
+                fclasses.append(val)
+            codes[i] = fclass_index[val]
+
+    fclass_rows = {
+        name: np.flatnonzero(codes == idx) for name, idx in fclass_index.items()
+    }
+    return Dataset(
+        version=version,
+        fclasses=fclasses,
+        fclass_codes=codes,
+        names=np.array([n or "" for n in names], dtype=str),
+        osm_ids=np.array([str(o or "") for o in osm_ids], dtype=str),
+        bounds=shapely.bounds(geometries),
+        geometries=geometries,
+        fclass_rows=fclass_rows,
+        source=source,
+        feature_digests=digests,
+    )
+
+
+FEATURES_ARRAY = re.compile(r'"features"\s*:\s*\[')
+WHITESPACE = re.compile(r"\s*")
+
+
+def iter_features(text: str):
+    """Yield (feature, start, end) for each entry of the top-level features array.
+
+    Features are decoded one at a time, so only the current one is ever held
+    as Python objects; ``text[start:end]`` is its source text.
+    """
+    match = FEATURES_ARRAY.search(text)
+    if match is None:
+        raise ValueError("no features array")
+    decoder = json.JSONDecoder()
+    pos = WHITESPACE.match(text, match.end()).end()
+    if text[pos] == "]":
+        return
+    while True:
+        feature, end = decoder.raw_decode(text, pos)
+        yield feature, pos, end
+        pos = WHITESPACE.match(text, end).end()
+        if text[pos] == "]":
+            return
+        if text[pos] != ",":
+            raise ValueError(f"unexpected {text[pos]!r} at offset {pos}")
+        pos = WHITESPACE.match(text, pos + 1).end()
+
+
+def parse_geometry_batch(texts: List[Optional[str]]) -> np.ndarray:
+    """Geometries of a batch of Feature texts; ``None`` marks a null geometry."""
+    present = [t for t in texts if t is not None]
+    geoms = None
+    # GEOS parses a whole collection in one pass, several times faster than
+    # feature by feature; it rejects null geometries, so those are left out
+    try:
+        geoms = shapely.get_parts(
+            shapely.from_geojson('{"type":"FeatureCollection","features":[' + ",".join(present) + "]}")
+        )
+    except shapely.errors.GEOSException:
+        pass
+    if geoms is None or len(geoms) != len(present):
+        geoms = shapely.from_geojson(np.array(present, dtype=object))
+    out = np.full(len(texts), None, dtype=object)
+    out[[i for i, t in enumerate(texts) if t is not None]] = geoms
+    return out
+
+
+def parse_geojson(
+    data: bytes, version: str, source: Optional[Path] = None, previous: Optional[Dataset] = None
+) -> Dataset:
+    """Parse raw GeoJSON bytes into a columnar ``Dataset``.
+
+    The features array is streamed and its geometries parsed in batches of
+    ``GEOJSON_BATCH``, keeping peak memory near the size of the file. Features
+    whose digest is in ``previous`` take its already parsed geometry.
+    """
+    reuse = previous if previous is not None and previous.feature_digests is not None else None
+    order = np.argsort(reuse.feature_digests, kind="stable") if reuse is not None else None
+
+    def parse_batch(texts, digests):
+        geoms = np.full(len(texts), None, dtype=object)
+        fresh = np.arange(len(texts))
+        if reuse is not None:
+            kept, kept_from = match_rows(reuse.feature_digests, digests, order)
+            geoms[kept] = reuse.geometries[kept_from]
+            fresh = other_rows(len(texts), kept)
+        geoms[fresh] = parse_geometry_batch([texts[i] for i in fresh])
+        return geoms
+
+    text = data.decode("utf-8-sig")
+    fclass_values, names, osm_ids, digests, parts, batch = [], [], [], [], [], []
+    try:
+        for feat, start, end in iter_features(text):
+            props = feat.get("properties", {}) or {}
+            fclass_values.append(props.get("fclass"))
+            names.append(props.get("name"))
+            osm_ids.append(props.get("osm_id"))
+            digests.append(feature_digest(feat))
+            batch.append(text[start:end] if feat.get("geometry") else None)
+            if len(batch) == GEOJSON_BATCH:
+                parts.append(parse_batch(batch, np.array(digests[-len(batch):], dtype=np.uint64)))
+                batch = []
+    except (ValueError, IndexError):
+        return parse_geojson_document(data, version, source)
+    if batch:
+        parts.append(parse_batch(batch, np.array(digests[-len(batch):], dtype=np.uint64)))
+    geoms = np.concatenate(parts) if parts else np.empty(0, dtype=object)
+    return build_dataset(
+        fclass_values, names, osm_ids, geoms, version, source, np.array(digests, dtype=np.uint64)
+    )
+
+
+def parse_geojson_document(data: bytes, version: str, source: Optional[Path] = None) -> Dataset:
+    """Whole-document fallback for GeoJSON the streaming parser can't follow."""
+    features = json.loads(data).get("features", [])
+    digests = np.array([feature_digest(f) for f in features], dtype=np.uint64)
+    props = [feat.get("properties", {}) or {} for feat in features]
+    geoms = shapely.from_geojson(
+        np.array(
+            [json.dumps(f["geometry"]) if f.get("geometry") else None for f in features],
+            dtype=object,
+        )
+    )
+    return build_dataset(
+        [p.get("fclass") for p in props],
+        [p.get("name") for p in props],
+        [p.get("osm_id") for p in props],
+        geoms,
+        version,
+        source,
+        digests,
+    )
+
+
+def read_source(source: Path, data: bytes, version: str, previous: Optional[Dataset] = None) -> Dataset:
+    """Parse a source file into a ``Dataset``; non-GeoJSON goes through GDAL.
+
+    ``previous`` is the version being replaced, whose parsed geometries can be
+    reused for unchanged GeoJSON features.
+    """
+    if source.suffix.lower() in (".geojson", ".json"):
+        return parse_geojson(data, version, source, previous)
+    import geopandas as gpd  # heavy; only needed for shapefiles and friends
+
+    gdf = gpd.read_file(source).to_crs("EPSG:4326")
+    column = lambda name: gdf[name] if name in gdf else [None] * len(gdf)
+    columns = [column("fclass"), column("name"), column("osm_id"), np.asarray(gdf.geometry.values)]
+    return build_dataset(*columns, version, source, row_digests(*columns))
+
+
+def save_columnar(dataset: Dataset, directory: Path):
+    """Write a dataset as flat .npy columns that ``load_columnar`` can memory-map."""
+
+    def writer(tmp):
+        meta = {"version": dataset.version, "fclasses": dataset.fclasses, "rows": len(dataset)}
+        meta["geometry"] = save_geometries(tmp, dataset.geometries)
+        np.save(tmp / "fclass_codes.npy", dataset.fclass_codes)
+        np.save(tmp / "names.npy", dataset.names)
+        np.save(tmp / "osm_ids.npy", dataset.osm_ids)
+        np.save(tmp / "bounds.npy", dataset.bounds)
+        if dataset.feature_digests is not None:
+            np.save(tmp / "digests.npy", dataset.feature_digests)
+        (tmp / "meta.json").write_text(json.dumps(meta))
+
+    write_directory(directory, writer)
+
+
+def load_columnar(directory: Path, source: Optional[Path] = None) -> Dataset:
+    """Load a dataset written by ``save_columnar``, memory-mapping every column."""
+    meta = json.loads((directory / "meta.json").read_text())
+    load = lambda name: np.load(directory / name, mmap_mode="r")
+    geometries = load_geometries(directory, meta["geometry"])
+    codes = load("fclass_codes.npy")
+    if len(codes) != meta["rows"] or len(geometries) != meta["rows"]:
+        raise ValueError(f"Truncated columnar cache in {directory}")
+    fclass_rows = {
+        name: np.flatnonzero(codes == idx) for idx, name in enumerate(meta["fclasses"])
+    }
+    return Dataset(
+        version=meta["version"],
+        fclasses=list(meta["fclasses"]),
+        fclass_codes=codes,
+        names=load("names.npy"),
+        osm_ids=load("osm_ids.npy"),
+        bounds=load("bounds.npy"),
+        geometries=geometries,
+        fclass_rows=fclass_rows,
+        source=source,
+        # caches written before digests existed have none; that version is then reloaded in full
+        feature_digests=load("digests.npy") if (directory / "digests.npy").exists() else None,
+    )
+
+
+def columnar_dir(source: Path, version: str) -> Path:
+    prefix = cache_prefix(source, version)
+    return prefix.with_name(f"{prefix.name}.columns")
+
+
+def cache_index_path(source: Path) -> Path:
+    return source.parent / ".cache" / f"{source.stem}.index.json"
+
+
+def prune_cache(source: Path, keep):
+    """Delete the columnar, projected and LOD files of every version of ``source`` not in ``keep``."""
+    pattern = re.compile(re.escape(source.stem) + r"-([0-9a-f]{16})\.(?:columns|svy21|lod-z\d+)$")
+    try:
+        entries = list((source.parent / ".cache").iterdir())
+    except OSError:
+        return
+    for path in entries:
+        match = pattern.match(path.name)
+        if match is not None and match.group(1) not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class DatasetEngine:
+    """Loads the data file once and hands out the current ``Dataset``.
+
+    ``get()`` is cheap: it returns the resident snapshot and, at most once per
+    ``check_interval`` seconds, stats the file. A changed mtime/size triggers a
+    hash of the content, and only a changed hash triggers a reload. Reloads
+    come from the columnar cache when it has the version, and from the source
+    file otherwise (writing the cache for next time). ``on_load`` is called
+    with each newly published snapshot and the seconds its load took.
+
+    After ``watch()``, ``get()`` never touches the file: a background thread
+    reloads on change, builds whatever the old snapshot had built (index,
+    projection, LOD bands) reusing its unchanged rows, and only then swaps
+    the new snapshot in. ``on_change(previous, dataset, diff)`` is called after
+    every swap from one version to another; ``diff`` is None when the two
+    can't be matched row by row.
+
+    With ``check_interval=None`` the engine never checks the file once
+    loaded; whoever owns it calls ``reload()`` instead.
+
+    Cached files of a replaced version are deleted once its snapshot, and
+    with it the memory maps of those files, is no longer in use.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        check_interval: Optional[float] = 1.0,
+        use_cache: bool = True,
+        on_load: Optional[Callable[[Dataset, float], None]] = None,
+        on_change: Optional[Callable[[Dataset, Dataset, Optional[DatasetDiff]], None]] = None,
+    ):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self.use_cache = use_cache
+        self.on_load = on_load
+        self.on_change = on_change
+        self.watcher: Optional[FileWatcher] = None
+        self._dataset: Optional[Dataset] = None
+        self._stat: Optional[List[List[int]]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        # replaced snapshots that something still holds, by version
+        self._retired: "weakref.WeakValueDictionary[str, Dataset]" = weakref.WeakValueDictionary()
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._dataset.version if self._dataset else None
+
+    @property
+    def loaded(self) -> Optional[Dataset]:
+        """The resident snapshot as is, without checking the file; None before the first load."""
+        return self._dataset
+
+    def get(self) -> Dataset:
+        """Return the current dataset, reloading it if the file changed."""
+        dataset = self._dataset
+        if dataset is not None and (
+            self.watcher is not None
+            or self.check_interval is None
+            or time.monotonic() - self._checked_at < self.check_interval
+        ):
+            return dataset
+        with self._lock:
+            self._refresh()
+            return self._dataset
+
+    def watch(self, use_events: bool = True) -> FileWatcher:
+        """Reload from a background thread when the file changes, not on ``get()``.
+
+        File events are used when ``watchfiles`` is installed, else the file
+        is polled every ``check_interval`` seconds.
+        """
+        if self.watcher is None:
+            self.watcher = FileWatcher(
+                watched_files(self.path), self.reload, interval=self.check_interval or 1.0, use_events=use_events
+            ).start()
+        return self.watcher
+
+    def stop_watching(self, timeout: Optional[float] = 5.0):
+        if self.watcher is not None:
+            self.watcher.stop(timeout)
+            self.watcher = None
+
+    def reload(self):
+        """Pick up a change to the file now; keeps the current snapshot on failure."""
+        with self._lock:
+            try:
+                self._refresh()
+            except (OSError, ValueError, shapely.errors.GEOSException):
+                pass  # nothing loaded yet; the next get() reports it
+
+    def _refresh(self):
+        self._checked_at = time.monotonic()
+        try:
+            stat = source_stat(self.path)
+        except OSError:
+            if self._dataset is None:
+                raise
+            return  # keep serving the last good snapshot
+        if self._dataset is not None and stat == self._stat:
+            return
+
+        start = time.perf_counter()
+        try:
+            dataset = self._load(stat)
+        except (ValueError, shapely.errors.GEOSException):
+            if self._dataset is None:
+                raise
+            return  # half-written file; retry on the next check
+        previous = self._dataset
+        if dataset is not previous:
+            diff = DatasetDiff.between(previous, dataset) if previous is not None else None
+            if diff is not None:
+                dataset.inherit(previous, diff)
+            dataset.tree  # build the spatial index before publishing the snapshot
+            self._dataset = dataset
+            if self.on_load is not None:
+                self.on_load(dataset, time.perf_counter() - start)
+            if previous is not None and self.on_change is not None:
+                self.on_change(previous, dataset, diff)
+            if previous is not None:
+                self._retired[previous.version] = previous
+                weakref.finalize(previous, self._prune_when_free).atexit = False
+                del previous
+                self._prune()
+        self._stat = stat
+
+    def _prune(self):
+        """Delete cached files of versions that are neither current nor still in use"""
+        prune_cache(self.path, {self._dataset.version, *self._retired.keys()})
+
+    def _prune_when_free(self):
+        # a retired snapshot was freed, possibly by a thread inside _refresh,
+        # which prunes itself once it has swapped
+        if self._lock.acquire(blocking=False):
+            try:
+                self._prune()
+            finally:
+                self._lock.release()
+
+    def _load(self, stat: List[List[int]]) -> Dataset:
+        index_path = cache_index_path(self.path)
+        if self.use_cache:
+            # Fast path: the file is unchanged since the cache was written
+            try:
+                index = json.loads(index_path.read_text())
+                if index["stat"] == stat:
+                    if self._dataset is not None and index["version"] == self._dataset.version:
+                        return self._dataset
+                    return load_columnar(columnar_dir(self.path, index["version"]), self.path)
+            except (OSError, ValueError, KeyError):
+                pass
+
+        data = b"".join(p.read_bytes() for p in source_files(self.path))
+        version = file_digest(data)
+        if self._dataset is not None and version == self._dataset.version:
+            return self._dataset
+        if not self.use_cache:
+            return read_source(self.path, data, version, self._dataset)
+
+        directory = columnar_dir(self.path, version)
+        try:
+            dataset = load_columnar(directory, self.path)
+        except (OSError, ValueError, KeyError):
+            dataset = read_source(self.path, data, version, self._dataset)
+            try:
+                save_columnar(dataset, directory)
+                dataset = load_columnar(directory, self.path)
+            except OSError:
+                pass  # read-only data dir; serve the parsed copy
+        try:
+            index_path.write_text(json.dumps({"stat": stat, "version": version}))
+        except OSError:
+            pass
+        return dataset
+
+
+def main():
+    """Build the columnar cache, projection and LOD pyramid for some data files (default: every layer)."""
+    import sys
+
+    from layers import load_layer_specs
+
+    paths = [Path(p) for p in sys.argv[1:]] or [spec.path for spec in load_layer_specs().values()]
+    for path in paths:
+        start = time.perf_counter()
+        dataset = DatasetEngine(path).get()
+        dataset.warm()
+        elapsed = time.perf_counter() - start
+        print(f"{path}: version {dataset.version}, {len(dataset)} features, {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Streaming GeoJSON export of the resident dataset.
+
+Features are encoded a batch of rows at a time straight from the dataset's
+columns: geometries go through one vectorized ``shapely.to_geojson`` call per
+batch and properties through ``orjson``, and each batch
+is handed to the response (compressed, if the client asked for it) before the
+next one is built. Memory therefore stays at one batch however many features
+are exported.
+
+Pages are addressed by an opaque cursor holding the dataset version and the
+last row sent. Rows are only meaningful within one version, so a cursor from
+an older version is rejected rather than silently skipping or repeating
+features.
+"""
+
+import base64
+import json
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import shapely
+
+from dataset import Dataset
+
+try:
+    import orjson
+except ImportError:  # no wheel for this platform: the stdlib encoder is just slower
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # no wheel for this platform: gzip is always available
+    zstandard = None
+
+BATCH_ROWS = 1000
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "geojson": "application/geo+json"}
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def encode_cursor(version: str, row: int) -> str:
+    return base64.urlsafe_b64encode(f"{version}:{row}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """(dataset version, last row sent); ValueError if it isn't a cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        version, row = raw.rsplit(":", 1)
+        return version, int(row)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+
+
+def page(rows: np.ndarray, version: str, cursor: Optional[str], limit: Optional[int]):
+    """(rows of this page, cursor for the next one or None) from sorted ``rows``.
+
+    ValueError for a malformed cursor, LookupError for one from another
+    dataset version.
+    """
+    if cursor is not None:
+        cursor_version, after = decode_cursor(cursor)
+        if cursor_version != version:
+            raise LookupError(cursor_version)
+        rows = rows[np.searchsorted(rows, after, side="right"):]
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(version, int(rows[-1]))
+
+
+def encode_features(
+    dataset: Dataset,
+    rows: np.ndarray,
+    geometry: bool = True,
+    zoom: Optional[float] = None,
+    batch: int = BATCH_ROWS,
+) -> Iterator[List[bytes]]:
+    """Encoded GeoJSON Features for ``rows``, one list per batch of rows.
+
+    Same shape as ``Dataset.feature``.
+    """
+    fclass_names = dataset.fclasses + [None]  # code -1 -> None
+    geometries = dataset.lod.for_zoom(zoom) if geometry and zoom is not None else dataset.geometries
+    for start in range(0, len(rows), batch):
+        chunk = rows[start:start + batch]
+        codes = dataset.fclass_codes[chunk].tolist()
+        osm_ids = dataset.osm_ids[chunk].tolist()
+        names = dataset.names[chunk].tolist()
+        if geometry:
+            texts = shapely.to_geojson(geometries[chunk]).tolist()
+        else:
+            texts = [None] * len(chunk)
+        yield [
+            b'{"type":"Feature","properties":'
+            + dumps({"osm_id": osm_id, "fclass": fclass_names[code], "name": name})
+            + b',"geometry":'
+            + (text.encode() if text is not None else b"null")
+            + b"}"
+            for code, osm_id, name, text in zip(codes, osm_ids, names, texts)
+        ]
+
+
+def ndjson(features: Iterable[List[bytes]]) -> Iterator[bytes]:
+    """One Feature per line."""
+    for batch in features:
+        if batch:
+            yield b"\n".join(batch) + b"\n"
+
+
+def feature_collection(features: Iterable[List[bytes]], members: dict) -> Iterator[bytes]:
+    """A FeatureCollection with ``members`` ahead of its features, in chunks."""
+    head = dumps({"type": "FeatureCollection", **members})
+    yield head[:-1] + b',"features":['
+    separator = b""
+    for batch in features:
+        if batch:
+            yield separator + b",".join(batch)
+            separator = b","
+    yield b"]}"
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best content coding we support for an Accept-Encoding header; None for identity."""
+    offered = ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in offered:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(chunks: Iterable[bytes], encoding: Optional[str]) -> Iterator[bytes]:
+    """``chunks`` in the given content coding, flushed per chunk so the client
+    sees features as they are produced."""
+    if encoding is None:
+        yield from chunks
+        return
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        flush, finish = zstandard.COMPRESSOBJ_FLUSH_BLOCK, zstandard.COMPRESSOBJ_FLUSH_FINISH
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        flush, finish = zlib.Z_SYNC_FLUSH, zlib.Z_FINISH
+    else:
+        raise ValueError(f"Unsupported content coding {encoding!r}")
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(flush)
+        if data:
+            yield data
+    yield compressor.flush(finish)
@@ -0,0 +1,207 @@
+"""Registry of the map layers the servers can serve.
+
+Layers are declared in ``data/layers.json`` (or the file ``DATASET_LAYERS``
+names) as ``{"name": {"path": ..., "title": ...}}``, with paths relative to
+that file; the first one is the default. Declaring a layer costs nothing:
+its file is only read when someone first asks for it, and from then on it
+has its own ``DatasetEngine`` (snapshot, spatial index, LOD bands) and its
+own caches.
+
+Loaded layers share a memory budget. Whenever a layer (re)loads, the least
+recently used other layers are dropped until the estimated total fits; a
+dropped layer simply loads again on its next use.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from cache import LRUCache
+from dataset import DATA_PATH, Dataset, DatasetDiff, DatasetEngine
+
+LAYERS_CONFIG = Path(os.environ.get("DATASET_LAYERS", DATA_PATH.parent / "layers.json"))
+LAYER_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+@dataclass(frozen=True)
+class LayerSpec:
+    name: str
+    path: Path
+    title: str
+
+
+def load_layer_specs(config: Path = LAYERS_CONFIG) -> Dict[str, LayerSpec]:
+    """Declared layers by name, in file order; just ``DATA_PATH`` if there is no config."""
+    try:
+        declared = json.loads(Path(config).read_text())
+    except FileNotFoundError:
+        return {DATA_PATH.stem: LayerSpec(DATA_PATH.stem, DATA_PATH, "Health facilities")}
+    specs = {}
+    for name, entry in declared.items():
+        if not LAYER_NAME.match(name):
+            raise ValueError(f"Invalid layer name {name!r} in {config}")
+        path = (Path(config).parent / entry["path"]).resolve()
+        specs[name] = LayerSpec(name, path, entry.get("title", name))
+    if not specs:
+        raise ValueError(f"No layers declared in {config}")
+    return specs
+
+
+class Layer:
+    """A layer in use: its engine and the caches built over its data."""
+
+    def __init__(self, spec: LayerSpec, engine: DatasetEngine, caches: Dict[str, LRUCache]):
+        self.spec = spec
+        self.engine = engine
+        self.caches = caches
+        self.nbytes = 0  # estimate as of the last load
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    def measure(self) -> int:
+        dataset = self.engine.loaded
+        self.nbytes = (dataset.nbytes if dataset is not None else 0) + sum(c.bytes for c in self.caches.values())
+        return self.nbytes
+
+
+class LayerRegistry:
+    """Hands out each declared layer's dataset, creating its engine on first use
+
+    ``caches`` maps a cache name to ``LRUCache`` options; every layer gets its
+    own instance of each (``layer.caches[name]``). ``on_load(layer, dataset,
+    seconds)`` and ``on_change(layer, previous, dataset, diff)`` are the
+    engines' callbacks with the layer first; ``on_evict(layer)`` is called
+    when a layer is dropped.
+
+    ``max_bytes`` bounds the estimated memory of the loaded layers (see
+    ``Dataset.nbytes``). It is enforced on the next ``get()`` after any layer
+    loads; the layer being asked for is never dropped, so a single layer
+    larger than the budget still loads.
+    """
+
+    def __init__(
+        self,
+        specs: Dict[str, LayerSpec],
+        max_bytes: Optional[int] = None,
+        caches: Optional[Dict[str, dict]] = None,
+        on_load: Optional[Callable[[Layer, Dataset, float], None]] = None,
+        on_change: Optional[Callable[[Layer, Dataset, Dataset, Optional[DatasetDiff]], None]] = None,
+        on_evict: Optional[Callable[[Layer], None]] = None,
+        **engine_options,
+    ):
+        if not specs:
+            raise ValueError("No layers declared")
+        self.specs = dict(specs)
+        self.default = next(iter(self.specs))
+        self.max_bytes = max_bytes
+        self.cache_options = caches or {}
+        self.on_load = on_load
+        self.on_change = on_change
+        self.on_evict = on_evict
+        self.engine_options = engine_options
+        self.watching = False
+        self._layers: "OrderedDict[str, Layer]" = OrderedDict()  # least recently used first
+        self._loaded = threading.Event()  # a layer (re)loaded since the budget was last checked
+        self._lock = threading.Lock()
+
+    def names(self) -> List[str]:
+        return list(self.specs)
+
+    def resolve(self, name: Optional[str]) -> str:
+        """``name``, or the default layer for None; KeyError if it isn't declared."""
+        if name is None:
+            return self.default
+        if name not in self.specs:
+            raise KeyError(name)
+        return name
+
+    def loaded(self) -> List[Layer]:
+        """Layers in memory, least recently used first."""
+        with self._lock:
+            return list(self._layers.values())
+
+    def version(self, name: Optional[str] = None) -> Optional[str]:
+        """Resident version of a layer, without loading it; None if it isn't loaded."""
+        layer = self._layers.get(name if name is not None else self.default)
+        return layer.engine.version if layer is not None else None
+
+    def layer(self, name: Optional[str] = None) -> Layer:
+        """A declared layer, marked as most recently used; its data loads on ``get()``."""
+        name = self.resolve(name)
+        with self._lock:
+            layer = self._layers.get(name)
+            if layer is None:
+                layer = self._layers[name] = self._create(self.specs[name])
+            else:
+                self._layers.move_to_end(name)
+            return layer
+
+    def get(self, name: Optional[str] = None) -> Dataset:
+        """Current dataset of a layer, loading it if needed; KeyError if undeclared."""
+        layer = self.layer(name)
+        dataset = layer.engine.get()
+        if self._loaded.is_set():
+            self.trim(keep=layer)
+        return dataset
+
+    def trim(self, keep: Optional[Layer] = None):
+        """Drop least recently used layers until the loaded ones fit ``max_bytes``."""
+        self._loaded.clear()
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            layers = list(self._layers.values())
+        total = sum(layer.measure() for layer in layers)
+        for layer in layers:
+            if total <= self.max_bytes:
+                break
+            if layer is not keep:
+                total -= layer.nbytes
+                self.evict(layer.name)
+
+    def evict(self, name: str):
+        with self._lock:
+            layer = self._layers.pop(name, None)
+        if layer is None:
+            return
+        # don't wait: the watcher may be in the middle of a reload
+        layer.engine.stop_watching(timeout=0)
+        for cache in layer.caches.values():
+            cache.clear()
+        if self.on_evict is not None:
+            self.on_evict(layer)
+
+    def watch(self):
+        """Watch the files of loaded layers, and of every layer loaded from now on."""
+        self.watching = True
+        for layer in self.loaded():
+            layer.engine.watch()
+
+    def stop_watching(self):
+        self.watching = False
+        for layer in self.loaded():
+            layer.engine.stop_watching()
+
+    def _create(self, spec: LayerSpec) -> Layer:
+        def loaded(dataset, seconds):
+            self._loaded.set()
+            if self.on_load is not None:
+                self.on_load(layer, dataset, seconds)
+
+        def changed(previous, dataset, diff):
+            if self.on_change is not None:
+                self.on_change(layer, previous, dataset, diff)
+
+        engine = DatasetEngine(spec.path, on_load=loaded, on_change=changed, **self.engine_options)
+        caches = {name: LRUCache(**options) for name, options in self.cache_options.items()}
+        layer = Layer(spec, engine, caches)
+        if self.watching:
+            layer.engine.watch()
+        return layer
@@ -1,77 +1,547 @@
-import asyncio
+import json
+import os
+import re
+import secrets
+import sys
+import textwrap
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import quote
 import streamlit as st
+import streamlit.components.v1 as components
 import folium
+from branca.element import Element, MacroElement
+from folium.plugins import VectorGridProtobuf
+from jinja2 import Template
 import geopandas as gpd
-from streamlit_folium import st_folium
+import numpy as np
+import shapely
+
+from cache import LRUCache
+from dataset import lod_band
+from layers import LayerRegistry, load_layer_specs
+import streamlit_folium
 import requests
-import redis
+import threading
 import time
 
+API_BASE_URL = os.environ.get("API_BASE_URL", "http://localhost:8000")
+# Vector tiles are fetched by the browser, so this must be reachable from it
+TILES_URL = os.environ.get("MAP_TILES_URL", f"{API_BASE_URL}/tiles/{{z}}/{{x}}/{{y}}.mvt")
+# "tiles" draws one vector-tile layer; "geojson" embeds the polygons in the page
+MAP_RENDERER = os.environ.get("MAP_RENDERER", "tiles")
+
+# A session's change listener disconnects after this long with nobody waiting
+LISTENER_IDLE_SECONDS = 300
+# Listeners kept for reuse, and for how long; one dropped while in use is
+# replaced on the next rerun and disconnects once idle
+LISTENER_MAX_SESSIONS = 256
+LISTENER_TTL_SECONDS = 3600
+
+# Memory budget for built maps shared by all sessions of this process
+MAP_CACHE_MB = float(os.environ.get("MAP_CACHE_MB", "256"))
+# Map centres are rounded to this many decimals (about 1 m) in cache keys
+MAP_CENTER_DECIMALS = 5
+# Estimated memory the layers loaded by this process may use
+LAYER_MEMORY_MB = float(os.environ.get("LAYER_MEMORY_MB", "2048"))
+
+FACILITY_STYLE = {
+    "fillColor": "blue",
+    "color": "black",
+    "weight": 1,
+    "fillOpacity": 0.5,
+}
+
+
+def get_state_session():
+    """State namespace from the ``?session=`` URL parameter; None for the shared one"""
+    return st.query_params.get("session") or None
+
+
+def session_params(session):
+    return {"session": session} if session else {}
+
+
+@st.cache_resource
+def get_api_session():
+    """Process-wide keep-alive HTTP session, so reruns don't open a connection per call"""
+    return requests.Session()
+
 
-def get_app_state():
-    """Get current app state from API server"""
+def get_app_state(session=None):
+    """Get current app state from API server
+
+    The last state is kept per session with its ETag, so reruns where nothing
+    changed get an empty 304 instead of the full state.
+    """
+    cached = st.session_state.get("app_state_cache")
+    if cached and cached[0] != session:
+        cached = None
+    headers = {"If-None-Match": cached[1]} if cached else {}
     try:
-        response = requests.get("http://localhost:8000/state", timeout=2)
+        response = get_api_session().get(
+            f"{API_BASE_URL}/state", params=session_params(session), headers=headers, timeout=2
+        )
+        if response.status_code == 304 and cached:
+            return cached[2]
         if response.status_code == 200:
-            return response.json()
+            state = response.json()
+            st.session_state["app_state_cache"] = (session, response.headers.get("ETag"), state)
+            return state
     except requests.exceptions.RequestException as e:
         st.write(f"Couldn't get state error: {e}")
-    return {"selected_fclasses": [], "map_center": None, "zoom_level": 12}
+    return {"layer": None, "selected_fclasses": [], "map_center": None, "zoom_level": 12}
+
 
+def update_app_state(path, payload, session=None, layer=None):
+    """Send a partial state update (``/filters`` or ``/map``); returns the new state version
 
-def update_app_state(state):
-    """Update app state via API server"""
+    Only the changed fields are written, so a concurrent change to the other
+    fields (e.g. an agent setting filters while the user pans) is kept.
+    ``layer`` switches the map to another layer along with ``/filters``.
+    """
+    params = session_params(session)
+    if layer is not None:
+        params["layer"] = layer
     try:
-        requests.post("http://localhost:8000/state", json=state, timeout=2)
+        response = get_api_session().post(f"{API_BASE_URL}{path}", params=params, json=payload, timeout=2)
+        if response.status_code == 200:
+            return response.json().get("version")
     except requests.exceptions.RequestException as e:
         st.write(f"Couldn't update state: {e}")
+    return None
 
 
-@st.cache_resource
-def get_redis_subscription():
-    """Get Redis subscriber for state change notifications"""
-    try:
-        redis_client = redis.Redis(
-            host="localhost", port=6379, db=0, decode_responses=True
-        )
-        pubsub = redis_client.pubsub()
-        pubsub.subscribe("app_state_changes")
-        return pubsub
-    except redis.RedisError as e:
-        st.write(f"Couldn't get redis subscription: {e}")
+class StateEventListener:
+    """Follows the API's /events stream on a background thread
+
+    One listener per state session is shared by every Streamlit session viewing
+    it. It keeps the latest state version and wakes sessions waiting for a
+    newer one. Once nobody has waited on it for ``LISTENER_IDLE_SECONDS`` it
+    disconnects, and the next wait reconnects it.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.version = 0
+        self._changed = threading.Condition()
+        self._waited_at = time.monotonic()
+        self._thread = None
+        self._ensure_running()
 
+    def _ensure_running(self):
+        with self._changed:
+            self._waited_at = time.monotonic()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="state-events", daemon=True)
+                self._thread.start()
 
-async def poll_for_updates():
-    """Check for Redis pub/sub updates and trigger rerun if needed"""
-    last_forced = time.time()
-    while True:
-        pubsub = get_redis_subscription()
+    def _idle(self):
+        return time.monotonic() - self._waited_at > LISTENER_IDLE_SECONDS
 
-        if pubsub:
+    def _run(self):
+        backoff = 0.5
+        while not self._idle():
             try:
-                message = pubsub.get_message(timeout=0.01)  # Non-blocking check
-                if message and message["type"] == "message":
-                    print("Triggering rerun!")
-                    st.rerun()
-            except (redis.RedisError, TypeError) as e:
-                st.write(f"Redis error: {e}")
+                # The server sends a keepalive every 15s, so a silent minute means a dead link
+                with requests.get(self.url, stream=True, timeout=(2, 60)) as response:
+                    response.raise_for_status()
+                    backoff = 0.5
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line and line.startswith("data:"):
+                            self._on_data(line[5:].strip())
+                        elif self._idle():
+                            return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 10)
+
+    def _on_data(self, data):
+        try:
+            version = json.loads(data).get("version")
+        except (ValueError, AttributeError):
+            return
+        if not isinstance(version, int):
+            return
+        with self._changed:
+            if version > self.version:
+                self.version = version
+                self._changed.notify_all()
+
+    def wait_for_change(self, seen_version, timeout):
+        """Wait until the version passes ``seen_version``; False on timeout"""
+        self._ensure_running()
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version > seen_version, timeout)
+
+
+@st.cache_resource(max_entries=LISTENER_MAX_SESSIONS, ttl=LISTENER_TTL_SECONDS)
+def get_state_listener(session=None):
+    """Process-wide change listener for one state session"""
+    query = f"?session={quote(session)}" if session else ""
+    return StateEventListener(f"{API_BASE_URL}/events{query}")
+
+
+def wait_for_state_change(rendered_version, session=None, layer=None, dataset_version=None):
+    """Block until the state moves past ``rendered_version``, then rerun
+
+    The wait wakes as soon as the listener sees a newer version. In between it
+    touches session state every 250 ms: that is a Streamlit yield point, so a
+    widget interaction or closed tab still interrupts the wait promptly. It
+    also ends once a new version of the shown layer's data has been swapped in.
+    """
+    listener = get_state_listener(session)
+    registry = get_layer_registry()
+    while not listener.wait_for_change(rendered_version, timeout=0.25):
+        if dataset_version is not None and registry.version(layer) != dataset_version:
+            break
+        st.session_state.get("fclass_selector")
+    st.rerun()
+
+
+def add_vector_tile_layer(m, selected_fclasses, dataset_version, layer=None):
+    """Add a single vector-tile layer served by the API, filtered by fclass
+
+    The dataset version in the URL keeps the browser from reusing tiles it
+    cached for an older version of the data.
+    """
+    url = TILES_URL + "?fclasses=" + quote(",".join(selected_fclasses)) + "&v=" + quote(dataset_version)
+    if layer is not None:
+        url += "&layer=" + quote(layer)
+    options = {
+        "vectorTileLayerStyles": {
+            "facilities": {**FACILITY_STYLE, "fill": True},
+        },
+    }
+    VectorGridProtobuf(url, name="Health facilities", options=options).add_to(m)
+
+
+class RawScript(Element):
+    """Script element emitted verbatim
+
+    branca compiles every rendered script as a Jinja template before output,
+    which costs time proportional to the data and would mangle any "{{" in it.
+    """
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = script
+
+    def render(self, **kwargs):
+        return self.script
+
+
+class FeatureCollectionLayer(MacroElement):
+    """One Leaflet GeoJSON layer built from an already serialized FeatureCollection
+
+    folium.GeoJson re-parses and re-dumps its data and builds a per-feature
+    style map, so the JSON string is injected into the page as-is instead.
+    Each feature gets its ``name`` property as a tooltip.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson({{ this.data_json }}, {
+            style: {{ this.style|tojson }},
+            onEachFeature: function(feature, layer) {
+                if (feature.properties && feature.properties.name) {
+                    var label = document.createElement("span");
+                    label.textContent = feature.properties.name;
+                    layer.bindTooltip(label, {sticky: true});
+                }
+            }
+        }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, data_json, style):
+        super().__init__()
+        self._name = "FeatureCollectionLayer"
+        # Keep "</script>" in a facility name from closing the script tag
+        self.data_json = data_json.replace("</", "<\\/")
+        self.style = style
+
+    def render(self, **kwargs):
+        script = self._template.module.__dict__["script"](self, kwargs)
+        self.get_root().script.add_child(RawScript(script), name=self.get_name())
+
+
+def serialize_features(names, geometries):
+    """Serialize names + geometries into a FeatureCollection string"""
+    geometries = shapely.to_geojson(np.asarray(geometries))
+    features = [
+        f'{{"type":"Feature","properties":{{"name":{json.dumps(str(name))}}},"geometry":{geom}}}'
+        for name, geom in zip(names, geometries)
+        if geom is not None
+    ]
+    return '{"type":"FeatureCollection","features":[' + ",".join(features) + "]}"
+
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def serialize_selection(_dataset, data_version, selection, band):
+    """Serialized FeatureCollection for one fclass selection and LOD band
+
+    ``selection`` is a sorted tuple of the selected fclasses, so reruns with the
+    same selection in any order hit the cache and skip serialization entirely.
+    ``_dataset`` is not hashed; ``data_version`` stands in for it. The string
+    is shared as is rather than copied per hit like ``st.cache_data`` would.
+    """
+    rows = _dataset.rows_for(list(selection))
+    geometries = _dataset.lod.for_zoom(band)
+    return serialize_features(_dataset.names[rows], geometries[rows])
 
-        # Force a periodic refresh every 5 seconds as a safety net
-        now = time.time()
-        if now - last_forced >= 5:
-            print("Triggering periodic rerun (5s interval)")
-            st.rerun()
-            # After rerun is called, execution restarts; this assignment is for completeness
-            last_forced = now
 
-        await asyncio.sleep(1)
+def add_geojson_layer(m, dataset, selected_fclasses, zoom_level):
+    """Add all selected facilities to the map as a single GeoJSON layer"""
+    selection = tuple(sorted(set(selected_fclasses)))
+    band = lod_band(zoom_level)
+    data_json = serialize_selection(dataset, dataset.version, selection, band)
+    FeatureCollectionLayer(data_json, FACILITY_STYLE).add_to(m)
+
+
+@st.cache_resource
+def get_layer_registry():
+    """Process-wide layer registry shared by all sessions
+
+    A layer loads when a session first shows it. Changes to the data files
+    are picked up by background watchers, so reruns never wait for a reload.
+    """
+    registry = LayerRegistry(load_layer_specs(), max_bytes=int(LAYER_MEMORY_MB * 2**20))
+    registry.watch()
+    return registry
+
+
+@st.cache_resource(max_entries=2)
+def facilities_frame(_dataset, data_version):
+    """GeoDataFrame view of the resident dataset, built once per version"""
+    return gpd.GeoDataFrame(
+        {
+            "osm_id": _dataset.osm_ids,
+            "fclass": _dataset.fclass_values,
+            "name": _dataset.names,
+        },
+        geometry=_dataset.geometries,
+        crs="EPSG:4326",
+    )
+
+
+# streamlit_folium's frontend, declared here so that a map rendered once can be
+# shown again from its cached payload; st_folium itself renders the map it is
+# given on every call
+folium_component = components.declare_component(
+    "st_folium", path=str(Path(streamlit_folium.__file__).parent / "frontend" / "build")
+)
+
+
+@dataclass(frozen=True)
+class RenderedMap:
+    """What st_folium sends to the browser for one map, as plain strings
+
+    Holds no reference to the folium objects, so any session can show it
+    again without building or rendering the map.
+    """
+
+    script: str
+    header: str
+    html: str
+    id: str
+    # hash of the script without folium's random element ids, so the same view
+    # built again keeps the component mounted
+    digest: str
+    defaults: dict
+    css_links: tuple
+    js_links: tuple
+
+    @property
+    def nbytes(self) -> int:
+        return sum(sys.getsizeof(s) for s in (self.script, self.header, self.html, *self.css_links, *self.js_links))
+
+
+@st.cache_resource
+def get_map_cache():
+    """Process-wide LRU of rendered maps, bounded by MAP_CACHE_MB"""
+    return LRUCache(max_entries=256, max_bytes=int(MAP_CACHE_MB * 2**20), sizeof=lambda r: r.nbytes)
+
+
+def map_assets(element):
+    """(css, js) links of ``element`` and everything added to it"""
+    css = [href for _, href in getattr(element, "default_css", [])]
+    js = [src for _, src in getattr(element, "default_js", [])]
+    for child in getattr(element, "_children", {}).values():
+        child_css, child_js = map_assets(child)
+        css += child_css
+        js += child_js
+    return css, js
+
+
+def render_map(m):
+    """Render a folium map into the payload st_folium would send for it"""
+    root = m.get_root()
+    root.render()
+    m.render()
+    map_id = streamlit_folium.get_full_id(m)
+    # html and header first: building the script renames the map's elements
+    html = re.sub(r'<div class="folium-map" id=".*" ></div>', "", root.html.render()).strip()
+    header = re.sub(r'<script src=".*?"></script>|<link rel="stylesheet" href=".*?"/>', "", root.header.render())
+    script = textwrap.dedent(streamlit_folium.generate_leaflet_string(m))
+    if "drawnItems" not in script:
+        script += "\nvar drawnItems = [];"  # the frontend expects it
+    (south, west), (north, east) = m.get_bounds()
+    css_links, js_links = map_assets(m)
+    defaults = {
+        "last_clicked": None,
+        "last_object_clicked": None,
+        "last_object_clicked_tooltip": None,
+        "last_object_clicked_popup": None,
+        "all_drawings": None,
+        "last_active_drawing": None,
+        "bounds": {
+            "_southWest": {"lat": south, "lng": west},
+            "_northEast": {"lat": north, "lng": east},
+        },
+        "zoom": m.options.get("zoom"),
+        "last_circle_radius": None,
+        "last_circle_polygon": None,
+        "selected_layers": None,
+    }
+    return RenderedMap(
+        script=script,
+        header=header.replace(map_id, "map_div"),
+        html=html,
+        id=streamlit_folium.get_full_id(m),
+        digest=streamlit_folium.generate_js_hash(script),
+        defaults=defaults,
+        css_links=tuple(css_links),
+        js_links=tuple(js_links),
+    )
+
+
+def show_map(rendered, key, height, width):
+    """Display a rendered map like st_folium and return what the user did with it"""
+    component_key = f"{key}_{rendered.digest}"
+
+    def on_change():
+        st.session_state[key] = st.session_state.get(component_key, {})
+
+    return folium_component(
+        script=rendered.script,
+        header=rendered.header,
+        html=rendered.html,
+        id=rendered.id,
+        key=component_key,
+        height=height,
+        width=width,
+        returned_objects=None,
+        default=rendered.defaults,
+        zoom=None,
+        center=None,
+        feature_group=None,
+        return_on_hover=False,
+        layer_control=None,
+        pixelated=False,
+        css_links=list(rendered.css_links),
+        js_links=list(rendered.js_links),
+        on_change=on_change,
+    )
+
+
+def build_map(dataset, selected_fclasses, center, zoom_level, fit_bounds=None, layer=None):
+    """Folium map of the selected facilities around ``center``"""
+    m = folium.Map(location=center, zoom_start=zoom_level, tiles="CartoDB positron")
+    if fit_bounds is not None:
+        minx, miny, maxx, maxy = fit_bounds
+        m.fit_bounds([[miny, minx], [maxy, maxx]])
+
+    # Add polygons to the map
+    if MAP_RENDERER == "tiles":
+        add_vector_tile_layer(m, selected_fclasses, dataset.version, layer)
+    else:
+        add_geojson_layer(m, dataset, selected_fclasses, zoom_level)
+    return m
+
+
+def cached_map(dataset, selected_fclasses, center, zoom_level, fit_bounds=None, layer=None):
+    """Rendered map for a view, shared with every session showing the same one
+
+    Views are keyed by renderer, layer and its dataset version, fclass
+    selection (in any order), centre rounded to ``MAP_CENTER_DECIMALS`` and
+    zoom, so a repeat view is one dictionary lookup. Views of replaced
+    dataset versions are never looked up again and age out of the LRU.
+    """
+    center = [round(float(c), MAP_CENTER_DECIMALS) for c in center]
+    cache = get_map_cache()
+    view = (
+        MAP_RENDERER,
+        layer,
+        dataset.version,
+        tuple(sorted(set(selected_fclasses))),
+        tuple(center),
+        zoom_level,
+        None if fit_bounds is None else tuple(fit_bounds),
+    )
+    rendered = cache.get(view)
+    if rendered is None:
+        rendered = render_map(build_map(dataset, selected_fclasses, center, zoom_level, fit_bounds, layer))
+        cache.put(view, rendered)
+    return rendered
+
+
+def session_sidebar(session):
+    """Show the state session and let the user switch to a private one
+
+    Agents address a session by passing its id to the MCP tools, so the id is
+    what the user hands over.
+    """
+    with st.sidebar:
+        st.subheader("Session")
+        if session:
+            st.code(session, language=None)
+            st.caption("Give this id to your agent so its tools control this map.")
+            if st.button("Switch to the shared session"):
+                del st.query_params["session"]
+                st.rerun()
+        else:
+            st.caption("Shared session: every viewer and agent without a session id sees this map.")
+            if st.button("Start a private session"):
+                st.query_params["session"] = secrets.token_urlsafe(8)
+                st.rerun()
 
 
 def main():
     st.header("Singapore Health Facilities Explorer")
+    session = get_state_session()
+    session_sidebar(session)
+
+    # Get current state from API
+    current_state = get_app_state(session)
+    rendered_version = current_state.get("version", 0)
+
+    # The layer on the map; one this process doesn't declare shows the default
+    registry = get_layer_registry()
+    names = registry.names()
+    layer = current_state.get("layer")
+    if layer not in registry.specs:
+        layer = registry.default
+    if len(names) > 1:
+        # Show a switch made elsewhere (e.g. by an agent) in the widget
+        if st.session_state.get("shown_layer") != layer:
+            st.session_state["layer_selector"] = layer
+        chosen = st.selectbox(
+            "Layer", names, format_func=lambda name: registry.specs[name].title, key="layer_selector"
+        )
+        if chosen != layer:
+            # A newly chosen layer starts with all of its classes selected
+            rendered_version = update_app_state("/filters", [], session, layer=chosen) or rendered_version
+            layer = chosen
+            current_state = {**current_state, "selected_fclasses": []}
+    st.session_state["shown_layer"] = layer
 
-    # Load GeoJSON data
-    gdf = gpd.read_file("data/health_sg.geojson")
+    # Load the layer's data
+    dataset = registry.get(layer)
+    gdf = facilities_frame(dataset, dataset.version)
 
     # Get unique 'fclass' values
     fclass_values = gdf["fclass"].unique()
@@ -79,11 +549,8 @@ def main():
         st.error("No 'fclass' values found.")
         return
 
-    # Get current state from API
-    current_state = get_app_state()
-
     # Use API state if available, otherwise default to all values
-    default_selection = current_state.get("selected_fclasses", [])
+    default_selection = [f for f in current_state.get("selected_fclasses", []) if f in fclass_values]
     if not default_selection:
         default_selection = list(fclass_values)
 
@@ -96,45 +563,31 @@ def main():
 
     # Update state when selection changes
     if selected_fclasses != current_state.get("selected_fclasses", []):
-        new_state = current_state.copy()
-        new_state["selected_fclasses"] = selected_fclasses
-        update_app_state(new_state)
+        # Our own write shouldn't wake this session up again
+        rendered_version = update_app_state("/filters", selected_fclasses, session) or rendered_version
 
-    # Filter GeoDataFrame
-    filtered_gdf = gdf[gdf["fclass"].isin(selected_fclasses)]
+    # Count, bounds and centre of the selection, from per-fclass aggregates
+    extent = dataset.selection_extent(selected_fclasses)
 
-    if filtered_gdf.empty:
+    if extent is None:
         st.warning("No data for selected fclass(es).")
+        wait_for_state_change(rendered_version, session, layer, dataset.version)
         return
 
     # Determine map center and zoom
     map_center = current_state.get("map_center")
     zoom_level = current_state.get("zoom_level", 12)
 
+    # Build or reuse the rendered map; with no saved view, frame the whole selection
     if map_center is None:
-        map_center = [
-            filtered_gdf.geometry.centroid.y.mean(),
-            filtered_gdf.geometry.centroid.x.mean(),
-        ]
-
-    # Create Folium map
-    m = folium.Map(location=map_center, zoom_start=zoom_level, tiles="CartoDB positron")
-
-    # Add polygons to the map
-    for _, row in filtered_gdf.iterrows():
-        folium.GeoJson(
-            row["geometry"],
-            style_function=lambda x: {
-                "fillColor": "blue",
-                "color": "black",
-                "weight": 1,
-                "fillOpacity": 0.5,
-            },
-            tooltip=row["name"],
-        ).add_to(m)
+        view = cached_map(
+            dataset, selected_fclasses, extent["center"], zoom_level, extent["bounds"], layer=layer
+        )
+    else:
+        view = cached_map(dataset, selected_fclasses, map_center, zoom_level, layer=layer)
 
     # Display map and capture interactions
-    map_data = st_folium(m, width="100%", height=500, key="folium_map")
+    map_data = show_map(view, "folium_map", height=500, width="100%")
 
     # Update map state if user interacted with map
     if map_data and "center" in map_data and map_data["center"]:
@@ -142,13 +595,12 @@ def main():
         new_zoom = map_data.get("zoom", zoom_level)
 
         if new_center != map_center or new_zoom != zoom_level:
-            new_state = current_state.copy()
-            new_state["map_center"] = new_center
-            new_state["zoom_level"] = new_zoom
-            update_app_state(new_state)
+            rendered_version = (
+                update_app_state("/map", {"center": new_center, "zoom": new_zoom}, session) or rendered_version
+            )
 
-    # Poll for updates in redis, this needs to be at the end of the streamlit code
-    asyncio.run(poll_for_updates())
+    # Wait for state pushed by other clients, this needs to be at the end of the streamlit code
+    wait_for_state_change(rendered_version, session, layer, dataset.version)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
 import asyncio
+import contextlib
+import importlib
 import json
+import os
+import sys
 from pathlib import Path
 from typing import Any
+
 import httpx
 from mcp.server import Server
 from mcp.server.models import InitializationOptions
@@ -18,35 +23,209 @@ VENV_PYTHON = PROJECT_ROOT / ".venv" / "bin" / "python"
 server = Server("singapore-health-facilities-explorer")
 
 API_BASE_URL = "http://localhost:8000"
+DATASET_VERSION_HEADER = "X-Dataset-Version"
+# "http" talks to the API server at API_BASE_URL; "inprocess" serves tool
+# calls from api_server.app inside this process (Redis must be reachable)
+API_TRANSPORT = os.environ.get("MCP_API_TRANSPORT", "http")
+
+# State session the tools act on unless a call names one; use_session rebinds
+# it. None is the shared session that every client sees by default.
+_session: dict = {"id": os.environ.get("MCP_SESSION") or None}
+SESSION_SCHEMA = {
+    "type": "string",
+    "pattern": "^[A-Za-z0-9_-]{1,64}$",
+    "description": "State session id shown in the app's sidebar; defaults to the bound session"
+}
+LAYER_SCHEMA = {
+    "type": "string",
+    "pattern": "^[A-Za-z0-9_-]{1,64}$",
+    "description": "Layer name from list_layers; defaults to the default layer"
+}
+
+_http_client: httpx.AsyncClient | None = None
+_http_client_lock = asyncio.Lock()
+_app_lifespan = contextlib.AsyncExitStack()
+# Per layer (None: the default), fclass values and the dataset version they were read from
+_fclass_catalogs: dict = {}
+# Last known fclass enum of the tool schemas and, per layer, the values and
+# dataset version it was built from, kept on disk so a fresh process answers tools/list without waiting
+# for the API; refreshed in the background
+TOOL_SCHEMA_CACHE = Path(
+    os.environ.get("MCP_TOOL_SCHEMA_CACHE", PROJECT_ROOT / "data" / ".cache" / "mcp_tool_schema.json")
+)
+_tool_schema: dict | None = None
+_tool_schema_refresh: asyncio.Task | None = None
+
+async def get_http_client() -> httpx.AsyncClient:
+    """Process-wide keep-alive client, so tool calls reuse open connections
+
+    In in-process mode the client dispatches straight to the ASGI app, whose
+    startup (dataset load, Redis script) runs here on first use.
+    """
+    global _http_client
+    async with _http_client_lock:
+        if _http_client is None:
+            if API_TRANSPORT == "inprocess":
+                # Loads the dataset stack; only needed in this mode, and off
+                # the event loop so stdio keeps being answered meanwhile
+                api_server = await asyncio.to_thread(importlib.import_module, "api_server")
+                await _app_lifespan.enter_async_context(
+                    api_server.app.router.lifespan_context(api_server.app)
+                )
+                transport, base_url = httpx.ASGITransport(app=api_server.app), "http://api-server"
+            else:
+                transport, base_url = None, API_BASE_URL
+            _http_client = httpx.AsyncClient(
+                base_url=base_url,
+                transport=transport,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            )
+    return _http_client
+
+def fclass_catalog(layer: str | None) -> dict:
+    return _fclass_catalogs.setdefault(layer or None, {"version": None, "fclasses": None})
+
+def note_dataset_version(response: httpx.Response, layer: str | None = None):
+    """Drop a layer's cached fclass catalog once the API reports a new dataset for it"""
+    version = response.headers.get(DATASET_VERSION_HEADER)
+    catalog = fclass_catalog(layer)
+    if version and version != catalog["version"]:
+        catalog.update(version=version, fclasses=None)
 
-async def make_api_request(method: str, endpoint: str, data: dict = None) -> dict:
+def session_params(arguments: dict[str, Any]) -> dict:
+    """Query parameters selecting the call's session, or the bound one"""
+    session = arguments.get("session") or _session["id"]
+    return {"session": session} if session else {}
+
+def layer_params(arguments: dict[str, Any]) -> dict:
+    """Query parameters selecting the call's layer, if it names one"""
+    layer = arguments.get("layer")
+    return {"layer": layer} if layer else {}
+
+class APIError(Exception):
+    """The API answered with an error status"""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"API returned error {response.status_code}: {response.text}")
+        self.response = response
+
+    def rejected_fclasses(self) -> list[str] | None:
+        """The fclasses a write was refused for, if that's why it failed"""
+        if self.response.status_code != 422:
+            return None
+        detail = self.response.json().get("detail")
+        return detail.get("invalid") if isinstance(detail, dict) else None
+
+async def make_api_request(method: str, endpoint: str, data: dict = None, params: dict = None) -> dict:
     """Make HTTP request to the FastAPI server"""
-    async with httpx.AsyncClient() as client:
+    client = await get_http_client()
+    try:
+        if method.upper() == "GET":
+            response = await client.get(endpoint, params=params)
+        elif method.upper() == "POST":
+            response = await client.post(endpoint, json=data, params=params)
+        elif method.upper() == "DELETE":
+            response = await client.delete(endpoint, params=params)
+
+        note_dataset_version(response, (params or {}).get("layer"))
+        response.raise_for_status()
+        return response.json()
+    except httpx.RequestError as e:
+        raise Exception(f"API request failed: {e}")
+    except httpx.HTTPStatusError as e:
+        raise APIError(e.response)
+
+async def get_fclasses(layer: str | None = None, refresh: bool = False) -> list[str]:
+    """Known fclass values of a layer, fetched once per dataset version"""
+    catalog = fclass_catalog(layer)
+    if refresh or catalog["fclasses"] is None:
+        data = await make_api_request("GET", "/fclasses", params={"layer": layer} if layer else None)
+        catalog.update(version=data.get("dataset_version"), fclasses=data.get("fclasses") or [])
+    return catalog["fclasses"]
+
+async def find_unknown_fclasses(fclasses: list[str], layer: str | None = None) -> list[str]:
+    """Values not in the layer's catalog; the catalog is refetched before rejecting any"""
+    allowed = set(await get_fclasses(layer))
+    unknown = [x for x in fclasses if x not in allowed]
+    if unknown:
+        # The dataset may have been reloaded since anything last told us
+        allowed = set(await get_fclasses(layer, refresh=True))
+        unknown = [x for x in fclasses if x not in allowed]
+    return unknown
+
+async def warm_up():
+    """Open the API client (and in-process, start the app) while the client initializes"""
+    with contextlib.suppress(Exception):
+        await get_http_client()
+
+def tool_schema() -> dict:
+    """The tool schema snapshot, read from TOOL_SCHEMA_CACHE on first use"""
+    global _tool_schema
+    if _tool_schema is None:
         try:
-            if method.upper() == "GET":
-                response = await client.get(f"{API_BASE_URL}{endpoint}")
-            elif method.upper() == "POST":
-                response = await client.post(f"{API_BASE_URL}{endpoint}", json=data)
-            elif method.upper() == "DELETE":
-                response = await client.delete(f"{API_BASE_URL}{endpoint}")
-            
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            raise Exception(f"API request failed: {e}")
-        except httpx.HTTPStatusError as e:
-            raise Exception(f"API returned error {e.response.status_code}: {e.response.text}")
+            _tool_schema = json.loads(TOOL_SCHEMA_CACHE.read_text())
+        except (OSError, ValueError):
+            _tool_schema = {"layers": {}, "fclasses": None}
+    return _tool_schema
 
-@server.list_tools()
-async def handle_list_tools() -> list[types.Tool]:
-    """List available tools for Streamlit manipulation"""
-    # Try to fetch available fclasses to enrich schemas
-    allowed_fclasses: list[str] | None = None
+async def fetch_tool_schema(known: dict) -> dict:
+    """Current fclass enum: every value of every layer
+
+    Calls are still checked against their own layer's values. Listing tools
+    never loads a layer: /fclasses is only read for layers the API already
+    has loaded, when the snapshot has no values for them or has them from
+    another dataset version. A layer that isn't loaded keeps the values the
+    snapshot has for it; while any layer's values are unknown there is no
+    enum, so none of its values are refused.
+    """
+    known_layers = known.get("layers") or {}
+    layers = {}
+    for layer in (await make_api_request("GET", "/layers"))["layers"]:
+        name, version = layer["name"], layer.get("dataset_version")
+        entry = known_layers.get(name)
+        if layer.get("loaded") and (entry is None or version != entry["dataset_version"]):
+            fclasses = await get_fclasses(name)
+            entry = {"dataset_version": fclass_catalog(name)["version"], "fclasses": fclasses}
+        layers[name] = entry if entry is not None else {"dataset_version": None, "fclasses": None}
+    if layers == known_layers:
+        return known
+    if any(entry["fclasses"] is None for entry in layers.values()):
+        return {"layers": layers, "fclasses": None}
+    values = list(dict.fromkeys(value for entry in layers.values() for value in entry["fclasses"]))
+    return {"layers": layers, "fclasses": values or None}
+
+async def refresh_tool_schema(session):
+    """Bring the snapshot up to date, telling the client to list tools again if they changed"""
+    global _tool_schema
+    known = tool_schema()
     try:
-        data = await make_api_request("GET", "/fclasses")
-        allowed_fclasses = data.get("fclasses") or None
+        fresh = await fetch_tool_schema(known)
     except Exception:
-        allowed_fclasses = None
+        return  # API unreachable: keep serving the last known schema
+    if fresh == known:
+        return
+    _tool_schema = fresh
+    try:
+        TOOL_SCHEMA_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = TOOL_SCHEMA_CACHE.with_name(f"{TOOL_SCHEMA_CACHE.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(fresh))
+        os.replace(tmp, TOOL_SCHEMA_CACHE)
+    except OSError:
+        pass  # read-only checkout: the snapshot just lives in memory
+    if fresh["fclasses"] != known["fclasses"]:
+        with contextlib.suppress(Exception):
+            await session.send_tool_list_changed()
+
+@server.list_tools()
+async def handle_list_tools() -> list[types.Tool]:
+    """List available tools for Streamlit manipulation
+
+    Answers from the snapshot straight away and refreshes it in the background.
+    """
+    global _tool_schema_refresh
+    allowed_fclasses = tool_schema()["fclasses"]
+    if _tool_schema_refresh is None or _tool_schema_refresh.done():
+        _tool_schema_refresh = asyncio.create_task(refresh_tool_schema(server.request_context.session))
 
     # Common schema for fclasses array, optionally with enum
     fclasses_items_schema: dict = {"type": "string"}
@@ -57,6 +236,18 @@ async def handle_list_tools() -> list[types.Tool]:
         types.Tool(
             name="get_app_state",
             description="Get the current state of the Streamlit app including selected filters and map view",
+            inputSchema={
+                "type": "object",
+                "properties": {"session": SESSION_SCHEMA},
+                "required": []
+            }
+        ),
+        types.Tool(
+            name="list_layers",
+            description=(
+                "List the map layers (datasets) the app can show, the default first, "
+                "and which are loaded"
+            ),
             inputSchema={
                 "type": "object",
                 "properties": {},
@@ -65,16 +256,20 @@ async def handle_list_tools() -> list[types.Tool]:
         ),
         types.Tool(
             name="list_facility_classes",
-            description="List all available facility class names (fclasses) from the dataset",
+            description="List all available facility class names (fclasses) in a layer",
             inputSchema={
                 "type": "object",
-                "properties": {},
+                "properties": {"layer": LAYER_SCHEMA},
                 "required": []
             }
         ),
         types.Tool(
             name="set_facility_filters",
-            description="Set which facility classes are visible on the map",
+            description=(
+                "Set which facility classes are visible on the map. Giving a layer also "
+                "switches the map to that layer; fclasses are then that layer's. Without "
+                "one the map stays on the layer it shows."
+            ),
             inputSchema={
                 "type": "object", 
                 "properties": {
@@ -82,7 +277,9 @@ async def handle_list_tools() -> list[types.Tool]:
                         "type": "array",
                         "items": fclasses_items_schema,
                         "description": "List of facility class names to display"
-                    }
+                    },
+                    "layer": LAYER_SCHEMA,
+                    "session": SESSION_SCHEMA
                 },
                 "required": ["fclasses"]
             }
@@ -104,17 +301,159 @@ async def handle_list_tools() -> list[types.Tool]:
                     "zoom": {
                         "type": "integer",
                         "description": "Map zoom level (1-20)"
-                    }
+                    },
+                    "session": SESSION_SCHEMA
                 },
                 "required": ["latitude", "longitude", "zoom"]
             }
         ),
+        types.Tool(
+            name="apply_state_changes",
+            description=(
+                "Apply several state changes at once, in order, as a single update "
+                "(one round trip, one app refresh). Each operation is 'filters' "
+                "(needs fclasses), 'map' (needs latitude, longitude, zoom) or "
+                "'reset'. Prefer this over separate calls for composite actions, "
+                "e.g. showing only hospitals and zooming to a town."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "operations": {
+                        "type": "array",
+                        "minItems": 1,
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "op": {"type": "string", "enum": ["filters", "map", "reset"]},
+                                "fclasses": {
+                                    "type": "array",
+                                    "items": fclasses_items_schema,
+                                    "description": "For 'filters': facility classes to display"
+                                },
+                                "layer": {
+                                    **LAYER_SCHEMA,
+                                    "description": "For 'filters': switch to this layer; fclasses are its classes"
+                                },
+                                "latitude": {"type": "number", "description": "For 'map': center latitude"},
+                                "longitude": {"type": "number", "description": "For 'map': center longitude"},
+                                "zoom": {"type": "integer", "description": "For 'map': zoom level (1-20)"}
+                            },
+                            "required": ["op"]
+                        },
+                        "description": "Operations to apply, in order"
+                    },
+                    "session": SESSION_SCHEMA
+                },
+                "required": ["operations"]
+            }
+        ),
+        types.Tool(
+            name="count_facilities_within",
+            description=(
+                "Count and list facilities within a distance (metres) of a point, nearest "
+                "first, e.g. 'how many clinics within 2 km of Orchard Road'"
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "latitude": {"type": "number", "description": "Point latitude"},
+                    "longitude": {"type": "number", "description": "Point longitude"},
+                    "radius_m": {"type": "number", "description": "Radius in metres"},
+                    "fclasses": {
+                        "type": "array",
+                        "items": fclasses_items_schema,
+                        "description": "Only count these facility classes (default: all)"
+                    },
+                    "limit": {"type": "integer", "description": "Facilities to list (default 20)"},
+                    "layer": LAYER_SCHEMA
+                },
+                "required": ["latitude", "longitude", "radius_m"]
+            }
+        ),
+        types.Tool(
+            name="nearest_facilities",
+            description=(
+                "For every facility of some classes, find the nearest facility of other "
+                "classes and the distance in metres, e.g. 'nearest hospital to each clinic'"
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "from_fclasses": {
+                        "type": "array",
+                        "items": fclasses_items_schema,
+                        "description": "Facility classes to start from"
+                    },
+                    "to_fclasses": {
+                        "type": "array",
+                        "items": fclasses_items_schema,
+                        "description": "Facility classes to find the nearest of"
+                    },
+                    "limit": {"type": "integer", "description": "Pairs to list, closest first (default 20)"},
+                    "layer": LAYER_SCHEMA
+                },
+                "required": ["from_fclasses", "to_fclasses"]
+            }
+        ),
+        types.Tool(
+            name="facility_density",
+            description=(
+                "Facilities per square kilometre on a square grid, densest cells first, "
+                "to find where facilities cluster"
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "cell_m": {"type": "number", "description": "Grid cell size in metres (default 1000)"},
+                    "fclasses": {
+                        "type": "array",
+                        "items": fclasses_items_schema,
+                        "description": "Only count these facility classes (default: all)"
+                    },
+                    "top": {"type": "integer", "description": "Cells to list (default 10)"},
+                    "layer": LAYER_SCHEMA
+                },
+                "required": []
+            }
+        ),
+        types.Tool(
+            name="get_facility_extent",
+            description=(
+                "Bounding box, centre and a zoom level that fits the given facility classes, "
+                "to frame the map on them with set_map_view"
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "fclasses": {
+                        "type": "array",
+                        "items": fclasses_items_schema,
+                        "description": "Facility classes to frame (default: all)"
+                    },
+                    "layer": LAYER_SCHEMA
+                },
+                "required": []
+            }
+        ),
         types.Tool(
             name="reset_app",
             description="Reset the app to its default state",
             inputSchema={
                 "type": "object",
-                "properties": {},
+                "properties": {"session": SESSION_SCHEMA},
+                "required": []
+            }
+        ),
+        types.Tool(
+            name="use_session",
+            description=(
+                "Bind the state session that later tool calls act on, by the id shown in "
+                "the app's sidebar. Omit the id to go back to the shared session."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {"session": SESSION_SCHEMA},
                 "required": []
             }
         ),
@@ -129,6 +468,16 @@ async def handle_list_tools() -> list[types.Tool]:
         )
     ]
 
+def unknown_fclasses_text(invalid: list[str]) -> list[types.TextContent]:
+    return [types.TextContent(
+        type="text",
+        text=(
+            "Some fclasses are not recognized: "
+            + ", ".join(invalid)
+            + "\nUse list_facility_classes to see valid options."
+        )
+    )]
+
 @server.call_tool()
 async def handle_call_tool(
     name: str, arguments: dict[str, Any]
@@ -136,40 +485,37 @@ async def handle_call_tool(
     """Handle tool execution"""
     
     if name == "get_app_state":
-        result = await make_api_request("GET", "/state")
+        result = await make_api_request("GET", "/state", params=session_params(arguments))
         return [types.TextContent(
             type="text",
             text=f"Current app state:\n{json.dumps(result, indent=2)}"
         )]
     
+    elif name == "list_layers":
+        result = await make_api_request("GET", "/layers")
+        return [types.TextContent(
+            type="text",
+            text=f"Available layers:\n{json.dumps(result['layers'], indent=2)}"
+        )]
+
     elif name == "list_facility_classes":
-        result = await make_api_request("GET", "/fclasses")
+        fclasses = await get_fclasses(arguments.get("layer"))
         return [types.TextContent(
             type="text",
-            text=f"Available fclasses:\n{json.dumps(result['fclasses'], indent=2)}"
+            text=f"Available fclasses:\n{json.dumps(fclasses, indent=2)}"
         )]
     
     elif name == "set_facility_filters":
         fclasses = arguments.get("fclasses", [])
-        # Validate against known fclasses if available
+        # The API checks the values against the layer the session shows
         try:
-            known = await make_api_request("GET", "/fclasses")
-            allowed = set(known.get("fclasses", []))
-            invalid = [x for x in fclasses if x not in allowed]
-            if invalid:
-                return [types.TextContent(
-                    type="text",
-                    text=(
-                        "Some fclasses are not recognized: "
-                        + ", ".join(invalid)
-                        + "\nUse list_facility_classes to see valid options."
-                    )
-                )]
-        except Exception:
-            # If validation fails (e.g., API down), proceed without it
-            pass
-
-        result = await make_api_request("POST", "/filters", fclasses)
+            result = await make_api_request(
+                "POST", "/filters", fclasses, {**session_params(arguments), **layer_params(arguments)}
+            )
+        except APIError as e:
+            if (invalid := e.rejected_fclasses()) is None:
+                raise
+            return unknown_fclasses_text(invalid)
         return [types.TextContent(
             type="text", 
             text=f"Facility filters updated: {result['selected_fclasses']}"
@@ -184,18 +530,104 @@ async def handle_call_tool(
             "center": [lat, lng],
             "zoom": zoom
         }
-        result = await make_api_request("POST", "/map", map_data)
+        result = await make_api_request("POST", "/map", map_data, session_params(arguments))
         return [types.TextContent(
             type="text",
             text=f"Map view updated: center [{lat}, {lng}], zoom {zoom}"
         )]
     
+    elif name == "apply_state_changes":
+        operations = []
+        for operation in arguments.get("operations", []):
+            op = operation.get("op")
+            if op == "filters":
+                operations.append({
+                    "op": "filters", "fclasses": operation.get("fclasses", []), "layer": operation.get("layer")
+                })
+            elif op == "map":
+                missing = [k for k in ("latitude", "longitude", "zoom") if operation.get(k) is None]
+                if missing:
+                    return [types.TextContent(
+                        type="text",
+                        text=f"'map' operation is missing: {', '.join(missing)}"
+                    )]
+                operations.append({
+                    "op": "map",
+                    "center": [operation["latitude"], operation["longitude"]],
+                    "zoom": operation["zoom"]
+                })
+            elif op == "reset":
+                operations.append({"op": "reset"})
+            else:
+                return [types.TextContent(
+                    type="text",
+                    text=f"Unknown operation {op!r}; use 'filters', 'map' or 'reset'."
+                )]
+        if not operations:
+            return [types.TextContent(type="text", text="No operations given.")]
+
+        # The API checks fclasses against the layer the map shows at that point in the batch
+        try:
+            result = await make_api_request(
+                "POST", "/state/batch", {"operations": operations}, session_params(arguments)
+            )
+        except APIError as e:
+            if (invalid := e.rejected_fclasses()) is None:
+                raise
+            return unknown_fclasses_text(invalid)
+        return [types.TextContent(
+            type="text",
+            text=f"Applied {result['operations']} state change(s); state version {result['version']}"
+        )]
+
+    elif name in ("count_facilities_within", "nearest_facilities", "facility_density", "get_facility_extent"):
+        keys = {
+            "count_facilities_within": ("fclasses",),
+            "nearest_facilities": ("from_fclasses", "to_fclasses"),
+            "facility_density": ("fclasses",),
+            "get_facility_extent": ("fclasses",),
+        }[name]
+        requested = [x for key in keys for x in arguments.get(key) or []]
+        if requested:
+            try:
+                invalid = await find_unknown_fclasses(requested, arguments.get("layer"))
+                if invalid:
+                    return unknown_fclasses_text(invalid)
+            except Exception:
+                # If validation fails (e.g., API down), proceed without it
+                pass
+
+        params = {key: ",".join(arguments[key]) for key in keys if arguments.get(key)}
+        params.update(layer_params(arguments))
+        if name == "count_facilities_within":
+            params.update(
+                lat=arguments["latitude"], lon=arguments["longitude"],
+                radius_m=arguments["radius_m"], limit=arguments.get("limit", 20),
+            )
+            result = await make_api_request("GET", "/analytics/within", params=params)
+        elif name == "nearest_facilities":
+            params["limit"] = arguments.get("limit", 20)
+            result = await make_api_request("GET", "/analytics/nearest", params=params)
+        elif name == "facility_density":
+            params.update(cell_m=arguments.get("cell_m", 1000), top=arguments.get("top", 10))
+            result = await make_api_request("GET", "/analytics/density", params=params)
+        else:
+            result = await make_api_request("GET", "/extent", params=params)
+        return [types.TextContent(type="text", text=json.dumps(result, indent=2))]
+
     elif name == "reset_app":
-        result = await make_api_request("DELETE", "/state")
+        result = await make_api_request("DELETE", "/state", params=session_params(arguments))
         return [types.TextContent(
             type="text",
             text="App state reset to defaults"
         )]
+
+    elif name == "use_session":
+        _session["id"] = arguments.get("session") or None
+        return [types.TextContent(
+            type="text",
+            text=f"Now using session {_session['id']}" if _session["id"] else "Now using the shared session"
+        )]
     
     elif name == "check_health":
         result = await make_api_request("GET", "/health")
@@ -209,18 +641,27 @@ async def handle_call_tool(
 
 async def main():
     """Main entry point"""
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="singapore-health-facilities-explorer",
-                server_version="0.1.0",
-                capabilities=ServerCapabilities(
-                    tools={},
+    warm = asyncio.create_task(warm_up())
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="singapore-health-facilities-explorer",
+                    server_version="0.1.0",
+                    capabilities=ServerCapabilities(
+                        tools=types.ToolsCapability(listChanged=True),
+                    )
                 )
             )
-        )
+    finally:
+        warm.cancel()
+        if _tool_schema_refresh is not None:
+            _tool_schema_refresh.cancel()
+        if _http_client is not None:
+            await _http_client.aclose()
+        await _app_lifespan.aclose()
 
 def generate_claude_config():
     """Generate portable Claude Desktop config"""
@@ -249,7 +690,6 @@ def print_config():
     print(f"3. Virtual env at: {VENV_PYTHON}")
 
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) > 1 and sys.argv[1] == "--config":
         print_config()
     else:
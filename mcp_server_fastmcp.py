@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
 import asyncio
+import contextlib
+import importlib
 import json
+import os
+import sys
 from pathlib import Path
-from typing import Any, List, Dict
+from typing import Annotated, Any, List, Dict, Literal, Optional
 
 import httpx
+from pydantic import BaseModel, Field
 
 try:
     from fastmcp import FastMCP
@@ -19,72 +24,305 @@ PROJECT_ROOT = Path(__file__).parent.absolute()
 VENV_PYTHON = PROJECT_ROOT / ".venv" / "Scripts" / "python.exe" if (PROJECT_ROOT / ".venv" / "Scripts" / "python.exe").exists() else PROJECT_ROOT / ".venv" / "bin" / "python"
 
 API_BASE_URL = "http://localhost:8000"
+DATASET_VERSION_HEADER = "X-Dataset-Version"
+# "http" talks to the API server at API_BASE_URL; "inprocess" serves tool
+# calls from api_server.app inside this process (Redis must be reachable)
+API_TRANSPORT = os.environ.get("MCP_API_TRANSPORT", "http")
 
-app = FastMCP("singapore-health-facilities-explorer")
+# State session the tools act on unless a call names one; use_session rebinds
+# it. None is the shared session that every client sees by default.
+_session: Dict[str, Optional[str]] = {"id": os.environ.get("MCP_SESSION") or None}
+Session = Annotated[
+    Optional[str],
+    Field(
+        pattern=r"^[A-Za-z0-9_-]{1,64}$",
+        description="State session id shown in the app's sidebar; defaults to the bound session",
+    ),
+]
+Layer = Annotated[
+    Optional[str],
+    Field(pattern=r"^[A-Za-z0-9_-]{1,64}$", description="Layer name from list_layers; defaults to the default layer"),
+]
 
+@contextlib.asynccontextmanager
+async def _lifespan(server: "FastMCP"):
+    """Open the API client (and in-process, start the app) while the client
+    initializes, and close both on the way out."""
+    warm = asyncio.create_task(_warm_up())
+    try:
+        yield {}
+    finally:
+        warm.cancel()
+        if _client is not None:
+            await _client.aclose()
+        await _app_lifespan.aclose()
+
+
+async def _warm_up() -> None:
+    with contextlib.suppress(Exception):
+        await _http_client()
+
+
+app = FastMCP("singapore-health-facilities-explorer", lifespan=_lifespan)
+
+_client: httpx.AsyncClient | None = None
+_client_lock = asyncio.Lock()
+_app_lifespan = contextlib.AsyncExitStack()
+# Per layer (None: the default), fclass values and the dataset version they were read from
+_fclass_catalogs: Dict[Optional[str], Dict[str, Any]] = {}
+
+
+async def _http_client() -> httpx.AsyncClient:
+    """Process-wide keep-alive client, so tool calls reuse open connections.
+
+    In in-process mode the client dispatches straight to the ASGI app, whose
+    startup (dataset load, Redis script) runs here on first use.
+    """
+    global _client
+    async with _client_lock:
+        if _client is None:
+            if API_TRANSPORT == "inprocess":
+                # Loads the dataset stack; only needed in this mode, and off
+                # the event loop so stdio keeps being answered meanwhile
+                api_server = await asyncio.to_thread(importlib.import_module, "api_server")
+                await _app_lifespan.enter_async_context(
+                    api_server.app.router.lifespan_context(api_server.app)
+                )
+                transport, base_url = httpx.ASGITransport(app=api_server.app), "http://api-server"
+            else:
+                transport, base_url = None, API_BASE_URL
+            _client = httpx.AsyncClient(
+                base_url=base_url,
+                transport=transport,
+                timeout=5,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            )
+    return _client
+
+
+def _session_params(session: Optional[str]) -> Dict[str, str]:
+    """Query parameters selecting ``session``, or the bound one."""
+    session = session or _session["id"]
+    return {"session": session} if session else {}
+
+
+def _layer_params(layer: Optional[str]) -> Dict[str, str]:
+    return {"layer": layer} if layer else {}
+
+
+def _catalog(layer: Optional[str]) -> Dict[str, Any]:
+    return _fclass_catalogs.setdefault(layer or None, {"version": None, "fclasses": None})
 
-async def _api_request(method: str, endpoint: str, data: Any | None = None) -> Dict[str, Any]:
-    async with httpx.AsyncClient(timeout=5) as client:
-        url = f"{API_BASE_URL}{endpoint}"
-        if method == "GET":
-            resp = await client.get(url)
-        elif method == "POST":
-            resp = await client.post(url, json=data)
-        elif method == "DELETE":
-            resp = await client.delete(url)
-        else:
-            raise ValueError(f"Unsupported method: {method}")
-        resp.raise_for_status()
-        return resp.json()
+
+async def _api_request(
+    method: str, endpoint: str, data: Any | None = None, params: Dict[str, str] | None = None
+) -> Dict[str, Any]:
+    client = await _http_client()
+    if method == "GET":
+        resp = await client.get(endpoint, params=params)
+    elif method == "POST":
+        resp = await client.post(endpoint, json=data, params=params)
+    elif method == "DELETE":
+        resp = await client.delete(endpoint, params=params)
+    else:
+        raise ValueError(f"Unsupported method: {method}")
+    # Drop the layer's cached fclass catalog once the API reports a new dataset for it
+    version = resp.headers.get(DATASET_VERSION_HEADER)
+    catalog = _catalog((params or {}).get("layer"))
+    if version and version != catalog["version"]:
+        catalog.update(version=version, fclasses=None)
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def _fclasses(layer: Optional[str] = None, refresh: bool = False) -> List[str]:
+    """Known fclass values of a layer, fetched once per dataset version."""
+    catalog = _catalog(layer)
+    if refresh or catalog["fclasses"] is None:
+        data = await _api_request("GET", "/fclasses", params=_layer_params(layer))
+        catalog.update(version=data.get("dataset_version"), fclasses=list(data.get("fclasses", [])))
+    return catalog["fclasses"]
+
+
+async def _unknown_fclasses(fclasses: List[str], layer: Optional[str] = None) -> tuple[List[str], List[str]]:
+    """(unknown values, allowed values); the catalog is refetched before rejecting any."""
+    allowed = await _fclasses(layer)
+    unknown = [x for x in fclasses if x not in allowed]
+    if unknown:
+        # The dataset may have been reloaded since anything last told us
+        allowed = await _fclasses(layer, refresh=True)
+        unknown = [x for x in fclasses if x not in allowed]
+    return unknown, allowed
+
+
+async def _state_write(endpoint: str, data: Any, params: Dict[str, str]) -> Dict[str, Any]:
+    """POST a state change; fclasses the API refuses for the layer come back as an error."""
+    try:
+        result = await _api_request("POST", endpoint, data, params)
+    except httpx.HTTPStatusError as e:
+        detail = e.response.json().get("detail") if e.response.status_code == 422 else None
+        if not isinstance(detail, dict):
+            raise
+        return {"status": "error", **detail}
+    return {"status": "success", **result}
 
 
 @app.tool()
-async def get_app_state() -> Dict[str, Any]:
+async def get_app_state(session: Session = None) -> Dict[str, Any]:
     """Get the current state of the Streamlit app including selected filters and map view."""
-    return await _api_request("GET", "/state")
+    return await _api_request("GET", "/state", params=_session_params(session))
 
 
 @app.tool()
-async def list_facility_classes() -> List[str]:
-    """List all available facility class names (fclasses) from the dataset."""
-    data = await _api_request("GET", "/fclasses")
-    return list(data.get("fclasses", []))
+async def list_layers() -> Dict[str, Any]:
+    """List the map layers (datasets) the app can show, the default first, and which are loaded."""
+    return await _api_request("GET", "/layers")
 
 
 @app.tool()
-async def set_facility_filters(fclasses: List[str]) -> Dict[str, Any]:
-    """Set which facility classes are visible on the map. Rejects unknown values."""
-    # Validate against known fclasses
-    known = await _api_request("GET", "/fclasses")
-    allowed = set(known.get("fclasses", []))
-    invalid = [x for x in fclasses if x not in allowed]
-    if invalid:
-        return {
-            "status": "error",
-            "message": "Some fclasses are not recognized",
-            "invalid": invalid,
-            "allowed": sorted(list(allowed)),
-        }
+async def list_facility_classes(layer: Layer = None) -> List[str]:
+    """List all available facility class names (fclasses) in a layer."""
+    return list(await _fclasses(layer))
 
-    result = await _api_request("POST", "/filters", fclasses)
-    return {"status": "success", **result}
+
+@app.tool()
+async def set_facility_filters(fclasses: List[str], layer: Layer = None, session: Session = None) -> Dict[str, Any]:
+    """Set which facility classes are visible on the map. Rejects unknown values.
+
+    Giving a layer also switches the map to that layer; fclasses are then that
+    layer's. Without one the map stays on the layer it shows.
+    """
+    # The API checks the values against the layer the session shows
+    return await _state_write("/filters", fclasses, {**_session_params(session), **_layer_params(layer)})
 
 
 @app.tool()
-async def set_map_view(latitude: float, longitude: float, zoom: int) -> Dict[str, Any]:
+async def set_map_view(latitude: float, longitude: float, zoom: int, session: Session = None) -> Dict[str, Any]:
     """Set the map center location (lat/lon) and zoom level."""
     payload = {"center": [latitude, longitude], "zoom": zoom}
-    result = await _api_request("POST", "/map", payload)
+    result = await _api_request("POST", "/map", payload, _session_params(session))
     return {"status": "success", **result}
 
 
+class StateChange(BaseModel):
+    op: Literal["filters", "map", "reset"]
+    fclasses: Optional[List[str]] = Field(None, description="For 'filters': facility classes to display")
+    layer: Optional[str] = Field(None, description="For 'filters': switch to this layer; fclasses are its classes")
+    latitude: Optional[float] = Field(None, description="For 'map': center latitude")
+    longitude: Optional[float] = Field(None, description="For 'map': center longitude")
+    zoom: Optional[int] = Field(None, description="For 'map': zoom level (1-20)")
+
+
 @app.tool()
-async def reset_app() -> Dict[str, Any]:
+async def apply_state_changes(operations: List[StateChange], session: Session = None) -> Dict[str, Any]:
+    """Apply several state changes at once, in order, as a single update (one round trip, one app refresh).
+
+    Each operation is 'filters' (needs fclasses), 'map' (needs latitude, longitude, zoom)
+    or 'reset'. Prefer this over separate calls for composite actions, e.g. showing only
+    hospitals and zooming to a town.
+    """
+    if not operations:
+        return {"status": "error", "message": "No operations given"}
+
+    payload = []
+    for change in operations:
+        if change.op == "filters":
+            payload.append({"op": "filters", "fclasses": change.fclasses or [], "layer": change.layer})
+        elif change.op == "map":
+            missing = [k for k in ("latitude", "longitude", "zoom") if getattr(change, k) is None]
+            if missing:
+                return {"status": "error", "message": "'map' operation is missing fields", "missing": missing}
+            payload.append({"op": "map", "center": [change.latitude, change.longitude], "zoom": change.zoom})
+        else:
+            payload.append({"op": "reset"})
+
+    # The API checks fclasses against the layer the map shows at that point in the batch
+    return await _state_write("/state/batch", {"operations": payload}, _session_params(session))
+
+
+async def _analytics(
+    endpoint: str, params: Dict[str, Any], layer: Optional[str] = None, **fclass_params: Optional[List[str]]
+) -> Dict[str, Any]:
+    """Validate fclass arguments against a layer, then call a read-only query endpoint on it."""
+    requested = [x for values in fclass_params.values() for x in values or []]
+    if requested:
+        invalid, allowed = await _unknown_fclasses(requested, layer)
+        if invalid:
+            return {
+                "status": "error",
+                "message": "Some fclasses are not recognized",
+                "invalid": invalid,
+                "allowed": sorted(list(allowed)),
+            }
+    params.update({key: ",".join(values) for key, values in fclass_params.items() if values})
+    params.update(_layer_params(layer))
+    return await _api_request("GET", endpoint, params=params)
+
+
+@app.tool()
+async def count_facilities_within(
+    latitude: float,
+    longitude: float,
+    radius_m: float,
+    fclasses: Optional[List[str]] = None,
+    limit: int = 20,
+    layer: Layer = None,
+) -> Dict[str, Any]:
+    """Count and list facilities within a distance (metres) of a point, nearest first.
+
+    E.g. 'how many clinics within 2 km of Orchard Road'. fclasses defaults to all.
+    """
+    params = {"lat": latitude, "lon": longitude, "radius_m": radius_m, "limit": limit}
+    return await _analytics("/analytics/within", params, layer, fclasses=fclasses)
+
+
+@app.tool()
+async def nearest_facilities(
+    from_fclasses: List[str], to_fclasses: List[str], limit: int = 20, layer: Layer = None
+) -> Dict[str, Any]:
+    """For every facility of some classes, find the nearest facility of other classes and the distance in metres.
+
+    E.g. 'nearest hospital to each clinic'. Pairs are listed closest first.
+    """
+    return await _analytics(
+        "/analytics/nearest", {"limit": limit}, layer, from_fclasses=from_fclasses, to_fclasses=to_fclasses
+    )
+
+
+@app.tool()
+async def facility_density(
+    cell_m: float = 1000, fclasses: Optional[List[str]] = None, top: int = 10, layer: Layer = None
+) -> Dict[str, Any]:
+    """Facilities per square kilometre on a square grid of cell_m metres, densest cells first."""
+    return await _analytics("/analytics/density", {"cell_m": cell_m, "top": top}, layer, fclasses=fclasses)
+
+
+@app.tool()
+async def get_facility_extent(fclasses: Optional[List[str]] = None, layer: Layer = None) -> Dict[str, Any]:
+    """Bounding box, centre [lat, lon] and a fitting zoom for some facility classes.
+
+    Use with set_map_view to frame the map on them. fclasses defaults to all.
+    """
+    return await _analytics("/extent", {}, layer, fclasses=fclasses)
+
+
+@app.tool()
+async def reset_app(session: Session = None) -> Dict[str, Any]:
     """Reset the app to its default state."""
-    result = await _api_request("DELETE", "/state")
+    result = await _api_request("DELETE", "/state", params=_session_params(session))
     return {"status": "success", **result}
 
 
+@app.tool()
+async def use_session(session: Session = None) -> Dict[str, Any]:
+    """Bind the state session that later tool calls act on, by the id shown in the app's sidebar.
+
+    Omit the id to go back to the shared session.
+    """
+    _session["id"] = session or None
+    return {"status": "success", "session": _session["id"]}
+
+
 @app.tool()
 async def check_health() -> Dict[str, Any]:
     """Check if the API server and Redis are healthy."""
@@ -106,7 +344,6 @@ def generate_claude_config() -> str:
 
 
 def main() -> None:
-    import sys
     if len(sys.argv) > 1 and sys.argv[1] == "--config":
         print("=== Portable Claude Desktop Config (fastmcp) ===")
         print(generate_claude_config())
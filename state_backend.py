@@ -0,0 +1,553 @@
+"""Where the app state lives, and the in-process read cache in front of Redis.
+
+State is kept per namespace: the shared one (None) or a named session. Each
+holds a JSON value per field and an integer ``version``, and every write
+publishes ``{"version": n}`` on the namespace's channel for /events streams.
+
+* ``RedisStateBackend``: Redis is the source of truth, shared by every API
+  process. Each process also keeps the states it has read and serves reads
+  from memory. Its own writes update the copy in place. The change message of
+  any process's write drops older copies everywhere else. Copies are only
+  kept while the subscription to those messages is up, so a message lost
+  to a dropped connection can never leave a stale copy behind.
+* ``MemoryStateBackend``: everything in this process, for a single-process
+  deployment or tests without Redis.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional, Tuple
+
+import redis
+
+from cache import LRUCache
+
+logger = logging.getLogger("uvicorn.error")
+
+STATE_KEY = "app:state"
+STATE_CHANNEL = "app_state_changes"
+# Where the shared state lived before it moved into the hash: a JSON blob of
+# every field, and a counter only read to seed the hash's version
+LEGACY_STATE_KEY = "app_state"
+LEGACY_VERSION_KEY = "app_state_version"
+DATASET_KEY = "dataset:version"
+DATASET_CHANNEL = "dataset_changes"
+# States kept by the read cache, across all sessions
+STATE_CACHE_ENTRIES = 10_000
+# A cached copy of a named session pushes back the session's expiry in Redis
+# at most this often (and at least four times per STATE_TTL_SECONDS)
+TOUCH_SECONDS = 60.0
+# A silent subscription is pinged after this long, and given up (dropping the
+# cache) if the ping isn't answered within as long again
+SUBSCRIPTION_PING_SECONDS = 15.0
+
+# State lives in one hash: a JSON-encoded value per field plus an integer
+# ``version``. The check, the writes, the version bump and the publish run as
+# one script, so concurrent partial updates never lose each other's fields
+# and every version is published exactly once.
+#
+# KEYS[1] state hash
+# ARGV[1] expected version, or "" to write unconditionally
+# ARGV[2] channel; ARGV[3] "1" to clear the fields first
+# ARGV[4] TTL in seconds, 0 for none; ARGV[5..] field/value pairs
+# Returns {1, new_version, receivers} or, on a version mismatch, {0, current_version}.
+UPDATE_STATE_LUA = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'version')) or 0
+if ARGV[1] ~= '' and tonumber(ARGV[1]) ~= current then
+    return {0, current}
+end
+if ARGV[3] == '1' then
+    redis.call('DEL', KEYS[1])
+end
+local version = current + 1
+redis.call('HSET', KEYS[1], 'version', version, unpack(ARGV, 5))
+if ARGV[4] ~= '0' then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+local receivers = redis.call('PUBLISH', ARGV[2], '{"version": ' .. version .. '}')
+return {1, version, receivers}
+"""
+
+# Moves the legacy blob's fields into the state hash, once: only if the blob
+# is still what was read, and only into a hash no write has filled since.
+# The blob is deleted either way.
+#
+# KEYS[1] legacy blob; KEYS[2] state hash
+# ARGV[1] the blob as read; ARGV[2] channel; ARGV[3..] field/value pairs
+# Returns {1, new_version, receivers}, {0} if the hash already had fields, or
+# {-1} if the blob changed since it was read.
+MIGRATE_STATE_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return {-1}
+end
+redis.call('DEL', KEYS[1])
+if redis.call('HLEN', KEYS[2]) - redis.call('HEXISTS', KEYS[2], 'version') > 0 then
+    return {0}
+end
+local version = (tonumber(redis.call('HGET', KEYS[2], 'version')) or 0) + 1
+redis.call('HSET', KEYS[2], 'version', version, unpack(ARGV, 3))
+local receivers = redis.call('PUBLISH', ARGV[2], '{"version": ' .. version .. '}')
+return {1, version, receivers}
+"""
+
+# HGETALL that also pushes back a session's expiry, in one round trip
+READ_STATE_LUA = """
+local state = redis.call('HGETALL', KEYS[1])
+if #state > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return state
+"""
+
+# Every API process watches the data files, so each new version of a layer is
+# published only by the first process to record it under DATASET_KEY.
+#
+# KEYS[1] DATASET_KEY:<layer>; ARGV[1] version; ARGV[2] channel; ARGV[3] message
+# Returns the receivers, or -1 if the version was already announced.
+ANNOUNCE_DATASET_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return -1
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return redis.call('PUBLISH', ARGV[2], ARGV[3])
+"""
+
+
+def state_namespace(session: Optional[str]) -> Tuple[str, str]:
+    """State hash key and change channel for a session (None: the shared one)"""
+    if session is None:
+        return STATE_KEY, STATE_CHANNEL
+    return f"{STATE_KEY}:{session}", f"{STATE_CHANNEL}:{session}"
+
+
+def channel_session(channel: str) -> Optional[str]:
+    """The session whose changes ``channel`` carries; inverse of ``state_namespace``"""
+    return None if channel == STATE_CHANNEL else channel[len(STATE_CHANNEL) + 1:]
+
+
+def announcement(summary: dict) -> dict:
+    """ANNOUNCE_DATASET_LUA keys and args for a dataset change"""
+    return {
+        "keys": [f"{DATASET_KEY}:{summary['layer']}"],
+        "args": [summary["dataset_version"], DATASET_CHANNEL, json.dumps(summary)],
+    }
+
+
+class StateBackend(ABC):
+    """Versioned state store with change notifications
+
+    ``defaults`` are the fields and values of an empty state. Named sessions
+    expire after ``ttl`` seconds without a read, a write or a ``touch``.
+    """
+
+    def __init__(self, defaults: dict, ttl: int):
+        self.defaults = defaults
+        self.ttl = ttl
+
+    async def prepare(self):
+        """Get ready to serve; called once the event loop runs"""
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def read(self, session: Optional[str] = None) -> dict:
+        """Current state with defaults filled in, including its ``version``"""
+
+    @abstractmethod
+    async def update(
+        self,
+        fields: dict,
+        reset: bool = False,
+        expected_version: Optional[int] = None,
+        session: Optional[str] = None,
+    ) -> Tuple[bool, int, int]:
+        """Apply field updates and publish the new version, atomically
+
+        ``reset`` drops every field first. Returns (applied, version,
+        receivers of the change message); not applied, with the current
+        version, if ``expected_version`` is given and not current.
+        """
+
+    async def touch(self, session: Optional[str]):
+        """Push back a named session's expiry"""
+
+    @abstractmethod
+    def subscribe(self, session: Optional[str]) -> "Subscription":
+        """Change messages of a session's state, and dataset announcements"""
+
+    @abstractmethod
+    async def announce_dataset(self, summary: dict) -> int:
+        """Publish a layer's dataset change once per version; -1 if already announced"""
+
+    async def ping(self):
+        pass
+
+    def decode(self, stored: dict) -> dict:
+        state = dict(self.defaults)
+        for name in self.defaults:
+            if name in stored:
+                state[name] = json.loads(stored[name])
+        state["version"] = int(stored.get("version", 0))
+        return state
+
+
+class Subscription(ABC):
+    """Messages as ``{"channel": ..., "data": ...}``, like redis-py's"""
+
+    async def open(self):
+        pass
+
+    @abstractmethod
+    async def get_message(self, timeout: float) -> Optional[dict]:
+        """Next message, or None if none came within ``timeout`` seconds"""
+
+    async def aclose(self):
+        pass
+
+
+class RedisSubscription(Subscription):
+    def __init__(self, client, channels):
+        self.pubsub = client.pubsub()
+        self.channels = channels
+
+    async def open(self):
+        await self.pubsub.subscribe(*self.channels)
+
+    async def get_message(self, timeout: float) -> Optional[dict]:
+        return await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+
+    async def aclose(self):
+        await self.pubsub.aclose()
+
+
+class RedisStateBackend(StateBackend):
+    """State in Redis, with reads served from memory while nothing changed
+
+    ``pubsub_client`` carries the long-lived subscriptions: /events streams
+    and, with ``cache``, this process's invalidation listener. ``on_read`` is
+    called with "hit" or "miss" for every read.
+    """
+
+    def __init__(
+        self,
+        client,
+        pubsub_client,
+        defaults: dict,
+        ttl: int,
+        cache: bool = True,
+        on_read: Optional[Callable[[str], None]] = None,
+    ):
+        super().__init__(defaults, ttl)
+        self.client = client
+        self.pubsub_client = pubsub_client
+        self.update_script = client.register_script(UPDATE_STATE_LUA)
+        self.read_script = client.register_script(READ_STATE_LUA)
+        self.announce_script = client.register_script(ANNOUNCE_DATASET_LUA)
+        self.cache_enabled = cache
+        self.on_read = on_read
+        # namespace -> (state, when its expiry was last pushed back)
+        self.cache = LRUCache(max_entries=STATE_CACHE_ENTRIES)
+        # Bumped whenever the subscription comes up or goes down; copies are
+        # only kept while it is up and hasn't changed since they were read
+        self._epoch = 0
+        self._listening = False
+        self._listener: Optional[asyncio.Task] = None
+        # Newest version announced for each namespace with reads in flight, so
+        # a read that raced a write isn't cached after the write's message
+        self._reads: Dict[Optional[str], int] = {}
+        self._newest: Dict[Optional[str], int] = {}
+
+    async def prepare(self):
+        """Start the invalidation listener, load the scripts and migrate legacy state
+
+        Listeners only act on versions newer than the last one they saw, so the
+        hash must not restart below the standalone counter it replaces. The old
+        blob's fields are then moved in as one more version.
+        """
+        if self.cache_enabled and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+        await self.client.script_load(UPDATE_STATE_LUA)
+        await self.client.script_load(READ_STATE_LUA)
+        legacy = await self.client.get(LEGACY_VERSION_KEY)
+        if legacy is not None:
+            await self.client.hsetnx(STATE_KEY, "version", int(legacy))
+        await self._migrate_blob()
+
+    async def _migrate_blob(self):
+        migrate = self.client.register_script(MIGRATE_STATE_LUA)
+        while True:
+            blob = await self.client.get(LEGACY_STATE_KEY)
+            if blob is None:
+                return
+            try:
+                stored = json.loads(blob)
+            except ValueError:
+                stored = None
+            if not isinstance(stored, dict):
+                logger.warning("Dropping unreadable legacy state under %s", LEGACY_STATE_KEY)
+                stored = {}
+            args = [blob, STATE_CHANNEL]
+            for name in self.defaults:
+                if name in stored:
+                    args += [name, json.dumps(stored[name])]
+            migrated, *rest = await migrate(keys=[LEGACY_STATE_KEY, STATE_KEY], args=args)
+            if migrated >= 0:
+                if migrated:
+                    logger.info("Migrated legacy state to %s at version %s", STATE_KEY, rest[0])
+                return
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    async def read(self, session: Optional[str] = None) -> dict:
+        entry = self.cache.get(session) if self._listening else None
+        if entry is not None:
+            state, touched = entry
+            if session is None or time.monotonic() - touched < min(TOUCH_SECONDS, self.ttl / 4):
+                self._count("hit")
+                return dict(state)
+            # A named session's copy is good while its hash lives; reading it
+            # must keep it alive, as a read from Redis would
+            if await self.client.expire(state_namespace(session)[0], self.ttl):
+                if self.cache.get(session) is entry:
+                    self.cache.put(session, (state, time.monotonic()))
+                self._count("hit")
+                return dict(state)
+        self._count("miss")
+
+        epoch = self._epoch
+        self._reads[session] = self._reads.get(session, 0) + 1
+        try:
+            key = state_namespace(session)[0]
+            if session is None:
+                stored = await self.client.hgetall(key)
+            else:
+                flat = await self.read_script(keys=[key], args=[self.ttl])
+                stored = dict(zip(flat[::2], flat[1::2]))
+            state = self.decode(stored)
+            if state["version"] >= self._newest.get(session, 0):
+                self._keep(session, state, epoch)
+        finally:
+            self._reads[session] -= 1
+            if not self._reads[session]:
+                del self._reads[session]
+                self._newest.pop(session, None)
+        return dict(state)
+
+    async def update(
+        self,
+        fields: dict,
+        reset: bool = False,
+        expected_version: Optional[int] = None,
+        session: Optional[str] = None,
+    ) -> Tuple[bool, int, int]:
+        key, channel = state_namespace(session)
+        ttl = 0 if session is None else self.ttl
+        args = ["" if expected_version is None else expected_version, channel, int(reset), ttl]
+        for name, value in fields.items():
+            args += [name, json.dumps(value)]
+        epoch = self._epoch
+        applied, version, *receivers = await self.update_script(keys=[key], args=args)
+        if not applied:
+            return False, version, 0
+        # Write through: the copy of the version this write applied to
+        # becomes the new state; any other copy is dropped
+        entry = self.cache.get(session)
+        self._changed(session, version)
+        if entry is not None and entry[0]["version"] == version - 1:
+            state = dict(self.defaults) if reset else dict(entry[0])
+            state.update((name, json.loads(json.dumps(value))) for name, value in fields.items())
+            state["version"] = version
+            self._keep(session, state, epoch)
+        return True, version, receivers[0]
+
+    async def touch(self, session: Optional[str]):
+        if session is not None:
+            await self.pubsub_client.expire(state_namespace(session)[0], self.ttl)
+
+    def subscribe(self, session: Optional[str]) -> Subscription:
+        return RedisSubscription(self.pubsub_client, [state_namespace(session)[1], DATASET_CHANNEL])
+
+    async def announce_dataset(self, summary: dict) -> int:
+        return await self.announce_script(**announcement(summary))
+
+    async def ping(self):
+        await self.client.ping()
+
+    def _count(self, result: str):
+        if self.on_read is not None:
+            self.on_read(result)
+
+    def _keep(self, session: Optional[str], state: dict, epoch: int):
+        """Cache ``state`` if the subscription has been up since ``epoch`` and it's no older"""
+        if not self._listening or epoch != self._epoch:
+            return
+        entry = self.cache.get(session)
+        if entry is None or entry[0]["version"] <= state["version"]:
+            self.cache.put(session, (state, time.monotonic()))
+
+    def _changed(self, session: Optional[str], version: int):
+        """Drop copies older than ``version`` of a namespace"""
+        if session in self._reads:
+            self._newest[session] = max(self._newest.get(session, 0), version)
+        entry = self.cache.get(session)
+        if entry is not None and entry[0]["version"] < version:
+            self.cache.discard(session)
+
+    async def _listen(self):
+        """Follow every namespace's change channel, reconnecting until cancelled"""
+        backoff = 0.5
+        while True:
+            pubsub = self.pubsub_client.pubsub()
+            try:
+                await pubsub.subscribe(STATE_CHANNEL)
+                await pubsub.psubscribe(f"{STATE_CHANNEL}:*")
+                # Only once both are in place will every later write reach us
+                confirmed = 0
+                while confirmed < 2:
+                    message = await pubsub.get_message(timeout=SUBSCRIPTION_PING_SECONDS)
+                    if message is None:
+                        raise redis.TimeoutError("No subscription confirmation")
+                    confirmed += message["type"] in ("subscribe", "psubscribe")
+                self._epoch += 1
+                self._listening = True
+                backoff = 0.5
+                pinged = False
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=SUBSCRIPTION_PING_SECONDS
+                    )
+                    if message is None:
+                        if pinged:
+                            raise redis.TimeoutError("Subscription went silent")
+                        await pubsub.ping()
+                        pinged = True
+                        continue
+                    pinged = False
+                    if message["type"] in ("message", "pmessage"):
+                        self._on_message(message)
+            except (redis.RedisError, OSError):
+                pass
+            finally:
+                self._listening = False
+                self._epoch += 1
+                self.cache.clear()
+                await pubsub.aclose()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 10)
+
+    def _on_message(self, message: dict):
+        session = channel_session(message["channel"])
+        try:
+            version = int(json.loads(message["data"])["version"])
+        except (TypeError, ValueError, KeyError):
+            self.cache.discard(session)  # publisher without a version
+            return
+        self._changed(session, version)
+
+
+class MemorySubscription(Subscription):
+    def __init__(self, backend: "MemoryStateBackend", channels):
+        self.backend = backend
+        self.channels = channels
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def open(self):
+        for channel in self.channels:
+            self.backend.subscribers.setdefault(channel, set()).add(self.queue)
+
+    async def get_message(self, timeout: float) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        for channel in self.channels:
+            queues = self.backend.subscribers.get(channel, set())
+            queues.discard(self.queue)
+            if not queues:
+                self.backend.subscribers.pop(channel, None)
+
+
+class MemoryStateBackend(StateBackend):
+    """State and notifications within this process; nothing survives a restart
+
+    Only for a single API process: every process would have its own state.
+    """
+
+    def __init__(self, defaults: dict, ttl: int):
+        super().__init__(defaults, ttl)
+        # namespace -> (stored fields as in the Redis hash, expiry or None)
+        self.states: Dict[Optional[str], Tuple[dict, Optional[float]]] = {}
+        self.subscribers: Dict[str, set] = {}
+        self.datasets: Dict[str, str] = {}
+
+    async def read(self, session: Optional[str] = None) -> dict:
+        stored = self._stored(session)
+        if stored:
+            self.states[session] = (stored, self._expiry(session))
+        return self.decode(stored)
+
+    async def update(
+        self,
+        fields: dict,
+        reset: bool = False,
+        expected_version: Optional[int] = None,
+        session: Optional[str] = None,
+    ) -> Tuple[bool, int, int]:
+        stored = self._stored(session)
+        current = int(stored.get("version", 0))
+        if expected_version is not None and expected_version != current:
+            return False, current, 0
+        version = current + 1
+        stored = {} if reset else dict(stored)
+        stored["version"] = str(version)
+        stored.update((name, json.dumps(value)) for name, value in fields.items())
+        if session not in self.states:
+            self._sweep()
+        self.states[session] = (stored, self._expiry(session))
+        return True, version, self._publish(state_namespace(session)[1], json.dumps({"version": version}))
+
+    async def touch(self, session: Optional[str]):
+        stored = self._stored(session)
+        if stored:
+            self.states[session] = (stored, self._expiry(session))
+
+    def subscribe(self, session: Optional[str]) -> Subscription:
+        return MemorySubscription(self, [state_namespace(session)[1], DATASET_CHANNEL])
+
+    async def announce_dataset(self, summary: dict) -> int:
+        if self.datasets.get(summary["layer"]) == summary["dataset_version"]:
+            return -1
+        self.datasets[summary["layer"]] = summary["dataset_version"]
+        return self._publish(DATASET_CHANNEL, json.dumps(summary))
+
+    def _stored(self, session: Optional[str]) -> dict:
+        stored, expiry = self.states.get(session, ({}, None))
+        if expiry is not None and expiry <= time.monotonic():
+            del self.states[session]
+            return {}
+        return stored
+
+    def _expiry(self, session: Optional[str]) -> Optional[float]:
+        return None if session is None else time.monotonic() + self.ttl
+
+    def _sweep(self):
+        """Forget expired sessions, so abandoned ones don't pile up"""
+        now = time.monotonic()
+        for session in [s for s, (_, expiry) in self.states.items() if expiry is not None and expiry <= now]:
+            del self.states[session]
+
+    def _publish(self, channel: str, data: str) -> int:
+        queues = self.subscribers.get(channel, ())
+        for queue in queues:
+            queue.put_nowait({"channel": channel, "data": data})
+        return len(queues)
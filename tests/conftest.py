@@ -0,0 +1,45 @@
+import json
+
+import fakeredis
+import pytest
+from fakeredis import aioredis as fake_aioredis
+from fastapi.testclient import TestClient
+
+import api_server
+from dataset import parse_geojson
+from state_backend import RedisStateBackend
+
+DEFAULTS = {"layer": None, "selected_fclasses": [], "map_center": None, "zoom_level": 12}
+
+
+def point(osm_id, fclass, lon, lat, name=None):
+    """A GeoJSON point feature"""
+    return {
+        "type": "Feature",
+        "properties": {"osm_id": osm_id, "fclass": fclass, "name": name or f"{fclass} {osm_id}"},
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+    }
+
+
+def geojson(features) -> bytes:
+    return json.dumps({"type": "FeatureCollection", "features": features}).encode()
+
+
+def make_dataset(features, version="v1"):
+    """A Dataset parsed from ``features``, with nothing cached on disk"""
+    return parse_geojson(geojson(features), version)
+
+
+def make_backend(server, cache=True):
+    """A RedisStateBackend on ``server``, a fakeredis.FakeServer"""
+    client = fake_aioredis.FakeRedis(server=server, decode_responses=True)
+    pubsub_client = fake_aioredis.FakeRedis(server=server, decode_responses=True)
+    return RedisStateBackend(client, pubsub_client, DEFAULTS, 3600, cache=cache)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """The API app on a fresh fakeredis-backed state backend"""
+    monkeypatch.setattr(api_server, "state_backend", make_backend(fakeredis.FakeServer()))
+    with TestClient(api_server.app) as client:
+        yield client
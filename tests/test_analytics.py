@@ -0,0 +1,72 @@
+"""SVY21 analytics: nearest pairs, grid density and distances"""
+
+import analytics
+from cache import LRUCache
+from conftest import make_dataset, point
+from dataset import svy21_transformer
+
+
+def svy21_point(osm_id, fclass, x, y):
+    lon, lat = svy21_transformer(inverse=True).transform(x, y)
+    return point(osm_id, fclass, lon, lat)
+
+
+def test_nearest_pairs_never_pairs_a_facility_with_itself():
+    dataset = make_dataset([
+        svy21_point("1", "hospital", 30000, 30000),
+        svy21_point("2", "hospital", 30300, 30400),
+        svy21_point("3", "clinic", 30010, 30000),
+    ])
+    result = analytics.nearest_pairs(dataset, ["hospital"], ["hospital"], LRUCache())
+    pairs = {pair["from"]["osm_id"]: pair["to"]["osm_id"] for pair in result["pairs"]}
+    assert pairs == {"1": "2", "2": "1"}
+    assert result["distance_m"]["min"] == 500.0
+
+    # across every class, 1 and 3 are each other's nearest
+    result = analytics.nearest_pairs(dataset, None, None, LRUCache())
+    assert result["count"] == 3
+    assert [(p["from"]["osm_id"], p["to"]["osm_id"], p["distance_m"]) for p in result["pairs"][:2]] == [
+        ("1", "3", 10.0),
+        ("3", "1", 10.0),
+    ]
+
+
+def test_grid_density_bins_centroids_into_aligned_cells():
+    dataset = make_dataset([
+        svy21_point("1", "clinic", 30100, 40100),
+        svy21_point("2", "clinic", 30900, 40900),
+        svy21_point("3", "clinic", 30500, 40999),
+        svy21_point("4", "clinic", 31001, 40500),
+        svy21_point("5", "hospital", 30500, 40500),
+        {"type": "Feature", "properties": {"osm_id": "6", "fclass": "clinic"}, "geometry": None},
+    ])
+    result = analytics.grid_density(dataset, 1000, ["clinic"])
+    assert result["facilities"] == 4  # the one without geometry isn't binned
+    assert result["occupied_cells"] == 2
+    assert [cell["count"] for cell in result["cells"]] == [3, 1]
+    lon, lat = svy21_transformer(inverse=True).transform(30500, 40500)
+    assert result["cells"][0]["center"] == [round(lat, 6), round(lon, 6)]
+    assert result["cells"][0]["per_km2"] == 3.0
+
+    result = analytics.grid_density(dataset, 500, top=1)
+    assert result["occupied_cells"] == 3
+    assert [cell["count"] for cell in result["cells"]] == [3]
+
+
+def test_radius_and_nearest_queries_measure_the_same_metres():
+    dataset = make_dataset([
+        svy21_point("1", "clinic", 30300, 40000),
+        svy21_point("2", "hospital", 30000, 40500),
+        svy21_point("3", "clinic", 32000, 40000),
+    ])
+    lon, lat = svy21_transformer(inverse=True).transform(30000, 40000)
+
+    rows, dist = dataset.query_radius(lon, lat, 600)
+    assert [dataset.osm_ids[r] for r in rows] == ["1", "2"]
+    assert [round(float(d), 1) for d in dist] == [300.0, 500.0]
+    result = analytics.within(dataset, lon, lat, 600)
+    assert [f["distance_m"] for f in result["features"]] == [300.0, 500.0]
+
+    rows, dist = dataset.nearest(lon, lat, 2, ["clinic"])
+    assert [dataset.osm_ids[r] for r in rows] == ["1", "3"]
+    assert [round(float(d), 1) for d in dist] == [300.0, 2000.0]
@@ -0,0 +1,47 @@
+"""Ordering of coalesced and exclusive writes"""
+
+import asyncio
+
+from coalesce import Coalescer
+
+
+def test_exclusive_write_waits_for_the_first_update_in_flight():
+    async def run():
+        writes = []
+
+        async def apply(key, fields):
+            await asyncio.sleep(0.02)
+            writes.append(fields)
+            return len(writes)
+
+        coalescer = Coalescer(0.05, apply)
+        pan = asyncio.create_task(coalescer.submit("s", {"zoom_level": 13}))
+        await asyncio.sleep(0)  # the pan's write is now in flight
+        async with coalescer.exclusive("s"):
+            writes.append({"reset": True})
+        assert await pan == 1
+        assert writes == [{"zoom_level": 13}, {"reset": True}]
+        await coalescer.close()
+
+    asyncio.run(run())
+
+
+def test_updates_within_the_window_are_merged():
+    async def run():
+        writes = []
+
+        async def apply(key, fields):
+            writes.append(fields)
+            return len(writes)
+
+        coalescer = Coalescer(0.05, apply)
+        assert await coalescer.submit("s", {"zoom_level": 13}) == 1
+        results = await asyncio.gather(
+            coalescer.submit("s", {"zoom_level": 14, "map_center": [1.3, 103.8]}),
+            coalescer.submit("s", {"zoom_level": 15}),
+        )
+        assert results == [2, 2]
+        assert writes[1] == {"zoom_level": 15, "map_center": [1.3, 103.8]}
+        await coalescer.close()
+
+    asyncio.run(run())
@@ -0,0 +1,106 @@
+"""Dataset reloads: row diffs between versions and cached files of replaced ones"""
+
+import gc
+import json
+import os
+
+from conftest import geojson, point
+from dataset import DatasetEngine
+
+
+FEATURES = [
+    point("1", "clinic", 103.80, 1.30),
+    point("2", "hospital", 103.85, 1.35),
+    point("3", "clinic", 103.90, 1.40),
+]
+
+
+def engine_on(path, features):
+    """An engine on ``features`` written to ``path``, and the (previous, dataset, diff) of each change"""
+    path.write_bytes(geojson(features))
+    changes = []
+    engine = DatasetEngine(path, on_change=lambda *change: changes.append(change))
+    engine.get()
+    return engine, changes
+
+
+def test_edited_added_and_removed_features_are_diffed_by_row(tmp_path):
+    path = tmp_path / "layer.geojson"
+    engine, changes = engine_on(path, FEATURES)
+    edited = point("1", "clinic", 103.81, 1.31)
+    path.write_bytes(geojson([FEATURES[1], edited, point("4", "pharmacy", 103.95, 1.45)]))
+    engine.reload()
+
+    (previous, dataset, diff), = changes
+    assert (diff.previous_version, diff.version) == (previous.version, dataset.version)
+    assert (diff.added, diff.changed, diff.removed) == (1, 1, 1)
+    # the unchanged hospital moved from row 1 to row 0
+    assert diff.kept.tolist() == [0] and diff.kept_from.tolist() == [1]
+    assert diff.fresh.tolist() == [1, 2]
+    assert diff.fclasses == ["clinic", "pharmacy"]
+    assert diff.touches((103.79, 1.29, 103.82, 1.32))  # the clinic's old and new place
+    assert diff.touches((103.89, 1.39, 103.91, 1.41))  # where the removed clinic was
+    assert not diff.touches((103.84, 1.34, 103.86, 1.36))  # only the unchanged hospital
+    assert not diff.touches((103.79, 1.29, 103.82, 1.32), ["hospital"])
+    # merged per-row arrays line up with the new rows
+    merged = diff.merge(previous.osm_ids, dataset.osm_ids[diff.fresh])
+    assert merged.tolist() == ["2", "1", "4"]
+
+
+def test_reformatting_changes_the_version_but_no_rows(tmp_path):
+    path = tmp_path / "layer.geojson"
+    engine, changes = engine_on(path, FEATURES)
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": FEATURES}, indent=2))
+    engine.reload()
+
+    (previous, dataset, diff), = changes
+    assert dataset.version != previous.version
+    assert (diff.added, diff.changed, diff.removed) == (0, 0, 0)
+    assert diff.fresh.tolist() == [] and diff.kept.tolist() == [0, 1, 2]
+    assert not diff.touches(dataset.extent)
+
+
+def test_an_unchanged_file_keeps_its_version(tmp_path):
+    path = tmp_path / "layer.geojson"
+    engine, changes = engine_on(path, FEATURES)
+    dataset = engine.get()
+    # same content, new mtime: hashed again, not reloaded
+    path.write_bytes(geojson(FEATURES))
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    engine.reload()
+    assert engine.get() is dataset
+    assert changes == []
+
+
+def cached_versions(path):
+    return sorted({p.name.split(".")[0].rsplit("-", 1)[1] for p in (path.parent / ".cache").glob(f"{path.stem}-*")})
+
+
+def test_files_of_a_replaced_version_go_once_it_is_released(tmp_path):
+    path = tmp_path / "layer.geojson"
+    path.write_bytes(geojson([point("1", "clinic", 103.8, 1.3)]))
+    engine = DatasetEngine(path)
+    first = engine.get()
+    first.lod.band(12)
+    first.projected
+    assert cached_versions(path) == [first.version]
+
+    path.write_bytes(geojson([point("1", "clinic", 103.8, 1.3), point("2", "hospital", 103.9, 1.4)]))
+    engine.reload()
+    second = engine.get()
+    # a request may still be using the first version's memory maps
+    assert cached_versions(path) == sorted([first.version, second.version])
+    del first
+    gc.collect()
+    assert cached_versions(path) == [second.version]
+
+    path.write_bytes(geojson([point("2", "hospital", 103.9, 1.4)]))
+    engine.reload()
+    third = engine.get()
+    del second
+    assert cached_versions(path) == [third.version]
+    # the new version inherited the LOD band and the projection the old one had built
+    assert sorted(p.name.split(".", 1)[1] for p in (path.parent / ".cache").glob(f"{path.stem}-*")) == [
+        "columns", "lod-z12", "svy21",
+    ]
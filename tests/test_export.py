@@ -0,0 +1,99 @@
+"""Feature export: cursor paging and content coding"""
+
+import gzip
+import json
+
+import pytest
+import zstandard
+
+import export
+from conftest import geojson, point
+from dataset import DatasetEngine
+
+
+def test_pages_follow_the_cursor_until_the_dataset_changes(client):
+    everything = client.get("/features/export", params={"geometry": False})
+    ids = [json.loads(line)["properties"]["osm_id"] for line in everything.text.splitlines()]
+
+    paged, params = [], {"geometry": False, "limit": 40}
+    while True:
+        response = client.get("/features/export", params=params)
+        assert response.headers["X-Total-Count"] == str(len(ids))
+        paged += [json.loads(line)["properties"]["osm_id"] for line in response.text.splitlines()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        assert f"cursor={cursor}" in response.headers["Link"]
+        params["cursor"] = cursor
+    assert paged == ids
+
+    # the same position from before a reload: rows may have moved since
+    version, row = export.decode_cursor(params["cursor"])
+    stale = export.encode_cursor("0" * 16, row)
+    assert client.get("/features/export", params={**params, "cursor": stale}).status_code == 410
+
+
+def test_a_cursor_is_refused_after_a_reload(tmp_path):
+    path = tmp_path / "layer.geojson"
+    features = [point(str(i), "clinic", 103.8 + i / 100, 1.3) for i in range(10)]
+    path.write_bytes(geojson(features))
+    engine = DatasetEngine(path)
+    dataset = engine.get()
+    rows, cursor = export.page(dataset.rows_for(), dataset.version, None, 4)
+    assert rows.tolist() == [0, 1, 2, 3]
+
+    path.write_bytes(geojson(features[1:]))  # every row shifts by one
+    engine.reload()
+    dataset = engine.get()
+    with pytest.raises(LookupError):
+        export.page(dataset.rows_for(), dataset.version, cursor, 4)
+
+
+def test_the_cursor_is_carried_in_a_feature_collection(client):
+    page = client.get("/features/export", params={"format": "geojson", "limit": 5, "geometry": False}).json()
+    assert len(page["features"]) == 5
+    rest = client.get("/features/export", params={"format": "geojson", "cursor": page["next_cursor"]}).json()
+    assert rest["next_cursor"] is None
+    assert len(page["features"]) + len(rest["features"]) == page["total"]
+
+
+# not base64, not UTF-8, no row ("nocolon"), a row that isn't a number ("v:abc")
+@pytest.mark.parametrize("cursor", ["!!!", "__8", "bm9jb2xvbg", "djphYmM"])
+def test_malformed_cursors_are_refused(client, cursor):
+    response = client.get("/features/export", params={"cursor": cursor, "limit": 5})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "accept, coding",
+    [
+        ("gzip", "gzip"),
+        ("gzip, zstd", "zstd"),
+        ("gzip;q=0.8, zstd;q=0.5", "gzip"),
+        ("*", "zstd"),
+        ("zstd;q=0, *;q=0.1", "gzip"),
+        ("identity", None),
+        ("gzip;q=0, zstd;q=0", None),
+        (None, None),
+    ],
+)
+def test_content_coding_follows_accept_encoding(accept, coding):
+    assert export.negotiate_encoding(accept) == coding
+
+
+def test_compressed_streams_decode_to_the_plain_body():
+    chunks = [b'{"a":1}\n', b"", b'{"b":2}\n' * 1000]
+    body = b"".join(chunks)
+    assert gzip.decompress(b"".join(export.compress(iter(chunks), "gzip"))) == body
+    reader = zstandard.ZstdDecompressor().stream_reader(b"".join(export.compress(iter(chunks), "zstd")))
+    assert reader.read() == body
+
+
+def test_export_is_sent_in_the_negotiated_coding(client):
+    plain = client.get("/features/export", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    for coding in ("gzip", "zstd"):
+        response = client.get("/features/export", headers={"Accept-Encoding": coding})
+        assert response.headers["Content-Encoding"] == coding
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert response.content == plain.content  # decoded by the client
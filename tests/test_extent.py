@@ -0,0 +1,32 @@
+"""Selection extents from the per-fclass aggregates"""
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from pyproj import Transformer
+
+import api_server
+
+
+@pytest.mark.parametrize("fclasses", [["hospital"], ["clinic", "hospital"], None])
+def test_extent_matches_the_geodataframe(client, fclasses):
+    dataset = api_server.layer_registry.get()
+    gdf = gpd.GeoDataFrame(
+        {"fclass": dataset.fclass_values}, geometry=dataset.geometries, crs="EPSG:4326"
+    )
+    if fclasses is not None:
+        gdf = gdf[gdf["fclass"].isin(fclasses)]
+    gdf = gdf[~gdf.geometry.is_empty & gdf.geometry.notna()]
+    centroids = gdf.to_crs("EPSG:3414").centroid
+    lon, lat = Transformer.from_crs("EPSG:3414", "EPSG:4326", always_xy=True).transform(
+        centroids.x.mean(), centroids.y.mean()
+    )
+
+    extent = client.get("/extent", params={"fclasses": fclasses} if fclasses else None).json()
+    assert extent["count"] == len(gdf)
+    np.testing.assert_allclose(extent["bounds"], gdf.total_bounds)
+    np.testing.assert_allclose(extent["center"], [lat, lon])
+
+
+def test_an_empty_selection_has_no_extent(client):
+    assert client.get("/extent", params={"fclasses": ["no-such-class"]}).status_code == 404
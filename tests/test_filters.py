@@ -0,0 +1,33 @@
+"""fclasses are checked against the layer they are written for"""
+
+
+def test_filters_are_checked_against_the_shown_layer(client):
+    assert client.post("/filters", json=["clinic"]).status_code == 200
+
+    response = client.post("/filters", json=["clinic"], params={"layer": "hospitals_sg"})
+    assert response.status_code == 422
+    assert response.json()["detail"]["invalid"] == ["clinic"]
+    assert response.json()["detail"]["allowed"] == ["hospital"]
+
+    # Without a layer the values belong to the one the session shows
+    assert client.post("/filters", json=["hospital"], params={"layer": "hospitals_sg"}).status_code == 200
+    response = client.post("/filters", json=["pharmacy"])
+    assert response.status_code == 422
+    assert client.get("/state").json() == {
+        "layer": "hospitals_sg", "selected_fclasses": ["hospital"], "map_center": None, "zoom_level": 12, "version": 2,
+    }
+    # Other sessions still show the default layer
+    assert client.post("/filters", json=["pharmacy"], params={"session": "other"}).status_code == 200
+
+
+def test_batch_checks_each_operation_against_the_layer_shown_at_that_point(client):
+    operations = [
+        {"op": "filters", "fclasses": ["hospital"], "layer": "hospitals_sg"},
+        {"op": "filters", "fclasses": ["clinic"]},
+    ]
+    response = client.post("/state/batch", json={"operations": operations})
+    assert response.status_code == 422
+    assert response.json()["detail"]["invalid"] == ["clinic"]
+
+    operations = [*operations[:1], {"op": "reset"}, {"op": "filters", "fclasses": ["clinic"]}]
+    assert client.post("/state/batch", json={"operations": operations}).status_code == 200
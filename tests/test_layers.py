@@ -0,0 +1,70 @@
+"""Layer registry memory budget"""
+
+import pytest
+
+from conftest import geojson, point
+from layers import LayerRegistry, LayerSpec
+
+
+@pytest.fixture
+def specs(tmp_path):
+    """Three layers of the same size"""
+    specs = {}
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.geojson"
+        path.write_bytes(geojson([point(str(i), "clinic", 103.8 + i / 1000, 1.3) for i in range(50)]))
+        specs[name] = LayerSpec(name, path, name)
+    return specs
+
+
+def layer_bytes(specs):
+    registry = LayerRegistry(specs)
+    registry.get("a")
+    return registry.layer("a").measure()
+
+
+def test_the_least_recently_used_layer_is_evicted(specs):
+    evicted = []
+    registry = LayerRegistry(
+        specs, max_bytes=int(layer_bytes(specs) * 2.5), on_evict=lambda layer: evicted.append(layer.name)
+    )
+    registry.get("a")
+    registry.get("b")
+    assert evicted == []
+    registry.get("c")
+    assert evicted == ["a"]
+    assert [layer.name for layer in registry.loaded()] == ["b", "c"]
+
+    registry.get("b")  # now c is the least recently used
+    registry.get("a")
+    assert evicted == ["a", "c"]
+    assert [layer.name for layer in registry.loaded()] == ["b", "a"]
+    assert registry.version("c") is None
+
+
+def test_the_requested_layer_is_never_evicted(specs):
+    evicted = []
+    registry = LayerRegistry(specs, max_bytes=1, on_evict=lambda layer: evicted.append(layer.name))
+    dataset = registry.get("a")
+    assert len(dataset) == 50
+    assert evicted == []
+    assert [layer.name for layer in registry.loaded()] == ["a"]
+
+    registry.get("b")
+    assert evicted == ["a"]
+    assert [layer.name for layer in registry.loaded()] == ["b"]
+
+
+def test_cached_renders_count_towards_the_budget(specs):
+    size = layer_bytes(specs)
+    evicted = []
+    registry = LayerRegistry(
+        specs,
+        max_bytes=int(size * 2.5),
+        caches={"tiles": {"max_bytes": 10 * size, "sizeof": len}},
+        on_evict=lambda layer: evicted.append(layer.name),
+    )
+    registry.get("a")
+    registry.layer("a").caches["tiles"].put((0, 0, 0, None), b"x" * size)
+    registry.get("b")
+    assert evicted == ["a"]
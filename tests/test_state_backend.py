@@ -0,0 +1,146 @@
+"""Versioned state writes through the Lua scripts, against fakeredis"""
+
+import asyncio
+import json
+
+import fakeredis
+import pytest
+
+from conftest import DEFAULTS, make_backend
+from state_backend import LEGACY_STATE_KEY, LEGACY_VERSION_KEY, STATE_KEY, StateBackend, Subscription
+
+
+def test_update_bumps_version_and_checks_expected_version():
+    async def run():
+        backend = make_backend(fakeredis.FakeServer(), cache=False)
+        await backend.prepare()
+        try:
+            assert (await backend.read())["version"] == 0
+            applied, version, _ = await backend.update({"zoom_level": 14})
+            assert (applied, version) == (True, 1)
+            applied, version, _ = await backend.update({"selected_fclasses": ["clinic"]}, expected_version=1)
+            assert (applied, version) == (True, 2)
+
+            # A stale expected version is refused and reports the current one
+            applied, version, _ = await backend.update({"zoom_level": 3}, expected_version=1)
+            assert (applied, version) == (False, 2)
+            state = await backend.read()
+            assert state["zoom_level"] == 14
+            assert state["selected_fclasses"] == ["clinic"]
+
+            applied, version, _ = await backend.update({"zoom_level": 10}, reset=True)
+            assert (applied, version) == (True, 3)
+            assert await backend.read() == {**DEFAULTS, "zoom_level": 10, "version": 3}
+        finally:
+            await backend.close()
+
+    asyncio.run(run())
+
+
+def test_sessions_are_versioned_separately_and_expire():
+    async def run():
+        backend = make_backend(fakeredis.FakeServer(), cache=False)
+        await backend.prepare()
+        try:
+            await backend.update({"zoom_level": 14})
+            applied, version, _ = await backend.update({"zoom_level": 5}, session="alice")
+            assert (applied, version) == (True, 1)
+            assert (await backend.read("alice"))["zoom_level"] == 5
+            assert (await backend.read())["zoom_level"] == 14
+            assert 0 < await backend.client.ttl(f"{STATE_KEY}:alice") <= 3600
+            assert await backend.client.ttl(STATE_KEY) == -1
+        finally:
+            await backend.close()
+
+    asyncio.run(run())
+
+
+def test_cached_reads_follow_writes_from_another_process():
+    async def run():
+        server = fakeredis.FakeServer()
+        reader, writer = make_backend(server), make_backend(server, cache=False)
+        await reader.prepare()
+        await writer.prepare()
+        try:
+            while not reader._listening:
+                await asyncio.sleep(0.01)
+            assert (await reader.read())["version"] == 0
+            await writer.update({"zoom_level": 9})
+            for _ in range(100):
+                if (await reader.read())["version"] == 1:
+                    break
+                await asyncio.sleep(0.01)
+            assert (await reader.read())["zoom_level"] == 9
+        finally:
+            await reader.close()
+            await writer.close()
+
+    asyncio.run(run())
+
+
+def test_legacy_state_blob_is_migrated_once():
+    async def run():
+        server = fakeredis.FakeServer()
+        backend = make_backend(server, cache=False)
+        legacy = {"selected_fclasses": ["clinic"], "map_center": [1.35, 103.82], "zoom_level": 15}
+        await backend.client.set(LEGACY_STATE_KEY, json.dumps({**legacy, "stale": True}))
+        await backend.client.set(LEGACY_VERSION_KEY, 7)
+        await backend.prepare()
+        try:
+            assert await backend.read() == {**DEFAULTS, **legacy, "version": 8}
+            assert not await backend.client.exists(LEGACY_STATE_KEY)
+
+            # Later startups leave the hash alone
+            await backend.update({"zoom_level": 3})
+            await make_backend(server, cache=False).prepare()
+            assert (await backend.read())["zoom_level"] == 3
+        finally:
+            await backend.close()
+
+    asyncio.run(run())
+
+
+def test_legacy_state_blob_never_overwrites_newer_state():
+    async def run():
+        backend = make_backend(fakeredis.FakeServer(), cache=False)
+        await backend.prepare()
+        try:
+            await backend.update({"zoom_level": 9})
+            await backend.client.set(LEGACY_STATE_KEY, json.dumps({"zoom_level": 15}))
+            await backend.prepare()
+            assert await backend.read() == {**DEFAULTS, "zoom_level": 9, "version": 1}
+            assert not await backend.client.exists(LEGACY_STATE_KEY)
+        finally:
+            await backend.close()
+
+    asyncio.run(run())
+
+
+def test_backends_must_implement_the_abstract_methods():
+    with pytest.raises(TypeError):
+        StateBackend(DEFAULTS, 3600)
+    with pytest.raises(TypeError):
+        Subscription()
+
+
+def test_etag_if_match_and_if_none_match(client):
+    response = client.get("/state")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag == '"0"'
+    assert client.get("/state", headers={"If-None-Match": etag}).status_code == 304
+
+    response = client.post("/filters", json=["clinic"], headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"1"'
+
+    # The old ETag no longer matches: the write is refused with the current one
+    response = client.post("/filters", json=["hospital"], headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert response.headers["etag"] == '"1"'
+    assert response.json()["detail"]["version"] == 1
+
+    response = client.get("/state", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["selected_fclasses"] == ["clinic"]
+    assert client.post("/filters", json=[], headers={"If-Match": "not-a-tag"}).status_code == 400
@@ -0,0 +1,24 @@
+"""File change detection, with file system events and by polling"""
+
+import threading
+import time
+
+import pytest
+
+from watcher import FileWatcher
+
+
+@pytest.mark.parametrize("use_events", [True, False])
+def test_change_is_reported_once_settled(tmp_path, use_events):
+    path = tmp_path / "layer.geojson"
+    path.write_text("{}")
+    changed = threading.Event()
+    watcher = FileWatcher([path], changed.set, interval=0.05, debounce=0.05, use_events=use_events).start()
+    try:
+        assert watcher.mode == ("events" if use_events else "polling")
+        # give the event watcher time to subscribe before writing
+        time.sleep(0.2)
+        path.write_text('{"type": "FeatureCollection"}')
+        assert changed.wait(5)
+    finally:
+        watcher.stop()
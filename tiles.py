@@ -0,0 +1,135 @@
+"""Mapbox Vector Tile rendering for the resident dataset.
+
+Tiles are addressed in the usual web-mercator XYZ scheme. Each tile only
+touches the rows the spatial index returns for its extent; geometries are
+taken from the dataset's LOD band for the tile's zoom, projected, clipped to
+the tile (plus a small buffer) and quantized to the tile's integer grid by the
+encoder.
+"""
+
+import math
+from typing import List, Optional, Tuple
+
+import mapbox_vector_tile
+import numpy as np
+import shapely
+
+from cache import LRUCache
+from dataset import Dataset, DatasetDiff
+
+LAYER_NAME = "facilities"
+EXTENT = 4096
+BUFFER = 64  # tile units of overlap so strokes don't show seams
+MAX_ZOOM = 22
+
+EARTH_RADIUS = 6378137.0
+ORIGIN_SHIFT = math.pi * EARTH_RADIUS
+
+TILE_CACHE_ENTRIES = 4096  # per layer
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Web-mercator bounds (minx, miny, maxx, maxy) of an XYZ tile."""
+    size = 2 * ORIGIN_SHIFT / (1 << z)
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def to_mercator(coords: np.ndarray) -> np.ndarray:
+    """Vectorized lon/lat -> web-mercator metres, for ``shapely.transform``."""
+    lon = np.radians(coords[:, 0])
+    lat = np.radians(np.clip(coords[:, 1], -85.05112878, 85.05112878))
+    return np.column_stack(
+        (EARTH_RADIUS * lon, EARTH_RADIUS * np.log(np.tan(math.pi / 4 + lat / 2)))
+    )
+
+
+def to_lonlat(mx: float, my: float) -> Tuple[float, float]:
+    lon = mx / ORIGIN_SHIFT * 180.0
+    lat = math.degrees(2 * math.atan(math.exp(my / EARTH_RADIUS)) - math.pi / 2)
+    return lon, lat
+
+
+def fit_zoom(bounds: Tuple[float, float, float, float], width: int = 800, height: int = 500) -> int:
+    """Largest whole zoom at which lon/lat ``bounds`` fit a ``width`` x ``height`` px map."""
+    (x0, y0), (x1, y1) = to_mercator(np.array([bounds[:2], bounds[2:]], dtype=float))
+    zooms = [MAX_ZOOM]
+    for span, pixels in ((x1 - x0, width), (y1 - y0, height)):
+        if span > 0:
+            zooms.append(math.floor(math.log2(pixels / 256 * 2 * ORIGIN_SHIFT / span)))
+    return max(0, min(zooms))
+
+
+def tile_clip(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Web-mercator bounds of a tile plus its ``BUFFER``."""
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    pad = (maxx - minx) * BUFFER / EXTENT
+    return (minx - pad, miny - pad, maxx + pad, maxy + pad)
+
+
+def clip_lonlat(clip: Tuple[float, float, float, float]) -> Tuple[float, float, float, float]:
+    west, south = to_lonlat(clip[0], clip[1])
+    east, north = to_lonlat(clip[2], clip[3])
+    return (west, south, east, north)
+
+
+def render_tile(
+    dataset: Dataset, z: int, x: int, y: int, fclasses: Optional[List[str]] = None
+) -> bytes:
+    """Encode one tile. Returns ``b""`` for tiles with no features."""
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    clip = tile_clip(z, x, y)
+
+    rows = dataset.query_bbox(clip_lonlat(clip), fclasses)
+    if len(rows) == 0:
+        return b""
+
+    geoms = shapely.transform(dataset.lod.for_zoom(z)[rows], to_mercator)
+    geoms = shapely.clip_by_rect(geoms, *clip)
+    features = []
+    for row, geom in zip(rows, geoms):
+        if geom is None or geom.is_empty:
+            continue
+        props = dataset.feature(row, geometry=False)["properties"]
+        features.append(
+            {"geometry": geom, "properties": {k: v for k, v in props.items() if v is not None}}
+        )
+    if not features:
+        return b""
+
+    return mapbox_vector_tile.encode(
+        [{"name": LAYER_NAME, "features": features}],
+        default_options={"quantize_bounds": (minx, miny, maxx, maxy), "extents": EXTENT},
+    )
+
+
+def get_tile(
+    dataset: Dataset,
+    z: int,
+    x: int,
+    y: int,
+    cache: LRUCache,
+    fclasses: Optional[List[str]] = None,
+) -> bytes:
+    """Cached ``render_tile``; a new dataset version keeps only what ``retain_tiles`` kept.
+
+    Each dataset needs a ``cache`` of its own.
+    """
+    cache.ensure_version(dataset.version)
+    key = (z, x, y, tuple(sorted(set(fclasses))) if fclasses is not None else None)
+    tile = cache.get(key)
+    if tile is None:
+        tile = render_tile(dataset, z, x, y, fclasses)
+        cache.put(key, tile, dataset.version)
+    return tile
+
+
+def retain_tiles(diff: DatasetDiff, cache: LRUCache):
+    """Keep the cached tiles a dataset change didn't touch for its new version."""
+
+    def unchanged(key) -> bool:
+        z, x, y, fclasses = key
+        return not diff.touches(clip_lonlat(tile_clip(z, x, y)), fclasses)
+
+    cache.retain(diff.previous_version, diff.version, unchanged)
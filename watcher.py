@@ -0,0 +1,109 @@
+"""Background watching of data files for changes.
+
+Uses ``watchfiles`` (inotify on Linux, FSEvents/kqueue elsewhere) and falls
+back to polling mtime/size where it can't be imported.
+"""
+
+import atexit
+import os
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+try:
+    import watchfiles
+except ImportError:  # no wheel for this platform: polling works everywhere
+    watchfiles = None
+
+
+def file_signature(paths: List[Path]) -> Tuple[Optional[Tuple[int, int]], ...]:
+    """(mtime_ns, size) per path, None for a missing one."""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            signature.append(None)
+        else:
+            signature.append((st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+class FileWatcher:
+    """Call ``on_change`` from a background thread whenever one of ``paths`` changes
+
+    Changes are debounced: a file written in several chunks triggers one call
+    once it has been quiet for ``debounce`` seconds. ``on_change`` runs on the
+    watcher thread, so it can take as long as it needs; changes made while it
+    runs trigger one more call afterwards. Paths may not exist yet.
+    """
+
+    def __init__(
+        self,
+        paths: List[Path],
+        on_change: Callable[[], None],
+        interval: float = 1.0,
+        debounce: float = 0.5,
+        use_events: bool = True,
+    ):
+        self.paths = [Path(p).resolve() for p in paths]
+        self.on_change = on_change
+        self.interval = interval
+        self.debounce = debounce
+        self.use_events = use_events and watchfiles is not None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def mode(self) -> str:
+        return "events" if self.use_events else "polling"
+
+    def start(self) -> "FileWatcher":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+            self._thread.start()
+            # a watchfiles thread still running while the interpreter shuts
+            # down crashes it, so stop before then
+            atexit.register(self.stop)
+        return self
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        atexit.unregister(self.stop)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        if self.use_events:
+            self._watch_events()
+        else:
+            self._poll()
+
+    def _watch_events(self):
+        directories = {p.parent for p in self.paths}
+        wanted = set(self.paths)
+        for _ in watchfiles.watch(
+            *directories,
+            watch_filter=lambda change, path: Path(path) in wanted,
+            debounce=int(self.debounce * 1000),
+            stop_event=self._stop,
+            recursive=False,
+        ):
+            self.on_change()
+
+    def _poll(self):
+        seen = file_signature(self.paths)
+        while not self._stop.wait(self.interval):
+            current = file_signature(self.paths)
+            if current == seen:
+                continue
+            # wait for the writer to finish before reporting the change
+            while not self._stop.wait(self.debounce):
+                settled = file_signature(self.paths)
+                if settled == current:
+                    break
+                current = settled
+            seen = current
+            if not self._stop.is_set():
+                self.on_change()
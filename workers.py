@@ -0,0 +1,215 @@
+"""Pre-forked uvicorn workers that share one copy of the data.
+
+``serve()`` binds the listening socket and calls ``prepare()`` in a
+supervising process, then forks the workers from it. Whatever ``prepare()``
+built (datasets, spatial indexes, projected copies, LOD bands) is shared
+copy-on-write by every worker instead of being built again in each, so a
+worker is ready in milliseconds and adds little more than its own heap to
+the total memory. ``gc.freeze()`` before each fork keeps the garbage
+collector, in the workers and the supervisor alike, from writing to, and so
+copying, the shared objects.
+
+The supervisor replaces workers that die and calls ``refresh()`` every
+``interval`` seconds. When that reports a change (say a data file the
+supervisor reloaded), a new set of workers is forked and serving before the
+old ones are told to stop, then ``after_restart()`` runs while the old ones
+finish their requests. SIGHUP replaces them the same way.
+
+Needs ``os.fork``, so POSIX only.
+"""
+
+import gc
+import logging
+import os
+import select
+import signal
+import time
+from typing import Callable, Optional, Set
+
+import uvicorn
+
+logger = logging.getLogger("uvicorn.error")
+
+READY_TIMEOUT = 60.0
+
+
+class Worker(uvicorn.Server):
+    """uvicorn server that tells the supervisor once it is accepting requests"""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b"1")
+        os.close(self.ready_fd)
+
+
+class Supervisor:
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        workers: int,
+        prepare: Callable[[], None],
+        refresh: Optional[Callable[[], bool]] = None,
+        after_restart: Optional[Callable[[], None]] = None,
+        interval: float = 1.0,
+    ):
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Multiple workers need os.fork")
+        self.config = config
+        self.workers = workers
+        self.prepare = prepare
+        self.refresh = refresh
+        self.after_restart = after_restart
+        self.interval = interval
+        self.pids: Set[int] = set()
+        self.socket = None
+        self._stopping = False
+        self._restart_requested = False
+
+    def run(self):
+        self.socket = self.config.bind_socket()
+        start = time.perf_counter()
+        self.prepare()
+        logger.info("Data prepared in %.2fs", time.perf_counter() - start)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGHUP, self._request_restart)
+        try:
+            for _ in range(self.workers):
+                self.spawn()
+            while not self._stopping:
+                time.sleep(self.interval)
+                self.reap()
+                if self._stopping:
+                    break
+                if self._restart_requested or (self.refresh is not None and self.refresh()):
+                    self._restart_requested = False
+                    self.restart()
+        finally:
+            self.stop(*self.pids)
+            self.socket.close()
+
+    def spawn(self) -> Optional[int]:
+        """Fork a worker and wait until it accepts requests; None if it failed to start."""
+        read_fd, write_fd = os.pipe()
+        start = time.perf_counter()
+        # Objects alive now stay frozen in the supervisor too: collecting them
+        # later would write to pages the workers share, copying them
+        gc.collect()
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            status = 1
+            try:
+                Worker(self.config, write_fd).run(sockets=[self.socket])
+                status = 0
+            except Exception:
+                logger.exception("Worker %d crashed", os.getpid())
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        self.pids.add(pid)
+        try:
+            ready, _, _ = select.select([read_fd], [], [], READY_TIMEOUT)
+            ok = bool(ready) and os.read(read_fd, 1) == b"1"
+        finally:
+            os.close(read_fd)
+        if not ok:
+            logger.error("Worker %d failed to start", pid)
+            self.stop(pid)
+            return None
+        logger.info("Worker %d ready in %.1f ms", pid, (time.perf_counter() - start) * 1000)
+        return pid
+
+    def stop(self, *pids: int):
+        """Ask workers to finish their requests and exit, killing any that take too long."""
+        self.terminate(*pids)
+        self.wait(*pids)
+
+    def terminate(self, *pids: int):
+        """Ask workers to stop accepting requests and exit once their current ones are done."""
+        for pid in pids:
+            self.pids.discard(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def wait(self, *pids: int):
+        waiting = set(pids)
+        deadline = time.monotonic() + (self.config.timeout_graceful_shutdown or 30) + 5
+        while waiting and time.monotonic() < deadline:
+            for pid in list(waiting):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    waiting.discard(pid)
+            time.sleep(0.05)
+        for pid in waiting:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+    def restart(self):
+        """Replace every worker: start the new ones, then stop the old ones.
+
+        ``after_restart()`` runs as soon as the old workers stop taking new
+        requests, while they finish the ones they have.
+        """
+        old = list(self.pids)
+        fresh = []
+        for _ in old:
+            pid = None if self._stopping else self.spawn()
+            if pid is None:
+                self.stop(*fresh)  # the old workers keep serving
+                return
+            fresh.append(pid)
+        self.terminate(*old)
+        if self.after_restart is not None:
+            self.after_restart()
+        self.wait(*old)
+
+    def reap(self):
+        """Replace workers that exited on their own."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                break
+            if pid in self.pids and not self._stopping:
+                self.pids.discard(pid)
+                logger.warning("Worker %d exited (status %d)", pid, os.waitstatus_to_exitcode(status))
+        while len(self.pids) < self.workers and not self._stopping:
+            if self.spawn() is None:
+                break  # try again on the next tick
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _request_restart(self, signum, frame):
+        self._restart_requested = True
+
+
+def serve(
+    config: uvicorn.Config,
+    workers: int,
+    prepare: Callable[[], None],
+    refresh: Optional[Callable[[], bool]] = None,
+    after_restart: Optional[Callable[[], None]] = None,
+    interval: float = 1.0,
+):
+    """Run ``config``'s app in ``workers`` processes forked after ``prepare()``"""
+    Supervisor(config, workers, prepare, refresh, after_restart, interval).run()